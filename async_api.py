@@ -0,0 +1,194 @@
+import os
+import asyncio
+import threading
+import concurrent.futures
+import cv2
+import numpy
+from decoder import imread_grayscale, decode_grayscale
+from matching import ENGINES, make_matcher
+from roi import RoiManifest
+from tmpl_cache import TemplateCache
+
+
+class TemplateResult:
+    """
+    Result of one template on one screenshot.
+    """
+
+    def __init__(self, screenshot: str, template: str, hits: [tuple]):
+        """
+        :param screenshot: str, path or name of the screenshot
+        :param template:   str, path to the template
+        :param hits:       list, [(x, y, threshold), ...] or [(x, y, threshold, scale), ...], the best ones first
+        """
+        self.__screenshot = screenshot
+        self.__template = template
+        self.__hits = hits
+
+    def __repr__(self):
+        return f'TemplateResult({os.path.basename(self.__template)!r}, count={self.count}, best={self.best})'
+
+    @property
+    def screenshot(self) -> str:
+        return self.__screenshot
+
+    @property
+    def template(self) -> str:
+        return self.__template
+
+    @property
+    def hits(self) -> [tuple]:
+        return self.__hits
+
+    @property
+    def count(self) -> int:
+        return len(self.__hits)
+
+    @property
+    def found(self) -> bool:
+        return bool(self.__hits)
+
+    @property
+    def best(self) -> tuple:
+        """
+        :return: tuple, the hit with the highest threshold, None if the template is not found
+        """
+        return self.__hits[0] if self.__hits else None
+
+
+class AsyncMatcher:
+    """
+    Asyncio front end of the matching core used by ci.CheckImages: decoding and matching run in the pool of threads,
+    so the event loop is not blocked, and the results are returned as TemplateResult objects. At most
+    `max_concurrency` checks are in flight at once, the rest wait in the event loop. When the awaiting task is
+    cancelled, the check stops before the next template.
+    Usage:
+        async with AsyncMatcher(min_threshold=0.8, max_concurrency=2) as matcher:
+            results = await matcher.match('D:\\Capture\\1.png', 'D:\\Templates')
+            ok_button = results[0].best
+    """
+
+    def __init__(self, min_threshold=0.6, engine='opencv', scales=None, max_concurrency=None, cache_mb=None):
+        """
+        :param min_threshold:   float
+        :param engine:          str, search engine, one of matching.ENGINES
+        :param scales:          list of float, scales of the multi-scale search, None - only the original scale
+        :param max_concurrency: int, maximum number of checks in flight, it is the number of threads too,
+                                None - number of CPUs
+        :param cache_mb:        int or float, memory budget for decoded templates in megabytes, None - default
+        """
+        if engine not in ENGINES:
+            error = f'engine={engine} but it should be one of: {", ".join(ENGINES)}'
+            raise ValueError(error)
+        max_concurrency = max_concurrency or os.cpu_count() or 1
+        if not isinstance(max_concurrency, int) or max_concurrency < 1:
+            error = f'max_concurrency={max_concurrency} but it should be a positive integer'
+            raise ValueError(error)
+
+        self.__min_threshold = min_threshold
+        self.__engine = engine
+        self.__scales = None if not scales or list(scales) == [1.0] else sorted(set(scales))
+        self.__max_concurrency = max_concurrency
+        self.__tmpl_cache = TemplateCache(cache_mb)
+        self.__roi_manifest = RoiManifest()
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency,
+                                                                thread_name_prefix='async-matcher')
+        self.__local = threading.local()   # Matcher of every thread of the pool
+        self.__d_semaphores = dict()       # {event loop: asyncio.Semaphore, ...}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self.__d_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.__max_concurrency)
+            self.__d_semaphores = {loop: semaphore}   # Semaphores of closed loops are not kept
+        return semaphore
+
+    def __matcher(self):
+        matcher = getattr(self.__local, 'matcher', None)
+        if matcher is None:
+            matcher = make_matcher(self.__engine, self.__min_threshold, self.__scales)
+            self.__local.matcher = matcher
+        return matcher
+
+    @staticmethod
+    def __decode_screenshot(screenshot) -> numpy.ndarray:
+        if isinstance(screenshot, str):
+            return imread_grayscale(screenshot)
+        if isinstance(screenshot, (bytes, bytearray, memoryview)):
+            return decode_grayscale(bytes(screenshot))
+        if isinstance(screenshot, numpy.ndarray):
+            if screenshot.ndim == 3:
+                code = cv2.COLOR_BGRA2GRAY if screenshot.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+                return cv2.cvtColor(screenshot, code)
+            return screenshot
+        error = f'screenshot should be a path, the content of the image file or numpy.ndarray, ' \
+                f'not {type(screenshot).__name__}'
+        raise TypeError(error)
+
+    @staticmethod
+    def __template_paths(templates) -> [str]:
+        if isinstance(templates, str):
+            return [path for path, _ in TemplateCache.list_templates(templates)]
+        return list(templates)
+
+    def __match(self, screenshot, templates, cancel_event: threading.Event) -> [TemplateResult]:
+        tmpl_paths = self.__template_paths(templates)
+        scr_img = self.__decode_screenshot(screenshot)
+        scr_name = screenshot if isinstance(screenshot, str) else ''
+        matcher = self.__matcher()
+        results = []
+        try:
+            tmpl_imgs = (self.__tmpl_cache.get(tmpl_path) for tmpl_path in tmpl_paths)
+            rois = [self.__roi_manifest.roi_for(tmpl_path) for tmpl_path in tmpl_paths]
+            for tmpl_path, points in zip(tmpl_paths, matcher.find_all_many(scr_img, tmpl_imgs, rois)):
+                hits = [(int(pt[0][0]), int(pt[0][1]), float(pt[1])) + tuple(float(value) for value in pt[2:])
+                        for pt in sorted(points, key=lambda pt: -pt[1])]
+                results.append(TemplateResult(scr_name, tmpl_path, hits))
+                if cancel_event.is_set():
+                    break
+        finally:
+            matcher.release()
+        return results
+
+    async def match(self, screenshot, templates) -> [TemplateResult]:
+        """
+        Searches the templates on the screenshot without blocking the event loop.
+        :param screenshot: str - path to the screenshot, bytes - content of the image file, numpy.ndarray - grayscale,
+                           BGR or BGRA image, ex.: a frame captured by the test framework
+        :param templates:  str - folder of templates, template file or atlas, list - paths to templates
+        :return: list of TemplateResult in the order of templates
+        """
+        cancel_event = threading.Event()
+        async with self.__semaphore():
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self.__executor, self.__match, screenshot, templates, cancel_event)
+            except asyncio.CancelledError:
+                cancel_event.set()   # The thread cannot be interrupted, it stops before the next template
+                raise
+
+    def close(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+
+__d_default_matchers = dict()   # {(min_threshold, engine, scales): AsyncMatcher, ...}
+
+
+async def match_async(screenshot, templates, min_threshold=0.6, engine='opencv', scales=None) -> [TemplateResult]:
+    """
+    Searches the templates on the screenshot without blocking the event loop, see AsyncMatcher.match(). Checks with
+    the same parameters share one AsyncMatcher with the default concurrency limit.
+    """
+    key = (min_threshold, engine, tuple(scales) if scales else None)
+    matcher = __d_default_matchers.get(key)
+    if matcher is None:
+        matcher = AsyncMatcher(min_threshold, engine, scales)
+        __d_default_matchers[key] = matcher
+    return await matcher.match(screenshot, templates)
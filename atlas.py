@@ -0,0 +1,252 @@
+# Compiles a folder of templates into one atlas file
+# Usage: python atlas.py -t "D:\Templates" [-o "D:\Templates.atlas"]
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import numpy
+from decoder import imread_grayscale_alpha, PrefetchingDecoder
+
+
+class TemplateAtlas:
+    """
+    Packed template library: one file with the raw grayscale pixels of all templates of a folder tree, their shapes,
+    relative paths and content hashes of the source files.
+    Templates with transparent pixels keep their alpha channel too, it is stored after the grayscale pixels.
+    Manifests of the folders (roi.ini, expect.ini) are packed too. The pixels are memory-mapped, so opening the atlas
+    reads only the index, and a template costs nothing until its pixels are touched; all processes which open
+    the atlas share the pages of the file.
+    A template of the atlas is addressed by the virtual path <atlas file>/<relative path>, ex.:
+    D:\\Templates.atlas\\sub\\e.png. TemplateCache, ResultCache, RoiManifest and ExpectationManifest resolve such paths
+    by member(), so an atlas can be used everywhere instead of the folder.
+    File layout: magic, version, size of the index (uint32, uint32, uint64), index in JSON, pixels aligned to
+    `alignment` bytes.
+    """
+
+    extension = '.atlas'
+    extension_list = ['png', 'jpg', 'webp']
+    manifest_list = ['roi.ini', 'expect.ini']
+    magic = b'CIATLAS\0'
+    version = 2
+    alignment = 64
+
+    __header = struct.Struct('<8sIIQ')
+    __lock = threading.Lock()
+    __d_opened = dict()   # {absolute path: ((mtime, size), TemplateAtlas), ...} - atlases opened by this process
+
+    def __init__(self, path: str):
+        """
+        Opens the atlas, use open() to share the opened atlas within the process.
+        """
+        with open(path, 'rb') as f:
+            magic, version, _, index_size = self.__header.unpack(f.read(self.__header.size))
+            if magic != self.magic:
+                error = f'{path} is not a template atlas'
+                raise IOError(error)
+            if version != self.version:
+                error = f'{path} has version {version} but {self.version} is supported, compile it again'
+                raise IOError(error)
+            index = json.loads(f.read(index_size).decode('utf-8'))
+
+        self.__path = path
+        self.__root = index['root']
+        self.__d_entries = {entry['name']: entry for entry in index['templates']}
+        self.__d_files = index['files']
+        data_start = self.__data_start(index_size)
+        data_size = sum(entry['height'] * entry['width'] * (2 if 'alpha' in entry else 1)
+                        for entry in index['templates'])
+        self.__pixels = numpy.memmap(path, dtype=numpy.uint8, mode='r', offset=data_start,
+                                     shape=(data_size,)) if data_size else numpy.zeros(0, dtype=numpy.uint8)
+
+    @classmethod
+    def __data_start(cls, index_size: int) -> int:
+        return -(-(cls.__header.size + index_size) // cls.alignment) * cls.alignment
+
+    @classmethod
+    def open(cls, path: str):
+        """
+        Returns the atlas opened by this process before, opens it again if the file has changed.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        state = (stat.st_mtime_ns, stat.st_size)
+        with cls.__lock:
+            opened = cls.__d_opened.get(path)
+            if opened is None or opened[0] != state:
+                opened = (state, cls(path))
+                cls.__d_opened[path] = opened
+        return opened[1]
+
+    @classmethod
+    def is_atlas(cls, path: str) -> bool:
+        return path.lower().endswith(cls.extension) and os.path.isfile(path)
+
+    @classmethod
+    def member(cls, path: str):
+        """
+        Returns (TemplateAtlas, name inside the atlas) if `path` is a virtual path inside an atlas, otherwise None.
+        """
+        marker = path.lower().find(cls.extension + os.sep)
+        if marker < 0 and os.altsep:
+            marker = path.lower().find(cls.extension + os.altsep)
+        if marker < 0:
+            return None
+        atlas_path = path[:marker + len(cls.extension)]
+        if not os.path.isfile(atlas_path):
+            return None
+        name = path[marker + len(cls.extension) + 1:].replace(os.sep, '/')
+        return cls.open(atlas_path), name
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def root(self) -> str:
+        """
+        :return: str, the folder the atlas was compiled from
+        """
+        return self.__root
+
+    @property
+    def names(self) -> [str]:
+        """
+        :return: list, relative paths of the templates with / as the delimiter, ex.: ['e.png', 'sub/t.png']
+        """
+        return list(self.__d_entries)
+
+    def paths(self) -> [str]:
+        """
+        :return: list, virtual paths of all templates, ex.: ['D:\\Templates.atlas\\e.png', ...]
+        """
+        return [os.path.join(self.__path, *name.split('/')) for name in self.__d_entries]
+
+    def __entry(self, name: str) -> dict:
+        entry = self.__d_entries.get(name)
+        if entry is None:
+            error = f'Template {name} is not in {self.__path}'
+            raise IOError(error)
+        return entry
+
+    def image(self, name: str) -> numpy.ndarray:
+        """
+        Returns the read-only grayscale image of the template, a view of the memory-mapped file.
+        """
+        entry = self.__entry(name)
+        start = entry['offset']
+        return self.__pixels[start:start + entry['height'] * entry['width']].reshape(entry['height'], entry['width'])
+
+    def alpha(self, name: str) -> numpy.ndarray:
+        """
+        Returns the read-only alpha channel of the template, None if the template has no transparent pixels.
+        """
+        entry = self.__entry(name)
+        start = entry.get('alpha')
+        if start is None:
+            return None
+        return self.__pixels[start:start + entry['height'] * entry['width']].reshape(entry['height'], entry['width'])
+
+    def digest(self, name: str) -> str:
+        """
+        :return: str, SHA-1 of the source file, the same as ResultCache.file_hash() of it
+        """
+        return self.__entry(name)['digest']
+
+    def file_text(self, name: str) -> str:
+        """
+        :return: str, content of the packed manifest, ex.: file_text('sub/roi.ini'), None if there is no such file
+        """
+        return self.__d_files.get(name)
+
+    @staticmethod
+    def __file_digest(path: str) -> str:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @classmethod
+    def __decode_source(cls, path: str) -> (numpy.ndarray, numpy.ndarray, str):
+        return imread_grayscale_alpha(path) + (cls.__file_digest(path),)
+
+    @classmethod
+    def compile(cls, folder: str, atlas_path: str, decode_threads=None) -> int:
+        """
+        Packs all templates of the folder tree and their manifests into the atlas file, the file is replaced only
+        when it is written completely.
+        :return: int, number of packed templates
+        """
+        if not os.path.isdir(folder):
+            error = f'{folder} not found'
+            raise IOError(error)
+
+        tmpl_paths, d_files = [], dict()
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for file in sorted(files):
+                path = os.path.join(root, file)
+                name = os.path.relpath(path, folder).replace(os.sep, '/')
+                if file.split('.')[-1].lower() in cls.extension_list:
+                    tmpl_paths.append((name, path))
+                elif file in cls.manifest_list:
+                    with open(path, 'rt', encoding='utf-8') as f:
+                        d_files[name] = f.read()
+
+        entries, images = [], []
+        offset = 0
+        with PrefetchingDecoder(decode_threads) as decoder:
+            decoded = decoder.prefetch(cls.__decode_source, [path for _, path in tmpl_paths])
+            for (name, _), future in zip(tmpl_paths, decoded):
+                img, alpha, digest = future.result()
+                entry = {'name': name,
+                         'height': img.shape[0],
+                         'width': img.shape[1],
+                         'offset': offset,
+                         'digest': digest}
+                images.append(img)
+                offset += img.size
+                if alpha is not None and alpha.min() < 255:
+                    entry['alpha'] = offset
+                    images.append(alpha)
+                    offset += alpha.size
+                entries.append(entry)
+
+        index = json.dumps({'root': os.path.abspath(folder),
+                            'created': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                            'templates': entries,
+                            'files': d_files}, ensure_ascii=False).encode('utf-8')
+        temp_path = atlas_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(cls.__header.pack(cls.magic, cls.version, 0, len(index)))
+            f.write(index)
+            f.write(b'\0' * (cls.__data_start(len(index)) - f.tell()))
+            for img in images:
+                f.write(numpy.ascontiguousarray(img).tobytes())
+        os.replace(temp_path, atlas_path)
+        return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compiles the folder of templates into one atlas file')
+    parser.add_argument('-t', '--templates', type=str, dest="path_to_tmpls", required=True,
+                        help="Folder with template images, subfolders are packed too")
+    parser.add_argument('-o', '--output', type=str, dest="atlas_path",
+                        help="Atlas file, default - <folder>.atlas next to the folder", default='')
+    parser.add_argument('--decode-threads', type=int, dest="decode_threads",
+                        help="Number of threads which decode the templates", default=PrefetchingDecoder.default_threads)
+    options = parser.parse_args()
+
+    atlas_path = options.atlas_path or os.path.normpath(options.path_to_tmpls) + TemplateAtlas.extension
+    started = time.perf_counter()
+    count = TemplateAtlas.compile(options.path_to_tmpls, atlas_path, options.decode_threads)
+    print(f'{count} templates are packed into {atlas_path} in {time.perf_counter() - started:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
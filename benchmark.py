@@ -0,0 +1,539 @@
+# Benchmark of Check Images on synthetic screenshots
+# Usage: python benchmark.py -o report.json [-b baseline.json]
+# Exit code 1 - regressions against the baseline or the fft engine is slower than the opencv one
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import cv2
+import numpy
+import check_images
+import ci
+from matching import ENGINES, TemplateMatcher, PointClusterer, FFTMatcher, PyramidMatcher
+from output import JsonlWriter
+from stage_timer import StageTimer
+from tmpl_cache import TemplateCache
+
+
+class SyntheticCorpus:
+    """
+    The class generates deterministic screenshots with planted templates. Every template is a unique smooth random
+    texture, it is planted into every screenshot 1, 2 or 4 times (the density cycles over templates) without
+    overlapping. Decoy templates are generated the same way but never planted, any hit of them is a false positive.
+    Files are written to `folder`:
+        templates/t00_24x24.png, ..., templates/decoy0_48x32.png, ...
+        screenshots/1080p.png, ...
+        truth.json - {'params': {...}, 'hits': {'1080p.png': {'t00_24x24.png': [[x, y], ...], ...}, ...}}
+    The corpus is generated again only if it does not exist or was generated with other parameters.
+    """
+
+    resolutions = {'1080p': (1920, 1080), '1440p': (2560, 1440), '4k': (3840, 2160)}
+    template_sizes = ((24, 24), (48, 32), (64, 96), (120, 80), (200, 150))
+    densities = (1, 2, 4)
+    truth_name = 'truth.json'
+
+    def __init__(self, folder: str, resolutions=('1080p', '1440p', '4k'), seed=0, templates_per_size=2, decoys=3):
+        """
+        :param folder:             str, folder of the corpus
+        :param resolutions:        iterable, keys of `resolutions`
+        :param seed:               int, seed of the random generator, the same seed gives the same files
+        :param templates_per_size: int, number of planted templates of every size from `template_sizes`
+        :param decoys:             int, number of templates which are not planted
+        """
+        for resolution in resolutions:
+            if resolution not in self.resolutions:
+                error = f'resolution={resolution} but it should be one of {list(self.resolutions)}'
+                raise ValueError(error)
+
+        self.__folder = folder
+        self.__params = {'resolutions': list(resolutions),
+                         'seed': seed,
+                         'templates_per_size': templates_per_size,
+                         'decoys': decoys}
+        self.__d_hits = dict()
+
+    @property
+    def tmpls_folder(self) -> str:
+        return os.path.join(self.__folder, 'templates')
+
+    @property
+    def tmpl_paths(self) -> [str]:
+        return sorted(os.path.join(self.tmpls_folder, name) for name in os.listdir(self.tmpls_folder))
+
+    @property
+    def scr_paths(self) -> [str]:
+        return [os.path.join(self.__folder, 'screenshots', f'{resolution}.png')
+                for resolution in self.__params['resolutions']]
+
+    @property
+    def hits(self) -> dict:
+        """
+        :return: dict, {screenshot file name: {template file name: [(x, y), ...], ...}, ...}, planted templates only
+        """
+        return self.__d_hits
+
+    @staticmethod
+    def __texture(rng: numpy.random.Generator, width: int, height: int, cell: int) -> numpy.ndarray:
+        coarse = rng.uniform(0, 255, (max(2, height // cell), max(2, width // cell)))
+        texture = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+        return numpy.clip(texture, 0, 255)
+
+    def load(self) -> bool:
+        truth_path = os.path.join(self.__folder, self.truth_name)
+        if not os.path.isfile(truth_path):
+            return False
+        with open(truth_path, 'rt', encoding='utf-8') as f:
+            truth = json.load(f)
+        if truth['params'] != self.__params or not all(map(os.path.isfile, self.scr_paths)):
+            return False
+        self.__d_hits = {scr_name: {tmpl_name: [tuple(pt) for pt in points] for tmpl_name, points in d_tmpls.items()}
+                         for scr_name, d_tmpls in truth['hits'].items()}
+        return True
+
+    def generate(self):
+        if self.load():
+            return
+
+        rng = numpy.random.default_rng(self.__params['seed'])
+        os.makedirs(self.tmpls_folder, exist_ok=True)
+        os.makedirs(os.path.dirname(self.scr_paths[0]), exist_ok=True)
+        for name in os.listdir(self.tmpls_folder):
+            os.remove(os.path.join(self.tmpls_folder, name))
+
+        d_templates = dict()   # {file name: image, ...}, planted templates only
+        for idx in range(len(self.template_sizes) * self.__params['templates_per_size']):
+            width, height = self.template_sizes[idx % len(self.template_sizes)]
+            name = f't{idx:02d}_{width}x{height}.png'
+            d_templates[name] = self.__texture(rng, width, height, 4).astype(numpy.uint8)
+            cv2.imwrite(os.path.join(self.tmpls_folder, name), d_templates[name])
+        for idx in range(self.__params['decoys']):
+            width, height = self.template_sizes[idx % len(self.template_sizes)]
+            decoy = self.__texture(rng, width, height, 4).astype(numpy.uint8)
+            cv2.imwrite(os.path.join(self.tmpls_folder, f'decoy{idx}_{width}x{height}.png'), decoy)
+
+        self.__d_hits = dict()
+        for resolution, scr_path in zip(self.__params['resolutions'], self.scr_paths):
+            width, height = self.resolutions[resolution]
+            scr_img = self.__texture(rng, width, height, 16)
+            occupied = []   # [(x, y, width, height), ...]
+            d_planted = dict()
+            for idx, (name, tmpl_img) in enumerate(d_templates.items()):
+                tmpl_h, tmpl_w = tmpl_img.shape
+                d_planted[name] = []
+                for _ in range(self.densities[idx % len(self.densities)]):
+                    for _ in range(1000):
+                        x = int(rng.integers(0, width - tmpl_w))
+                        y = int(rng.integers(0, height - tmpl_h))
+                        if all(x + tmpl_w <= ox or ox + ow <= x or y + tmpl_h <= oy or oy + oh <= y
+                               for ox, oy, ow, oh in occupied):
+                            break
+                    else:
+                        error = f'No free place for {name} on {resolution}, use less templates'
+                        raise ValueError(error)
+                    scr_img[y:y + tmpl_h, x:x + tmpl_w] = tmpl_img
+                    occupied.append((x, y, tmpl_w, tmpl_h))
+                    d_planted[name].append((x, y))
+            scr_img += rng.normal(0, 3, scr_img.shape)   # Sensor noise, planted copies are not exact
+            cv2.imwrite(scr_path, numpy.clip(scr_img, 0, 255).astype(numpy.uint8))
+            self.__d_hits[os.path.basename(scr_path)] = d_planted
+
+        with open(os.path.join(self.__folder, self.truth_name), 'wt', encoding='utf-8') as f:
+            json.dump({'params': self.__params, 'hits': self.__d_hits}, f, indent=1)
+
+
+class _NullConsole:
+    """
+    Replaces wx.TextCtrl for ci.CheckImages, the text is dropped.
+    """
+
+    def AppendText(self, text: str):
+        pass
+
+
+class Benchmark:
+    """
+    The class times every stage of the search on the corpus and checks the accuracy of every engine. Stages are
+    decode (screenshot and templates), match (correlation map), peaks (candidate points), cluster (one point per
+    occurrence) and output (JSONL records), plus search - the whole matcher of every engine and end_to_end - the run
+    of check_images.CheckImages and ci.CheckImages with the stages recorded by their own StageTimer. Every time is
+    the minimum of `repeat` runs in seconds.
+    A found point is a true positive if it lies within `tolerance` pixels from a planted one, every planted point is
+    counted once. The pyramid engine is also compared with the exhaustive search point by point
+    (PyramidMatcher.recall_report): a point of the exhaustive search is recalled if the pyramid search found it with
+    the threshold which differs not more than `precision`.
+    The speedup of every engine is the search time of the opencv engine divided by the search time of the engine on
+    every resolution, the fft engine is meant to be faster on all of them, see check_speedup().
+    """
+
+    report_version = 1
+
+    def __init__(self, corpus: SyntheticCorpus, engines=tuple(ENGINES), min_threshold=0.8, repeat=3, tolerance=2,
+                 precision=0.0001):
+        """
+        :param corpus:        SyntheticCorpus, generated corpus
+        :param engines:       iterable, keys of matching.ENGINES
+        :param min_threshold: float
+        :param repeat:        int, number of runs of every measurement
+        :param tolerance:     int, maximum distance in pixels between found and planted points
+        :param precision:     float, maximum difference of thresholds of the pyramid and the exhaustive search
+        """
+        self.__corpus = corpus
+        self.__engines = list(engines)
+        self.__min_threshold = min_threshold
+        self.__repeat = repeat
+        self.__tolerance = tolerance
+        self.__precision = precision
+        self.__d_timings = dict()   # {'1080p/opencv/match': seconds, ...}
+        self.__d_accuracy = dict()  # {'opencv': {'planted': int, 'found': int, ...}, ...}
+        self.__d_recall = dict()    # {'1080p/t00_24x24.png': {'expected': int, 'recalled': int, ...}, ...}
+
+    def __time(self, key: str, seconds: float):
+        self.__d_timings[key] = min(self.__d_timings.get(key, seconds), seconds)
+
+    def __time_stages(self, key: str, timer: StageTimer):
+        for stage, seconds in timer.totals.items():
+            self.__time(f'{key}/{stage}', seconds)
+
+    def __score(self, key: str, d_found: dict):
+        """
+        :param d_found: dict, {screenshot file name: {template file name: [(x, y), ...], ...}, ...}
+        """
+        planted = found = true_positives = 0
+        for scr_name, d_tmpls in d_found.items():
+            d_planted = self.__corpus.hits[scr_name]
+            for tmpl_name, points in d_tmpls.items():
+                expected = list(d_planted.get(tmpl_name, []))
+                found += len(points)
+                for x, y in points:
+                    for idx, (px, py) in enumerate(expected):
+                        if abs(x - px) <= self.__tolerance and abs(y - py) <= self.__tolerance:
+                            del expected[idx]
+                            true_positives += 1
+                            break
+            planted += sum(len(points) for points in d_planted.values())
+
+        self.__d_accuracy[key] = {'planted': planted,
+                                  'found': found,
+                                  'true_positives': true_positives,
+                                  'recall': true_positives / planted if planted else 1.0,
+                                  'precision': true_positives / found if found else 1.0}
+
+    def __run_stages(self, scr_path: str, tmpl_paths: [str], output_path: str) -> dict:
+        resolution = os.path.splitext(os.path.basename(scr_path))[0]
+
+        started = time.perf_counter()
+        scr_img = TemplateCache.decode(scr_path)
+        tmpl_imgs = [TemplateCache.decode(tmpl_path) for tmpl_path in tmpl_paths]
+        self.__time(f'{resolution}/decode', time.perf_counter() - started)
+
+        d_found = dict()
+        for engine in self.__engines:
+            matcher = ENGINES[engine](self.__min_threshold)
+            started = time.perf_counter()
+            results = list(matcher.find_all_many(scr_img, tmpl_imgs, [None] * len(tmpl_imgs)))
+            self.__time(f'{resolution}/{engine}/search', time.perf_counter() - started)
+            d_found[engine] = {os.path.basename(tmpl_path): [pt[0] for pt in points]
+                               for tmpl_path, points in zip(tmpl_paths, results)}
+
+        # Stages of the exhaustive and FFT engines separately, the pyramid one mixes them on every level
+        for engine in ('opencv', 'fft'):
+            if engine not in self.__engines:
+                continue
+            match_time = peaks_time = cluster_time = 0.0
+            started = time.perf_counter()
+            if engine == 'fft':
+                maps = FFTMatcher(self.__min_threshold).match_many(scr_img, tmpl_imgs)
+            else:
+                maps = [TemplateMatcher.match(scr_img, tmpl_img) for tmpl_img in tmpl_imgs]
+            match_time += time.perf_counter() - started
+            results = []
+            for tmpl_img, searching in zip(tmpl_imgs, maps):
+                height, width = tmpl_img.shape[:2]
+                started = time.perf_counter()
+                peaks = TemplateMatcher.find_peaks(searching, self.__min_threshold, (width, height))
+                peaks_time += time.perf_counter() - started
+                started = time.perf_counter()
+                results.append(PointClusterer(width, height).cluster(peaks))
+                cluster_time += time.perf_counter() - started
+            self.__time(f'{resolution}/{engine}/match', match_time)
+            self.__time(f'{resolution}/{engine}/peaks', peaks_time)
+            self.__time(f'{resolution}/{engine}/cluster', cluster_time)
+
+            if engine == 'opencv':
+                started = time.perf_counter()
+                with JsonlWriter(output_path, quiet=True) as writer:
+                    writer.start_screenshot(scr_path)
+                    for tmpl_path, points in zip(tmpl_paths, results):
+                        hits = [(int(pt[0][0]), int(pt[0][1]), float(pt[1])) for pt in sorted(points)]
+                        writer.write_template(scr_path, tmpl_path, os.path.basename(tmpl_path), hits, 0.0)
+                    writer.end_screenshot()
+                self.__time(f'{resolution}/output', time.perf_counter() - started)
+                os.remove(output_path)
+
+        return d_found
+
+    def __measure_pyramid_recall(self):
+        """
+        Compares the pyramid search with the exhaustive one for every (screenshot, template) pair, the totals are
+        stored with the key 'total'.
+        """
+        matcher = PyramidMatcher(self.__min_threshold)
+        tmpl_imgs = [(os.path.basename(path), TemplateCache.decode(path)) for path in self.__corpus.tmpl_paths]
+        expected = recalled = missed = extra = 0
+        for scr_path in self.__corpus.scr_paths:
+            resolution = os.path.splitext(os.path.basename(scr_path))[0]
+            scr_img = TemplateCache.decode(scr_path)
+            for tmpl_name, tmpl_img in tmpl_imgs:
+                d_report = matcher.recall_report(scr_img, tmpl_img, self.__precision)
+                self.__d_recall[f'{resolution}/{tmpl_name}'] = {'expected': d_report['expected'],
+                                                                'recalled': d_report['recalled'],
+                                                                'recall': d_report['recall'],
+                                                                'missed': len(d_report['missed']),
+                                                                'extra': len(d_report['extra'])}
+                expected += d_report['expected']
+                recalled += d_report['recalled']
+                missed += len(d_report['missed'])
+                extra += len(d_report['extra'])
+            matcher.release()
+
+        self.__d_recall['total'] = {'expected': expected,
+                                    'recalled': recalled,
+                                    'recall': recalled / expected if expected else 1.0,
+                                    'missed': missed,
+                                    'extra': extra}
+
+    def __run_check_images(self, engine: str, output_path: str) -> dict:
+        timer = StageTimer()
+        check = check_images.CheckImages(self.__corpus.tmpls_folder, ' * '.join(self.__corpus.scr_paths),
+                                         self.__min_threshold, cache_mb=None, use_result_cache=False,
+                                         output_format='jsonl', output_path=output_path, quiet=True, engine=engine,
+                                         timer=timer)
+        started = time.perf_counter()
+        check.run()
+        self.__time(f'end_to_end/check_images/{engine}', time.perf_counter() - started)
+        self.__time_stages(f'end_to_end/check_images/{engine}', timer)
+
+        d_found = dict()
+        with open(output_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                points = d_found.setdefault(os.path.basename(record['screenshot']), dict()).setdefault(
+                    os.path.basename(record['template']), [])
+                if record['count']:
+                    points.append((record['x'], record['y']))
+        os.remove(output_path)
+        return d_found
+
+    def __run_ci(self, engine: str, output_path: str):
+        timer = StageTimer()
+        check = ci.CheckImages(self.__corpus.tmpl_paths, self.__corpus.scr_paths, _NullConsole(), self.__min_threshold,
+                               0.0001, 0, False, output_path, engine=engine, use_result_cache=False, timer=timer)
+        with open(os.devnull, 'wt') as devnull, contextlib.redirect_stdout(devnull):   # ci prints the table too
+            started = time.perf_counter()
+            check.run()
+            self.__time(f'end_to_end/ci/{engine}', time.perf_counter() - started)
+        self.__time_stages(f'end_to_end/ci/{engine}', timer)
+
+    def run(self, work_folder: str) -> dict:
+        """
+        :param work_folder: str, folder for temporary output files
+        :return: dict, report
+        """
+        tmpl_paths = self.__corpus.tmpl_paths
+        output_path = os.path.join(work_folder, 'benchmark_output.jsonl')
+        for _ in range(self.__repeat):
+            d_found = {engine: dict() for engine in self.__engines}
+            for scr_path in self.__corpus.scr_paths:
+                for engine, d_tmpls in self.__run_stages(scr_path, tmpl_paths, output_path).items():
+                    d_found[engine][os.path.basename(scr_path)] = d_tmpls
+            for engine in self.__engines:
+                self.__score(engine, d_found[engine])
+
+            for engine in self.__engines:
+                TemplateCache().clear()   # Templates are decoded in every run
+                self.__score(f'check_images/{engine}', self.__run_check_images(engine, output_path))
+                TemplateCache().clear()
+                self.__run_ci(engine, output_path)
+
+        if 'pyramid' in self.__engines:   # The result does not depend on the run, it is measured once
+            self.__measure_pyramid_recall()
+
+        d_speedup = dict()   # {'1080p': {'fft': 1.35, ...}, ...}
+        if 'opencv' in self.__engines:
+            for scr_path in self.__corpus.scr_paths:
+                resolution = os.path.splitext(os.path.basename(scr_path))[0]
+                base = self.__d_timings[f'{resolution}/opencv/search']
+                d_speedup[resolution] = {engine: base / self.__d_timings[f'{resolution}/{engine}/search']
+                                         for engine in self.__engines if engine != 'opencv'}
+
+        return {'version': self.report_version,
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'platform': {'python': platform.python_version(),
+                             'machine': platform.machine(),
+                             'system': platform.system(),
+                             'opencv': cv2.__version__,
+                             'numpy': numpy.__version__},
+                'settings': {'min_threshold': self.__min_threshold,
+                             'precision': self.__precision,
+                             'repeat': self.__repeat,
+                             'tolerance': self.__tolerance,
+                             'engines': self.__engines,
+                             'screenshots': [os.path.basename(path) for path in self.__corpus.scr_paths],
+                             'templates': [os.path.basename(path) for path in tmpl_paths]},
+                'timings': dict(sorted(self.__d_timings.items())),
+                'accuracy': self.__d_accuracy,
+                'speedup': d_speedup,
+                'pyramid_recall': self.__d_recall}
+
+
+def compare(report: dict, baseline: dict, tolerance=0.1, min_seconds=0.005) -> [str]:
+    """
+    Compares the report with the baseline report.
+    :param tolerance:   float, a timing is a regression if it is slower than the baseline more than this share
+    :param min_seconds: float, timings which are shorter in the baseline are not compared, they are noise
+    :return: list of regressions, ex.: ['1080p/opencv/match: 0.120 s, baseline 0.100 s (+20.0%)', ...]
+    """
+    regressions = []
+    for key, seconds in report['timings'].items():
+        base = baseline.get('timings', dict()).get(key)
+        if base is None or base < min_seconds:
+            continue
+        if seconds > base * (1 + tolerance):
+            regressions.append(f'{key}: {seconds:.3f} s, baseline {base:.3f} s ({(seconds / base - 1) * 100:+.1f}%)')
+
+    for key, d_accuracy in report['accuracy'].items():
+        d_base = baseline.get('accuracy', dict()).get(key)
+        if d_base is None:
+            continue
+        for metric in ('recall', 'precision'):
+            if d_accuracy[metric] < d_base[metric] - 1e-9:
+                regressions.append(f'{key} {metric}: {d_accuracy[metric]:.4f}, baseline {d_base[metric]:.4f}')
+
+    d_recall = report.get('pyramid_recall', dict()).get('total')
+    d_base = baseline.get('pyramid_recall', dict()).get('total')
+    if d_recall is not None and d_base is not None and d_recall['recall'] < d_base['recall'] - 1e-9:
+        regressions.append(f'pyramid recall: {d_recall["recall"]:.4f}, baseline {d_base["recall"]:.4f}')
+
+    return regressions
+
+
+def check_speedup(report: dict) -> [str]:
+    """
+    Checks that the fft engine is faster than the opencv one on every resolution of the corpus, it is the only reason
+    to choose it.
+    :return: list of failures, ex.: ['1080p: fft is slower than opencv, speedup 0.85', ...]
+    """
+    return [f'{resolution}: fft is slower than opencv, speedup {d_engines["fft"]:.2f}'
+            for resolution, d_engines in report.get('speedup', dict()).items()
+            if 'fft' in d_engines and d_engines['fft'] < 1]
+
+
+def print_report(report: dict, baseline=None):
+    baseline_timings = baseline.get('timings', dict()) if baseline else dict()
+    key_indent = max(map(len, report['timings'])) + 2
+    print(f'{"STAGE":<{key_indent}}{"SECONDS":>10}{"BASELINE":>12}')
+    for key, seconds in report['timings'].items():
+        base = baseline_timings.get(key)
+        base = f'{base:.4f}' if base is not None else '-'
+        print(f'{key:<{key_indent}}{seconds:>10.4f}{base:>12}')
+
+    print()
+    key_indent = max(map(len, report['accuracy'])) + 2
+    print(f'{"ENGINE":<{key_indent}}{"PLANTED":>8}{"FOUND":>8}{"TP":>8}{"RECALL":>9}{"PRECISION":>11}')
+    for key, d_accuracy in report['accuracy'].items():
+        print(f'{key:<{key_indent}}{d_accuracy["planted"]:>8}{d_accuracy["found"]:>8}'
+              f'{d_accuracy["true_positives"]:>8}{d_accuracy["recall"]:>9.4f}{d_accuracy["precision"]:>11.4f}')
+
+    d_speedup = report.get('speedup')
+    if d_speedup and any(d_speedup.values()):
+        print()
+        print('Speedup of the search against the opencv engine:')
+        engines = list(next(iter(d_speedup.values())))
+        print(f'{"RESOLUTION":<12}' + ''.join(f'{engine.upper():>10}' for engine in engines))
+        for resolution, d_engines in d_speedup.items():
+            print(f'{resolution:<12}' + ''.join(f'{d_engines[engine]:>10.2f}' for engine in engines))
+
+    d_recall = report.get('pyramid_recall')
+    if d_recall:
+        print()
+        print(f'Pyramid against exhaustive search, precision {report["settings"]["precision"]}:')
+        key_indent = max(map(len, d_recall)) + 2
+        print(f'{"PAIR":<{key_indent}}{"EXPECTED":>9}{"RECALLED":>9}{"MISSED":>8}{"EXTRA":>7}{"RECALL":>9}')
+        for key, d_pair in d_recall.items():
+            print(f'{key:<{key_indent}}{d_pair["expected"]:>9}{d_pair["recalled"]:>9}{d_pair["missed"]:>8}'
+                  f'{d_pair["extra"]:>7}{d_pair["recall"]:>9.4f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of Check Images on synthetic screenshots')
+    parser.add_argument('-d', '--corpus', type=str, dest="corpus_dir",
+                        help="Folder of the synthetic corpus, it is generated if it does not exist",
+                        default='benchmark_corpus')
+    parser.add_argument('-r', '--resolutions', type=str, dest="resolutions",
+                        help="Resolutions of screenshots, comma separated: " + ', '.join(SyntheticCorpus.resolutions),
+                        default='1080p,1440p,4k')
+    parser.add_argument('-s', '--seed', type=int, dest="seed",
+                        help="Seed of the corpus, the same seed gives the same files", default=0)
+    parser.add_argument('-e', '--engines', type=str, dest="engines",
+                        help="Engines, comma separated: " + ', '.join(ENGINES), default=','.join(ENGINES))
+    parser.add_argument('-n', '--min', type=float, dest="min_threshold",
+                        help="Minimum threshold value", default=0.8)
+    parser.add_argument('-p', '--precision', type=float, dest="precision",
+                        help="Maximum difference of thresholds of the pyramid and the exhaustive search in the recall "
+                             "report of the pyramid engine", default=0.0001)
+    parser.add_argument('--repeat', type=int, dest="repeat",
+                        help="Number of runs, the minimum time is reported", default=3)
+    parser.add_argument('-o', '--output', type=str, dest="report_path",
+                        help="File the JSON report is saved to", default='')
+    parser.add_argument('-b', '--baseline', type=str, dest="baseline_path",
+                        help="JSON report to compare with, the exit code is 1 if there are regressions", default='')
+    parser.add_argument('--tolerance', type=float, dest="tolerance",
+                        help="Allowed slowdown against the baseline, 0.1 - 10%%", default=0.1)
+    options = parser.parse_args()
+
+    engines = options.engines.split(',')
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f'unknown engine {engine}, it should be one of: {", ".join(ENGINES)}')
+
+    corpus = SyntheticCorpus(options.corpus_dir, options.resolutions.split(','), options.seed)
+    corpus.generate()
+    report = Benchmark(corpus, engines, options.min_threshold, options.repeat,
+                       precision=options.precision).run(options.corpus_dir)
+
+    baseline = None
+    if options.baseline_path:
+        with open(options.baseline_path, 'rt', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if options.report_path:
+        with open(options.report_path, 'wt', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+
+    failures = check_speedup(report)
+    if failures:
+        print()
+        print('FFT ENGINE IS SLOWER:')
+        print('\n'.join(failures))
+
+    if baseline is not None:
+        regressions = compare(report, baseline, options.tolerance)
+        print()
+        if regressions:
+            print('REGRESSIONS:')
+            print('\n'.join(regressions))
+            sys.exit(1)
+        print('No regressions')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
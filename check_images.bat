@@ -12,17 +12,79 @@ REM этими символами: <пробел><звездочка><пробе
 REM 	Диапазон порога для поиска лежит в диапазоне min ... 1.0. Параметр HOME_DIR - это папка, где лежит
 REM файл check_images.py. Вывод информации происходит в консоль и в файл thresholds.txt по пути HOME_DIR. Информация
 REM на каждом прогоне добавляется в конец файла (он не создается каждый раз новый).
+REM 	Область скриншота, в которой ищется шаблон, можно задать в имени файла шаблона (button@x,y,ширина,высота.png)
+REM или в файле roi.ini в папке шаблона (секция - имя файла, ключи x, y, width, height).
+REM 	С ключом --expect программа проверяет, что каждый шаблон найден столько раз, сколько указано в файле expect.ini
+REM в папке шаблона (секция - имя файла, ключи count или min_count и max_count; по умолчанию - хотя бы один раз).
+REM Проверка останавливается на первом ненайденном шаблоне, код возврата: 0 - успех, 1 - провал, 2 - ошибка.
+REM 	Большую папку шаблонов можно один раз упаковать в атлас: python atlas.py -t "%TEMPLATES%" (рядом с папкой
+REM появится файл <папка>.atlas) и передавать в -t путь к атласу, тогда картинки шаблонов не читаются при старте.
+REM 	Если запущен сервис поиска (check_images_service.bat), шаблоны уже лежат в его памяти, и при USE_SERVICE=1
+REM вместо check_images.py вызывается тонкий клиент client.py: он не загружает OpenCV и шаблоны, а отправляет
+REM сервису пути скриншотов. Результаты добавляются в thresholds.jsonl (или thresholds.csv с ключом -f csv).
+REM 	Запись экрана (mp4, avi, mkv, mov, wmv, webm) можно проверять напрямую, без выгрузки кадров в png:
+REM --video "запись.mp4" вместо -i, каждый N-й кадр задается ключом --stride N. Результаты подписываются временем кадра
+REM (запись.mp4@00:01:02.480). Кадр, который не изменился с предыдущего, не проверяется - повторяются его результаты.
+REM 	Если соседние скриншоты отличаются небольшой областью, ключ --incremental ищет шаблоны заново только вокруг
+REM изменившихся областей (только движок opencv без масштабов). Ключ --verify-incremental дополнительно ищет каждый шаблон
+REM по всему скриншоту и выводит шаблоны, результаты которых отличаются (код возврата 1).
+REM 	Прозрачные пиксели шаблонов png и webp (альфа-канал) не сравниваются со скриншотом, поэтому фон под иконкой
+REM не влияет на порог. Маска строится один раз при чтении шаблона. Атлас нужно пересобрать (версия 2).
+REM 	Ключ --colour bgr (или hsv) различает кнопки одной формы, но разного цвета: найденные в оттенках серого точки
+REM дополнительно сравниваются с шаблоном по каждому каналу цвета, оценка худшего канала выводится в колонке COLOUR,
+REM точки с оценкой ниже --min-colour отбрасываются. Не работает с атласом и видео.
+REM 	В большой библиотеке шаблонов одинаковые картинки (одна иконка в нескольких подпапках, png и webp) с ключом
+REM --dedup exact ищутся один раз, их результаты выводятся для каждого файла. С --dedup near так же группируются
+REM почти одинаковые шаблоны (например, пересохраненные с другим качеством jpg), пороги могут отличаться в последнем
+REM знаке. Хеши шаблонов хранятся в check_images.index.sqlite рядом с файлом результатов и пересчитываются только
+REM для измененных файлов.
 
 SET HOME_DIR=D:\My_documents\Programming\Python\Check Images
 SET TEMPLATES=F:\work\autotest\tests\launcher\l_screens\games\393
 SET SCREENSHOT=E:\Video edit\Capture\bandicam 2022-12-29 14-21-03-483.png * E:\Video edit\Capture\bandicam 2022-12-29 14-22-18-041.png
+SET USE_SERVICE=0
 
 REM All parameters:
-REM -t, --templates - path to one image file or folder with image files, required parameter
+REM -t, --templates - path to one image file or folder with image files or atlas file (atlas.py), required parameter
 REM -i, --image     - path to screen image(-s) where templates will be searched, path can be one or several, delimiter is ' * ', required parameter
 REM -n, --min       - minimum threshold value in range, default=0.6, optional parameter
 REM -p, --precision - the precision with which templates will be searched in the screen image, default=0.0001, optional parameter
+REM -c, --cache-mb  - memory budget for decoded templates in megabytes, default=512, optional parameter
+REM -w, --workers   - number of processes the templates are searched in, default=1, optional parameter
+REM --no-cache      - do not use the result cache (check_images.cache.sqlite next to thresholds.txt), optional parameter
+REM --watch         - folder where new screenshots are checked as soon as they appear, instead of -i, optional parameter
+REM -f, --format    - format of the output: table, jsonl or csv, default=table, optional parameter
+REM -o, --output    - file the results are added to, default=thresholds.txt (.jsonl, .csv), optional parameter
+REM -q, --quiet     - do not print results to the console, optional parameter
+REM -e, --engine    - search engine: opencv, fft or pyramid, default=opencv, optional parameter
+REM -s, --scales    - scales the templates are searched at, ex.: 1,1.25,1.5 or 0.8:1.5:0.1, default=1, optional parameter
+REM --timings       - print the time of every stage of the search and the slowest templates, optional parameter
+REM --trace         - file the stage times are saved to in Chrome trace-event format, optional parameter
+REM --profile       - run under cProfile and save the statistics to the file, default=check_images.prof, optional parameter
+REM -m, --memory-mb - memory budget for decoded screenshots in megabytes, the next ones are decoded in advance while they fit, default=256, optional parameter
+REM --decode-threads - number of threads which decode the next screenshots and templates in advance, default=4, optional parameter
+REM --expect        - pass/fail check by expect.ini, stops at the first failed template, exit code 0 - passed, 1 - failed, 2 - error, optional parameter
+REM --video         - video file whose frames are checked instead of screenshots, instead of -i, optional parameter
+REM --stride        - every N-th frame of the video is checked, default=1, optional parameter
+REM --incremental   - search the templates again only around the areas changed since the previous screenshot, opencv engine only, optional parameter
+REM --verify-incremental - incremental search checked against the full search of every template, exit code 1 on differences, optional parameter
+REM --colour        - check the found points in colour: bgr or hsv, the score is added in the COLOUR column, optional parameter
+REM --min-colour    - points with the lower colour score are dropped, default=0.9, optional parameter
+REM --dedup         - search duplicates of templates once: exact or near, the index is check_images.index.sqlite next to the output, optional parameter
 
-python "%HOME_DIR%\check_images.py" -t "%TEMPLATES%" -i "%SCREENSHOT%"
+REM Parameters of client.py:
+REM -i, --image     - path to screen image(-s), delimiter is ' * ', required parameter
+REM -s, --set       - name of the template set of the service, default=default, optional parameter
+REM --port          - port of the service, default=8765, optional parameter
+REM --upload        - send the content of screenshots instead of their paths, optional parameter
+REM -f, --format    - format of the output: jsonl or csv, default=jsonl, optional parameter
+REM -o, --output    - file the results are added to, default=thresholds.jsonl (.csv), optional parameter
+REM -q, --quiet     - do not print results to the console, optional parameter
+
+IF "%USE_SERVICE%"=="1" (
+    python "%HOME_DIR%\client.py" -i "%SCREENSHOT%"
+) ELSE (
+    python "%HOME_DIR%\check_images.py" -t "%TEMPLATES%" -i "%SCREENSHOT%"
+)
 
 pause
\ No newline at end of file
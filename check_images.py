@@ -2,10 +2,30 @@
 # Version 1.2.1
 
 import argparse
-import cv2
+import cProfile
+import pstats
 import numpy
 import os
 import datetime
+import sys
+import time
+import traceback
+from tmpl_cache import TemplateCache
+from tmpl_index import TemplateIndex
+from matching import ENGINES, MultiScaleMatcher, make_matcher
+from incremental import IncrementalMatcher
+from parallel import ParallelMatcher
+from result_cache import ResultCache
+from roi import RoiManifest
+from expect import ExpectationManifest
+from watcher import ScreenshotWatcher
+from screenshots import ScreenshotStream
+from video import VideoFrame, VideoFrameStream
+from colour import ColourVerifier
+from decoder import imread_grayscale, PrefetchingDecoder
+from atlas import TemplateAtlas
+from output import OutputWriter, JsonlWriter, CsvWriter
+from stage_timer import StageTimer, NULL_TIMER
 
 
 class InitServiceOutputInfo:
@@ -14,16 +34,20 @@ class InitServiceOutputInfo:
     to the console and to the file.
     """
 
-    def __init__(self, tmpls_dict: dict, path_to_tmpls: tuple, precision: float):
+    def __init__(self, tmpls_dict: dict, path_to_tmpls: tuple, precision: float, with_scale=False, with_colour=False):
         """
         :param tmpls_dict:    dict, contains pairs - {path to template images: list of images, ...}
         :param path_to_tmpls: tuple, 2 items: 0 - str, path to one image file or folder with image files, folder
                               1 - str, filename if the input is one file, else - empty string
         :param precision:     float
+        :param with_scale:    bool, add the SCALE column of the multi-scale search
+        :param with_colour:   bool, add the COLOUR column of the colour mode
         """
         self.__tmpls_dict = tmpls_dict
         self.__path_to_tmpls = path_to_tmpls
         self.__prec = precision
+        self.__with_scale = with_scale
+        self.__with_colour = with_colour
 
         self.__img_indent = 0
         self.__count_indent = 0
@@ -50,7 +74,7 @@ class InitServiceOutputInfo:
         right_indent = max_length - string_length - left_indent
         return left_indent, right_indent
 
-    def print_header(self, scr_image: str) -> (str, str, str, str, str):
+    def print_header(self, scr_image: str, to_console=True) -> (str, str, str, str, str):
         tmpls_folder = f'|   FOLDER - {self.__path_to_tmpls[0]}   |'
         screenshot = f'|   SCREENSHOT - {scr_image}   |'
         precision = f'|   PRECISION - {self.__prec}   ///   '
@@ -74,18 +98,24 @@ class InitServiceOutputInfo:
         time_as_str = time.strftime('%Y-%m-%d %H:%M:%S') + f'{" " * right}   |'
         third_string = precision + time_as_str
 
-        self.__count_indents()
+        if self.__img_indent == 0:   # All template names are scanned only once
+            self.__count_indents()
 
         header = f'IMAGE{" " * (self.__img_indent - 5)}|COUNT   |THRESHOLD{" " * (self.__threshold_indent - 9)}|' \
                  f'X{" " * (self.__coord_indent - 1)}|Y{" " * (self.__coord_indent - 1)}'
-
-        print('-' * max_length,
-              tmpls_folder,
-              screenshot,
-              third_string,
-              '-' * max_length,
-              header,
-              '-' * max_length, sep='\n')
+        if self.__with_scale:
+            header += '|SCALE'
+        if self.__with_colour:
+            header += '|COLOUR'
+
+        if to_console:
+            print('-' * max_length,
+                  tmpls_folder,
+                  screenshot,
+                  third_string,
+                  '-' * max_length,
+                  header,
+                  '-' * max_length, sep='\n')
 
         return ('-' * max_length + '\n',
                 tmpls_folder + '\n',
@@ -117,7 +147,8 @@ class OutputInfo:
     """
 
     def __init__(self, path_to_tmpls: str, thr: float, precision: float, tmpl_indent: int, count_indent: int,
-                 thr_indent: int, coord_indent: int, tmpl=None, count=None, x=None, y=None):
+                 thr_indent: int, coord_indent: int, tmpl=None, count=None, x=None, y=None, with_scale=False,
+                 scale=None, with_colour=False, colour=None):
         """
         :param path_to_tmpls: str, path to folder with image templates
         :param thr:           float
@@ -130,6 +161,10 @@ class OutputInfo:
         :param count:         int, count of found templates on screen image
         :param x:             int, x coordinate, where template found on screen image
         :param y:             int, y coordinate, where template found on screen image
+        :param with_scale:    bool, add the scale column of the multi-scale search
+        :param scale:         float, scale at which the template is found
+        :param with_colour:   bool, add the colour column of the colour mode
+        :param colour:        float, colour score of the found template
         """
         self.__path_to_tmpls = path_to_tmpls
         self.__thr = thr
@@ -142,6 +177,10 @@ class OutputInfo:
         self.__count = count if count is not None else ''
         self.__x = x
         self.__y = y
+        self.__with_scale = with_scale
+        self.__scale = scale
+        self.__with_colour = with_colour
+        self.__colour = colour
 
     def __get_tmpl_name_with_subdirs(self, tmpl: str) -> str:
         if tmpl == '':
@@ -149,27 +188,101 @@ class OutputInfo:
         tmpl_name = tmpl.split(self.__path_to_tmpls)[1]
         return tmpl_name[1:]   # Minus \ in begin filename
 
-    def print_one_found_entry(self) -> str:
+    def print_one_found_entry(self, to_console=True) -> str:
         one_entry = f'{self.__tmpl}{" " * (self.__tmpl_indent - len(self.__tmpl))}|' \
                     f'{"  "}{self.__count}{" " * (self.__count_indent - len(str(self.__count)) - 2)}|' \
                     f'{self.__thr}{" " * (self.__threshold_indent - len(str(self.__thr)))}|' \
                     f'{self.__x}{" " * (self.__coord_indent - len(str(self.__x)))}|' \
                     f'{self.__y}{" " * (self.__coord_indent - len(str(self.__y)))}'
-        print(one_entry)
+        if self.__with_scale:
+            one_entry += f'|{self.__scale}'
+        if self.__with_colour:
+            one_entry += f'|{self.__colour}'
+        if to_console:
+            print(one_entry)
 
         return one_entry + '\n'
 
-    def print_one_not_found_entry(self) -> str:
+    def print_one_not_found_entry(self, to_console=True) -> str:
         one_entry = f'{self.__tmpl}{" " * (self.__tmpl_indent - len(self.__tmpl))}|' \
                     f'{"  "}0{" " * (self.__count_indent - 3)}|' \
                     f'Not found{" " * (self.__threshold_indent - 9)}|' \
                     f'None{" " * (self.__coord_indent - 4)}|' \
                     f'None{" " * (self.__coord_indent - 4)}'
-        print(one_entry)
+        if self.__with_scale:
+            one_entry += '|None'
+        if self.__with_colour:
+            one_entry += '|None'
+        if to_console:
+            print(one_entry)
 
         return one_entry + '\n'
 
 
+class TableWriter(OutputWriter):
+    """
+    Output backend which writes the fixed-width table with the header for every screenshot, ex.:
+    IMAGE           |COUNT   |THRESHOLD   |X       |Y
+    exit.webp       |  1     |0.8136      |994     |2
+    """
+
+    def __init__(self, path: str, quiet: bool, tmpls_dict: dict, path_to_tmpls: tuple, precision: float,
+                 with_scale=False, with_colour=False):
+        """
+        :param path:          str, path to the output file
+        :param quiet:         bool, do not print results to the console
+        :param tmpls_dict:    dict, contains pairs - {path to template images: list of images, ...}
+        :param path_to_tmpls: tuple, see InitServiceOutputInfo
+        :param precision:     float
+        :param with_scale:    bool, add the SCALE column of the multi-scale search
+        :param with_colour:   bool, add the COLOUR column of the colour mode
+        """
+        super().__init__(path, quiet, with_scale, with_colour)
+        self.__path_to_tmpls = path_to_tmpls
+        self.__precision = precision
+        self.__output_preparing = InitServiceOutputInfo(tmpls_dict, path_to_tmpls, precision, with_scale,
+                                                        with_colour)
+
+    def start_screenshot(self, scr_path: str):
+        header_info = self.__output_preparing.print_header(scr_path, not self.quiet)
+        self.write(header_info[0])    # ------------------------------------------------------
+        self.write(header_info[1])    # |        FOLDER - D:\Python\Check Images\tf          |
+        self.write(header_info[2])    # |   SCREENSHOT - D:\Python\Check Images\i1_2.png     |
+        self.write(header_info[3])    # |   PRECISION - 0.0001   ///   2023-01-05 16:23:44   |
+        self.write(header_info[0])    # ------------------------------------------------------
+        self.write(header_info[4])    # IMAGE           |COUNT   |THRESHOLD   |X       |Y
+        self.write(header_info[0])    # ------------------------------------------------------
+
+    def write_template(self, scr_path: str, tmpl_path: str, tmpl_name: str, hits: [(int, int, float)],
+                       time_ms: float):
+        if hits:
+            for idx, hit in enumerate(hits):
+                one_entry_to_output = OutputInfo(self.__path_to_tmpls[0], hit[2], self.__precision,
+                                                 self.__output_preparing.img_indent,
+                                                 self.__output_preparing.count_indent,
+                                                 self.__output_preparing.threshold_indent,
+                                                 self.__output_preparing.coord_indent,
+                                                 tmpl_path if 0 == idx else '', len(hits) if 0 == idx else '',
+                                                 hit[0], hit[1], self.with_scale, hit[3] if self.with_scale else None,
+                                                 self.with_colour, hit[-1] if self.with_colour else None)
+                # exit.webp    |  1     |0.8136      |994     |2
+                self.write(one_entry_to_output.print_one_found_entry(not self.quiet))
+        else:
+            one_entry_to_output = OutputInfo(self.__path_to_tmpls[0], 0, self.__precision,
+                                             self.__output_preparing.img_indent,
+                                             self.__output_preparing.count_indent,
+                                             self.__output_preparing.threshold_indent,
+                                             self.__output_preparing.coord_indent,
+                                             tmpl_path, count=0, x=None, y=None, with_scale=self.with_scale,
+                                             with_colour=self.with_colour)
+            # fg_win.webp    |  0     |Not found   |None    |None
+            self.write(one_entry_to_output.print_one_not_found_entry(not self.quiet))
+
+    def end_screenshot(self):
+        self.write('\n\n')
+        super().end_screenshot()
+
+
 class CheckImages:
     """
     The class searches for one template image or all template images from the folder and its subfolders `path_to_tmpls`
@@ -181,32 +294,116 @@ class CheckImages:
     """
 
     __extension_list = ['png', 'jpg', 'webp']
-    __tmpls_dict = dict()   # {'D:\\Python\\Check Images\\tf': ['e.png', 't.png'], ...}
-    __scr_img_gray_list = list()
+    __output_formats = ['table', 'jsonl', 'csv']
 
-    def __init__(self, path_to_tmpls: str, screen_img: str, min_threshold=0.6, precision=0.0001):
+    def __init__(self, path_to_tmpls: str, screen_img: str, min_threshold=0.6, precision=0.0001, cache_mb=None,
+                 workers=1, use_result_cache=True, output_format='table', output_path=None, quiet=False,
+                 engine='opencv', timer=None, scales=None, expect=False, memory_mb=None, decode_threads=None,
+                 incremental=False, verify_incremental=False, colour=None, min_colour=0.9, dedup=None):
         """
         :param path_to_tmpls:      str, path to one image file or folder with image files, folder can be insist
-                                   subfolders with images templates
+                                   subfolders with images templates, or the atlas file compiled by atlas.py
         :param screen_img:         str, one or several paths to screenshot(-s), on which templates should be found,
-                                   delimiter is ' * '
+                                   delimiter is ' * ', None - screenshots will be taken from the folder by run_watch()
         :param min_threshold:      float
         :param precision:          float
+        :param cache_mb:           int or float, memory budget for decoded templates in megabytes, None - default
+        :param workers:            int, number of processes the (screenshot, template) pairs are matched in
+        :param use_result_cache:   bool, take results of unchanged (screenshot, template) pairs from the result cache
+                                   stored next to thresholds.txt
+        :param output_format:      str, 'table' - fixed-width table, 'jsonl' - JSON line per found template,
+                                   'csv' - CSV row per found template
+        :param output_path:        str, file the results are added to, None - thresholds.<txt|jsonl|csv>
+        :param quiet:              bool, do not print results to the console
+        :param engine:             str, search engine: 'opencv' - cv2.matchTemplate, 'fft' - DFT correlation which
+                                   reuses the screenshot spectrum for all templates, 'pyramid' - coarse-to-fine search
+        :param timer:              stage_timer.StageTimer, records the time of every stage of every (screenshot,
+                                   template) pair, None - nothing is recorded
+        :param scales:             list of float, templates are searched at all these scales and the best scale is
+                                   reported, ex.: [1, 1.25, 1.5] for screenshots at 100%, 125% and 150% DPI,
+                                   None - only at the original scale
+        :param expect:             bool, pass/fail mode: every template should be found as many times as expect.ini in
+                                   its folder says (at least once by default), the search of a template stops as soon
+                                   as it is decided and the run stops at the first failed template, screenshots and
+                                   templates which failed recently are checked first, `workers` are not used
+        :param memory_mb:          int or float, memory budget for decoded screenshots (the checked one and the ones
+                                   decoded in advance) in megabytes, None - default, the peak memory is about
+                                   `cache_mb` + `memory_mb` + buffers of the engine for one screenshot
+        :param decode_threads:     int, number of threads which decode the next screenshots and templates in advance,
+                                   None - default
+        :param incremental:        bool, every screenshot is compared with the previous one and templates are searched
+                                   again only around the changed areas (incremental.IncrementalMatcher), only for
+                                   the opencv engine at the original scale, `workers` are not used
+        :param verify_incremental: bool, the incremental search, and every template is also searched on the whole
+                                   screenshot, the templates whose results differ are printed and kept in `mismatches`
+        :param colour:             str, colour mode: the points found on grayscale images are checked in colour
+                                   (colour.ColourVerifier) and get the colour score, 'bgr' or 'hsv', None - grayscale
+                                   only; not for atlases and video
+        :param min_colour:         float, points with the lower colour score are dropped in the colour mode
+        :param dedup:              str, duplicates of templates are searched once and their results are reported for
+                                   all of them (tmpl_index.TemplateIndex): 'exact' - the same pixels, 'near' - also
+                                   nearly the same ones, None - every template is searched; not in the pass/fail mode
         """
         self.__path_to_tmpls = self.__check_templates(path_to_tmpls)   # tuple, 2 items: 0 - str, path to one image
                                                                        # file or folder with image files, folder
                                                                        # 1 - str, filename if the input is one file,
                                                                        # else - empty string
-        self.__screen_img_list = self.__check_screen_img(screen_img)
+        self.__screen_img_list = self.__check_screen_img(screen_img) if screen_img is not None else []
         self.__min_threshold = self.__check_threshold(min_threshold, 'min')
         self.__precision = self.__check_precision(precision)
-        self.__output_preparing = None
-        self.__screen_index = 0
-        self.__height = None
-        self.__width = None
-    
+        self.__output_format = self.__check_output_format(output_format)
+        self.__output_path = output_path if output_path else self.__default_output_path(self.__output_format)
+        self.__quiet = quiet
+        self.__writer = None
+        self.__tmpls_dict = dict()   # {'D:\\Python\\Check Images\\tf': ['e.png', 't.png'], ...}
+        self.__workers = self.__check_workers(workers)
+        self.__cache_mb = cache_mb
+        self.__tmpl_cache = TemplateCache(cache_mb)
+        self.__engine = self.__check_engine(engine)
+        self.__timer = timer or NULL_TIMER
+        self.__scales = self.__check_scales(scales)
+        self.__expect = expect
+        self.__incremental = self.__check_incremental(incremental or verify_incremental)
+        if self.__incremental:
+            self.__matcher = IncrementalMatcher(self.__min_threshold, verify_incremental, self.__timer)
+        else:
+            self.__matcher = make_matcher(self.__engine, self.__min_threshold, self.__scales, self.__timer)
+        self.__colour = self.__check_colour(colour, min_colour)
+        self.__dedup = self.__check_dedup(dedup)
+        self.__d_representatives = dict()   # {template path: path of its duplicate which is searched, ...}
+        self.__pool = None
+        self.__roi_manifest = RoiManifest()   # Regions of the screenshot where templates are searched
+        self.__use_result_cache = use_result_cache
+        self.__result_cache = None
+        self.__memory_mb = memory_mb
+        self.__decode_threads = decode_threads
+        self.__decoder = None
+        self.__screenshot = None   # screenshots.Screenshot, it is decoded only if some template is not in the cache
+        self.__expect_manifest = ExpectationManifest()   # Expected numbers of occurrences of templates
+        self.__failures = []   # [(screenshot, template, found, (min_count, max_count)), ...]
+        self.__previous_frame = None   # video.VideoFrame, the previous checked frame of the video
+        self.__d_frame_points = dict()   # {template path: found points on the previous checked frame, ...}
+        self.__frame_stats = [0, 0, 0, 0]   # Frames, unchanged frames, searched templates, all templates
+        self.__mismatches = []   # [(screenshot, template), ...] - differences of the incremental search
+
+    @property
+    def failures(self) -> list:
+        """
+        :return: list, templates which did not meet their expectations in the pass/fail mode,
+                 [(screenshot, template, number of found occurrences, (min_count, max_count)), ...]
+        """
+        return self.__failures
+
+    @property
+    def mismatches(self) -> list:
+        """
+        :return: list, templates whose incremental results differed from the full search with `verify_incremental`,
+                 [(screenshot, template), ...]
+        """
+        return self.__mismatches
+
     def __check_templates(self, path: str) -> (str, str):
-        if os.path.isdir(path):
+        if os.path.isdir(path) or TemplateAtlas.is_atlas(path):
             return path, ''
 
         elif os.path.isfile(path):
@@ -257,131 +454,492 @@ class CheckImages:
 
         return prec
 
+    def __check_workers(self, workers: int) -> int:
+        if not isinstance(workers, int) or workers < 1:
+            error = f'workers={workers} but it should be a positive integer'
+            raise ValueError(error)
+
+        return workers
+
+    def __check_output_format(self, output_format: str) -> str:
+        if output_format not in self.__output_formats:
+            error = f'output_format={output_format} but it should be one of {self.__output_formats}'
+            raise ValueError(error)
+
+        return output_format
+
+    def __check_engine(self, engine: str) -> str:
+        if engine not in ENGINES:
+            error = f'engine={engine} but it should be one of {list(ENGINES)}'
+            raise ValueError(error)
+
+        return engine
+
+    def __check_scales(self, scales: [float]) -> [float]:
+        if scales is None or list(scales) == [1.0]:
+            return None
+        if isinstance(scales, str):
+            return MultiScaleMatcher.parse_scales(scales)
+        if not scales or any(not (0.1 <= scale <= 10) for scale in scales):
+            error = f'scales={scales} but every scale should be in range 0.1 - 10'
+            raise ValueError(error)
+
+        return sorted(set(float(scale) for scale in scales))
+
+    def __check_incremental(self, incremental: bool) -> bool:
+        if incremental and (self.__engine != 'opencv' or self.__scales is not None or self.__expect):
+            error = 'The incremental search works only with the opencv engine at the original scale and not in ' \
+                    'the pass/fail mode'
+            raise ValueError(error)
+
+        return incremental
+
+    def __check_colour(self, colour: str, min_colour: float) -> ColourVerifier:
+        if colour is None:
+            return None
+        if TemplateAtlas.is_atlas(self.__path_to_tmpls[0]):
+            error = 'The colour mode needs the template files, the atlas keeps only grayscale templates'
+            raise ValueError(error)
+
+        return ColourVerifier(min_colour, colour)
+
+    def __check_dedup(self, dedup: str) -> str:
+        if dedup is None:
+            return None
+        if dedup not in TemplateIndex.modes:
+            error = f'dedup={dedup} but it should be one of {TemplateIndex.modes}'
+            raise ValueError(error)
+        if self.__expect:
+            error = 'Duplicates of templates are not grouped in the pass/fail mode'
+            raise ValueError(error)
+
+        return dedup
+
+    @staticmethod
+    def __default_output_path(output_format: str) -> str:
+        if output_format == 'jsonl':
+            return 'thresholds.' + JsonlWriter.default_extension
+        if output_format == 'csv':
+            return 'thresholds.' + CsvWriter.default_extension
+        return 'thresholds.txt'
+
     def __round_threshold(self, thr: float) -> float:
         multiplier = 10 ** (len(str(self.__precision)) - 2)
         thr = int(thr * multiplier)
         return thr / multiplier
 
     def __find_all_template_files(self):
-        if len(self.__path_to_tmpls[1]) == 0:
+        self.__tmpls_dict = dict()
+        if TemplateAtlas.is_atlas(self.__path_to_tmpls[0]):
+            # Paths of the templates are virtual: <atlas file>\<relative path>, the folders are not walked
+            for tmpl_path in TemplateAtlas.open(self.__path_to_tmpls[0]).paths():
+                folder, tmpl_name = os.path.split(tmpl_path)
+                self.__tmpls_dict.setdefault(folder, []).append(tmpl_name)
+
+        elif len(self.__path_to_tmpls[1]) == 0:
+            # Sorted like in the atlas and TemplateCache, so a folder and its atlas give the templates in one order
             for root, dirs, images in os.walk(self.__path_to_tmpls[0]):
+                dirs.sort()
                 prepared_images = []
-                for img in images:
+                for img in sorted(images):
                     if img.split('.')[-1] in self.__class__.__extension_list:
                         prepared_images.append(img)
-                self.__class__.__tmpls_dict[root] = prepared_images
+                self.__tmpls_dict[root] = prepared_images
 
         else:
-            self.__class__.__tmpls_dict[self.__path_to_tmpls[0]] = [self.__path_to_tmpls[1]]
+            self.__tmpls_dict[self.__path_to_tmpls[0]] = [self.__path_to_tmpls[1]]
+
+    def __current_screenshot(self) -> numpy.ndarray:
+        if not self.__screenshot.decoded:
+            started = self.__timer.start()   # Only the time the search waits for the screenshot
+            scr_img = self.__screenshot.image
+            self.__timer.stop('decode', started)
+            return scr_img
+        return self.__screenshot.image
+
+    def __needs_image(self, scr_path: str) -> bool:
+        if self.__result_cache is None or self.__expect:
+            return True
+        tmpl_paths = self.__template_paths()
+        rois = [self.__roi_manifest.roi_for(tmpl_path) for tmpl_path in tmpl_paths]
+        return not self.__result_cache.has_all(scr_path, tmpl_paths, self.__min_threshold, self.__method(), rois)
+
+    def __check_screenshot(self, screenshot):
+        self.__screenshot = screenshot
+        try:
+            if self.__expect:
+                return self.__check_expectations()
+            self.__find_thresholds_for_all_images()
+            return True
+        finally:
+            self.__matcher.release()
+            if self.__colour is not None:
+                self.__colour.release()
+            if self.__incremental:
+                self.__report_mismatches()
+
+    def __report_mismatches(self):
+        for tmpl_path in self.__matcher.mismatches[len(self.__mismatches):]:
+            print(f'MISMATCH: {os.path.relpath(tmpl_path, self.__path_to_tmpls[0])} on {self.__screenshot.path}: '
+                  f'the incremental search differs from the full one', file=sys.stderr)
+            self.__mismatches.append((self.__screenshot.path, tmpl_path))
+
+    def __find_all_templates(self, tmpl_paths: [str]):
+        """
+        Yields found points for every template on the current screenshot in the order of `tmpl_paths`,
+        ex.: [((849, 69), 0.8667161), ...].
+        """
+        if isinstance(self.__screenshot, VideoFrame):
+            yield from self.__find_frame_templates(tmpl_paths)
+        elif self.__result_cache is not None:
+            rois = [self.__roi_manifest.roi_for(tmpl_path) for tmpl_path in tmpl_paths]
+            yield from self.__result_cache.find_all(self.__screenshot.path, tmpl_paths,
+                                                    self.__min_threshold, self.__method(), self.__match_templates,
+                                                    rois)
+        else:
+            yield from self.__match_templates(tmpl_paths)
+
+    def __find_frame_templates(self, tmpl_paths: [str]):
+        """
+        Yields found points for every template on the current video frame. The points found on the previous checked
+        frame are reused for the templates whose search area has not changed, so a frame which looks the same as
+        the previous one is not searched at all.
+        """
+        frame, previous = self.__screenshot, self.__previous_frame
+        changed = frame.changed_rect(previous) if previous is not None else (0, 0) + frame.image.shape[::-1]
+        searched = [tmpl_path for tmpl_path in tmpl_paths if tmpl_path not in self.__d_frame_points or
+                    changed is not None and self.__search_area_touched(tmpl_path, changed)]
+        self.__frame_stats[0] += 1
+        self.__frame_stats[1] += changed is None
+        self.__frame_stats[2] += len(searched)
+        self.__frame_stats[3] += len(tmpl_paths)
+
+        searched_set = set(searched)
+        found = self.__match_templates(searched)
+        for tmpl_path in tmpl_paths:
+            if tmpl_path in searched_set:
+                self.__d_frame_points[tmpl_path] = next(found)
+            yield self.__d_frame_points[tmpl_path]
+
+    def __search_area_touched(self, tmpl_path: str, rect: (int, int, int, int)) -> bool:
+        """
+        Checks if the region `rect` (x, y, width, height) of the screenshot overlaps the area where the template is
+        searched. The region of interest may be enlarged to the template and moved inside the screenshot
+        (TemplateMatcher.crop), so it is widened by the size of the template at the largest scale.
+        """
+        roi = self.__roi_manifest.roi_for(tmpl_path)
+        if roi is None:
+            return True
+        tmpl_h, tmpl_w = self.__tmpl_cache.get(tmpl_path).shape[:2]
+        scale = max(self.__scales) if self.__scales is not None else 1.0
+        margin_x, margin_y = int(numpy.ceil(tmpl_w * scale)), int(numpy.ceil(tmpl_h * scale))
+        x, y, width, height = rect
+        return (x < roi[0] + roi[2] + margin_x and roi[0] - margin_x < x + width and
+                y < roi[1] + roi[3] + margin_y and roi[1] - margin_y < y + height)
+
+    def __method(self) -> str:
+        if self.__incremental:
+            method = f'TM_CCOEFF_NORMED/{self.__engine}/tiled'   # Values of the tiled map differ in the last digits
+        elif self.__scales is None:
+            method = f'TM_CCOEFF_NORMED/{self.__engine}'
+        else:
+            method = f'TM_CCOEFF_NORMED/{self.__engine}/scales={",".join(map(str, self.__scales))}'
+        if self.__dedup == 'near':   # Members of a group get the thresholds of the searched template
+            method += '/dedup=near'
+        if self.__colour is not None:
+            method += f'/{self.__colour.method}'
+        return method
+
+    def __match_templates(self, tmpl_paths: [str]):
+        rois = [self.__roi_manifest.roi_for(tmpl_path) for tmpl_path in tmpl_paths]
+        if self.__d_representatives:
+            found = self.__search_groups(tmpl_paths, rois)
+        else:
+            found = self.__search_templates(tmpl_paths, rois)
+        if self.__colour is None:
+            yield from found
+            return
+        # Grayscale search is the prefilter, only its points are checked in colour
+        for tmpl_path, points in zip(tmpl_paths, found):
+            yield self.__colour.verify(self.__screenshot.path, tmpl_path, points)
+
+    def __search_groups(self, tmpl_paths: [str], rois: list):
+        """
+        Searches one template of every group of duplicates and yields its points for every member of the group in
+        the order of `tmpl_paths`. Members with other regions of interest are searched separately.
+        """
+        searches = [(self.__d_representatives.get(tmpl_path, tmpl_path), roi)
+                    for tmpl_path, roi in zip(tmpl_paths, rois)]
+        unique = list(dict.fromkeys(searches))
+        d_found = dict(zip(unique, self.__search_templates([path for path, _ in unique], [roi for _, roi in unique])))
+        for search in searches:
+            yield d_found[search]
+
+    def __search_templates(self, tmpl_paths: [str], rois: list):
+        scr_img = self.__current_screenshot()
+        if self.__pool is not None:
+            found = self.__pool.find_all(scr_img, tmpl_paths, rois)
+        elif self.__incremental:
+            found = self.__matcher.find_all_many(scr_img, self.__prefetched_templates(tmpl_paths), rois, tmpl_paths)
+        else:
+            found = self.__matcher.find_all_many(scr_img, self.__prefetched_templates(tmpl_paths), rois)
+        return found
 
-    def __any_img_to_grayscale(self, path: str) -> numpy.ndarray:
-        img_rgb = cv2.imread(path)
-        return cv2.cvtColor(img_rgb, cv2.COLOR_BGR2GRAY)
+    def __prefetched_templates(self, tmpl_paths: [str]):
+        """
+        Yields decoded templates in the order of `tmpl_paths`, the next templates are decoded by the threads of
+        the decoder while the current one is searched.
+        """
+        for tmpl_path, future in zip(tmpl_paths, self.__decoder.prefetch(self.__tmpl_cache.get, tmpl_paths)):
+            started = self.__timer.start()   # Only the time the search waits for the template
+            tmpl_img = future.result()
+            self.__timer.name(tmpl_img, tmpl_path)
+            self.__timer.stop('decode', started, tmpl_img)
+            yield tmpl_img
+
+    def __decode_template(self, tmpl_path: str) -> numpy.ndarray:
+        started = self.__timer.start()
+        tmpl_img = self.__tmpl_cache.get(tmpl_path)
+        self.__timer.name(tmpl_img, tmpl_path)
+        self.__timer.stop('decode', started, tmpl_img)
+        return tmpl_img
+
+    def __template_paths(self) -> [str]:
+        return [tmpl_path + os.sep + tmpl_name
+                for tmpl_path, tmpl_names_list in self.__tmpls_dict.items()
+                for tmpl_name in tmpl_names_list]
 
-    def __find_one_image(self, img: str) -> numpy.ndarray:
-        img = self.__any_img_to_grayscale(img)
-        self.__height, self.__width = img.shape
-        return cv2.matchTemplate(img, self.__class__.__scr_img_gray_list[self.__screen_index], cv2.TM_CCOEFF_NORMED)
+    def __find_thresholds_for_all_images(self):
+        scr_path = self.__screenshot.path
+        self.__timer.set_screenshot(scr_path)
+        self.__writer.start_screenshot(scr_path)
 
-    def __filter_near_points(self, found_tmpl_dict: dict) -> list:
-        prev_pt = None
-        max_correlation = -1
-        pt_with_max_correlation = None
-        all_points_list = []
+        tmpl_paths = self.__template_paths()
 
-        if self.__width <= 18 and self.__height <= 18:
-            search_area = int(self.__width * 2), int(self.__height * 2)
-        else:
-            search_area = self.__width, self.__height
+        started = time.perf_counter()
+        for tmpl_path, all_points_list in zip(tmpl_paths, self.__find_all_templates(tmpl_paths)):
+            hits = [(int(pt[0][0]), int(pt[0][1]), float(self.__round_threshold(pt[1]))) + tuple(pt[2:])
+                    for pt in sorted(all_points_list)]
+            finished = time.perf_counter()
+            self.__writer.write_template(scr_path, tmpl_path, os.path.relpath(tmpl_path, self.__path_to_tmpls[0]),
+                                         hits, (finished - started) * 1000)
+            self.__timer.stop('write', finished, tmpl_path)
+            started = time.perf_counter()
 
-        for pt in sorted(found_tmpl_dict.keys()):
-            if prev_pt is None:  # First point in dict
-                max_correlation = found_tmpl_dict[pt]
-                pt_with_max_correlation = (pt, found_tmpl_dict[pt])
-            else:
-                if abs(pt[0] - prev_pt[0]) < search_area[0] or \
-                        abs(pt[1] - prev_pt[1]) < search_area[1]:
-                    if found_tmpl_dict[pt] > max_correlation:
-                        max_correlation = found_tmpl_dict[pt]
-                        pt_with_max_correlation = (pt, found_tmpl_dict[pt])
-                else:
-                    all_points_list.append(pt_with_max_correlation)
-                    max_correlation = found_tmpl_dict[pt]
-            prev_pt = pt
-        if pt_with_max_correlation is not None:     # Add the last point if any point has been found
-            all_points_list.append(pt_with_max_correlation)
-
-        return list(set(all_points_list))
+        self.__writer.end_screenshot()
 
-    def __find_thresholds_for_all_images(self):
-        with open('thresholds.txt', 'at', encoding='utf-8') as f:
-            header_info = self.__output_preparing.print_header(self.__screen_img_list[self.__screen_index])
-            f.writelines(header_info[0])    # ------------------------------------------------------
-            f.writelines(header_info[1])    # |        FOLDER - D:\Python\Check Images\tf          |
-            f.writelines(header_info[2])    # |   SCREENSHOT - D:\Python\Check Images\i1_2.png     |
-            f.writelines(header_info[3])    # |   PRECISION - 0.0001   ///   2023-01-05 16:23:44   |
-            f.writelines(header_info[0])    # ------------------------------------------------------
-            f.writelines(header_info[4])    # IMAGE           |COUNT   |THRESHOLD   |X       |Y
-            f.writelines(header_info[0])    # ------------------------------------------------------
-
-            for tmpl_path, tmpl_names_list in self.__class__.__tmpls_dict.items():
-                for tmpl_name in tmpl_names_list:
-                    found_tmpl_dict = dict()
-
-                    tmpl_to_find = tmpl_path + os.sep + tmpl_name
-                    searching = self.__find_one_image(tmpl_to_find)
-                    location = numpy.where(searching >= self.__min_threshold)
-                    for pt in zip(*location[::-1]):
-                        if found_tmpl_dict.get(pt) is None:
-                            found_tmpl_dict[pt] = searching[pt[1], pt[0]]
-                    all_points_list = self.__filter_near_points(found_tmpl_dict)   # [((849, 69), 0.8667161), ...]
-                    num_tmpls_found = len(all_points_list)
-
-                    if num_tmpls_found > 0:
-                        iteration = 1
-                        for pt in sorted(all_points_list):
-                            x, y = int(pt[0][0]), int(pt[0][1])
-                            threshold = float(self.__round_threshold(pt[1]))
-                            if iteration > 1:
-                                tmpl_to_find = ''
-                                num_tmpls_found = ''
-
-                            one_entry_to_output = OutputInfo(self.__path_to_tmpls[0], threshold, self.__precision,
-                                                             self.__output_preparing.img_indent,
-                                                             self.__output_preparing.count_indent,
-                                                             self.__output_preparing.threshold_indent,
-                                                             self.__output_preparing.coord_indent,
-                                                             tmpl_to_find, num_tmpls_found, x, y)
-                            f.writelines(
-                                one_entry_to_output.print_one_found_entry())  # exit.webp    |  1     |0.8136      |994     |2
-
-                            iteration += 1
-                    else:
-                        one_entry_to_output = OutputInfo(self.__path_to_tmpls[0], 0, self.__precision,
-                                                         self.__output_preparing.img_indent,
-                                                         self.__output_preparing.count_indent,
-                                                         self.__output_preparing.threshold_indent,
-                                                         self.__output_preparing.coord_indent,
-                                                         tmpl_to_find, count=0, x=None, y=None)
-                        f.writelines(one_entry_to_output.print_one_not_found_entry())  # fg_win.webp    |  0     |Not found   |None    |None
-
-            f.writelines('\n\n')
+    def __order_by_failures(self, paths: [str]) -> [str]:
+        """
+        Returns `paths` in the order they are checked in the pass/fail mode: the ones which failed more often and more
+        recently first, then the newest files.
+        """
+        d_stats = self.__result_cache.failure_stats(paths) if self.__result_cache is not None else dict()
+        return sorted(paths, key=lambda path: tuple(-value for value in d_stats.get(path, (0.0, 0.0))) +
+                      (-self.__modified_at(path),))
+
+    @staticmethod
+    def __modified_at(path: str) -> float:
+        member = TemplateAtlas.member(path)
+        return os.path.getmtime(member[0].path if member is not None else path)
+
+    def __find_first(self, tmpl_path: str, limit: int) -> [((int, int), float)]:
+        if limit == 0:
+            return []
+        roi = self.__roi_manifest.roi_for(tmpl_path)
+
+        def find_missing(tmpl_paths: [str]):
+            scr_img = self.__current_screenshot()
+            if self.__colour is not None:
+                # The first grayscale points may be dropped by the colour check, so all of them are checked
+                return [self.__colour.verify(self.__screenshot.path, path, self.__matcher.find_all(
+                    scr_img, self.__decode_template(path), roi))[:limit] for path in tmpl_paths]
+            return [self.__matcher.find_first(scr_img, self.__decode_template(path), limit, roi)
+                    for path in tmpl_paths]
+
+        if self.__result_cache is not None:
+            return list(self.__result_cache.find_all(self.__screenshot.path, [tmpl_path],
+                                                     self.__min_threshold, f'{self.__method()}/first={limit}',
+                                                     find_missing, [roi]))[0]
+        return find_missing([tmpl_path])[0]
+
+    def __check_expectations(self) -> bool:
+        """
+        Checks the expectations of all templates on the current screenshot, the check stops at the first template which
+        does not meet its expectation.
+        :return: bool, True - all templates meet their expectations
+        """
+        scr_path = self.__screenshot.path
+        self.__timer.set_screenshot(scr_path)
+        self.__writer.start_screenshot(scr_path)
+
+        d_outcomes = dict()   # {path: True - passed, ...}
+        passed = True
+        for tmpl_path in self.__order_by_failures(self.__template_paths()):
+            started = time.perf_counter()
+            expectation = self.__expect_manifest.expectation_for(tmpl_path)
+            hits = [(int(pt[0][0]), int(pt[0][1]), float(self.__round_threshold(pt[1]))) + tuple(pt[2:])
+                    for pt in sorted(self.__find_first(tmpl_path, self.__expect_manifest.limit(expectation)))]
+            finished = time.perf_counter()
+            tmpl_name = os.path.relpath(tmpl_path, self.__path_to_tmpls[0])
+            self.__writer.write_template(scr_path, tmpl_path, tmpl_name, hits, (finished - started) * 1000)
+            self.__timer.stop('write', finished, tmpl_path)
+
+            min_count, max_count = expectation
+            d_outcomes[tmpl_path] = min_count <= len(hits) and (max_count is None or len(hits) <= max_count)
+            if not d_outcomes[tmpl_path]:
+                found = f'more than {max_count}' if max_count is not None and len(hits) > max_count else len(hits)
+                print(f'FAILED: {tmpl_name} on {scr_path}: found {found}, expected '
+                      f'{self.__expect_manifest.describe(expectation)}', file=sys.stderr)
+                self.__failures.append((scr_path, tmpl_path, len(hits), expectation))
+                passed = False
+                break
+
+        self.__writer.end_screenshot()
+        d_outcomes[scr_path] = passed
+        if self.__result_cache is not None:
+            self.__result_cache.record_outcomes(d_outcomes)
+        return passed
+
+    def __start(self, video=False):
+        self.__find_all_template_files()
+        self.__decoder = PrefetchingDecoder(self.__decode_threads)
+        with_scale = self.__scales is not None
+        with_colour = self.__colour is not None
+        if self.__output_format == 'jsonl':
+            self.__writer = JsonlWriter(self.__output_path, self.__quiet, with_scale, with_colour)
+        elif self.__output_format == 'csv':
+            self.__writer = CsvWriter(self.__output_path, self.__quiet, with_scale, with_colour)
+        else:
+            self.__writer = TableWriter(self.__output_path, self.__quiet, self.__tmpls_dict,
+                                        self.__path_to_tmpls, self.__precision, with_scale, with_colour)
+        if self.__workers > 1 and not self.__expect and not self.__incremental:
+            self.__pool = ParallelMatcher(self.__workers, self.__min_threshold, self.__cache_mb, self.__engine,
+                                          self.__scales)
+        if self.__use_result_cache and not video:   # Video frames are not files, they can not be cached
+            self.__result_cache = ResultCache.next_to(self.__output_path)
+        if self.__expect:
+            self.__screen_img_list = self.__order_by_failures(self.__screen_img_list)
+        if self.__dedup is not None:
+            self.__group_duplicates()
+
+    def __group_duplicates(self):
+        tmpl_paths = self.__template_paths()
+        index = TemplateIndex.next_to(self.__output_path)
+        try:
+            self.__d_representatives = index.groups(tmpl_paths, self.__tmpl_cache.get, self.__dedup)
+            rehashed = index.rehashed
+        finally:
+            index.close()
+        if not self.__quiet:
+            print(f'Template index: {len(set(self.__d_representatives.values()))} of {len(tmpl_paths)} templates are '
+                  f'searched, {rehashed} templates hashed again')
+
+    def __stop(self):
+        if self.__writer is not None:
+            self.__writer.close()
+            self.__writer = None
+        if self.__pool is not None:
+            self.__pool.close()
+            self.__pool = None
+        if self.__result_cache is not None:
+            self.__result_cache.close()
+            self.__result_cache = None
+        if self.__decoder is not None:
+            self.__decoder.close()
+            self.__decoder = None
+        self.__screenshot = None
+        if self.__incremental:
+            done, total = self.__matcher.tiles
+            self.__matcher.reset()
+            if not self.__quiet and total:
+                print(f'Incremental search: {done} of {total} tiles of correlation maps calculated')
 
     def run(self):
-        for img in self.__screen_img_list:
-            self.__class__.__scr_img_gray_list.append(self.__any_img_to_grayscale(img))
-        self.__find_all_template_files()
-        self.__output_preparing = InitServiceOutputInfo(self.__class__.__tmpls_dict, self.__path_to_tmpls,
-                                                        self.__precision)
-        for _ in range(len(self.__scr_img_gray_list)):
-            self.__find_thresholds_for_all_images()
-            self.__screen_index += 1
+        """
+        Checks the screenshots one by one, the next screenshots are decoded in advance while the current one is
+        checked, as many as fit into the memory budget.
+        """
+        self.__start()
+        try:
+            for screenshot in ScreenshotStream(self.__screen_img_list, imread_grayscale, self.__memory_mb,
+                                               self.__decoder, self.__needs_image):
+                if not self.__check_screenshot(screenshot):
+                    break
+        finally:
+            self.__stop()
+
+    def run_video(self, video_path: str, stride=1):
+        """
+        Checks every `stride`-th frame of the video file without exporting the frames to image files, the results of
+        every frame are labelled <video file>@<timestamp>. A frame which looks the same as the previous checked one
+        (the same hash of the downsampled frame) is not searched, its results are repeated; on a changed frame only
+        the templates whose region of interest overlaps the changed region are searched again.
+        :param video_path: str, path to the video file, ex.: a bandicam recording
+        :param stride:     int, every `stride`-th frame is checked, 1 - every frame
+        """
+        if self.__expect:
+            error = 'Video can not be checked in the pass/fail mode'
+            raise ValueError(error)
+        if self.__colour is not None:
+            error = 'Video can not be checked in the colour mode, frames are decoded to grayscale'
+            raise ValueError(error)
+        if not os.path.isfile(video_path):
+            error = f'{video_path} not found'
+            raise IOError(error)
+
+        self.__start(video=True)
+        self.__frame_stats = [0, 0, 0, 0]
+        try:
+            for frame in VideoFrameStream(video_path, stride, self.__decoder):
+                self.__check_screenshot(frame)
+                self.__previous_frame = frame   # Only the downsampled frame is kept, the image is released
+        finally:
+            self.__previous_frame = None
+            self.__d_frame_points = dict()
+            self.__stop()
+
+        frames, unchanged, searched, total = self.__frame_stats
+        if not self.__quiet:
+            print(f'{frames} frames checked, {unchanged} of them unchanged, {searched} of {total} templates searched')
+
+    @staticmethod
+    def __watched_paths(watcher: ScreenshotWatcher, poll_interval: float):
+        while True:
+            scr_path = watcher.get(timeout=poll_interval)
+            if scr_path is not None:
+                yield scr_path
+
+    def run_watch(self, folder: str, poll_interval=0.5, queue_size=8):
+        """
+        Checks every new screenshot which appears in the `folder` until Ctrl+C. Templates are decoded once before
+        the start and stay in memory, results of every screenshot are written as soon as it is checked.
+        :param folder:        str, folder where the capture tool saves screenshots
+        :param poll_interval: float, seconds between checks of the folder
+        :param queue_size:    int, maximum number of screenshots waiting to be checked, the watcher does not take new
+                              files while the queue is full
+        """
+        self.__start()
+        for tmpl_path, tmpl_names_list in self.__tmpls_dict.items():
+            for tmpl_name in tmpl_names_list:
+                self.__tmpl_cache.get(tmpl_path + os.sep + tmpl_name)
+
+        try:
+            with ScreenshotWatcher(folder, self.__extension_list, poll_interval, queue_size) as watcher:
+                print(f'Watching {folder}, press Ctrl+C to stop')
+                for screenshot in ScreenshotStream(self.__watched_paths(watcher, poll_interval), imread_grayscale,
+                                                   self.__memory_mb):
+                    self.__check_screenshot(screenshot)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.__stop()
 
 
 def main():
     parser = argparse.ArgumentParser(description='-p or --param <value>')
     parser.add_argument('-t', '--templates', type=str, dest="path_to_tmpls",
-                        help="Path to template images folder, required parameter", default='')
+                        help="Path to template images folder or to the atlas compiled by atlas.py, required parameter",
+                        default='')
     parser.add_argument('-i', '--image', type=str, dest="scr_img_path",
                         help="Path to screen image(-s) where templates will be searched, path can be one or several,"
                              " delimiter is ' * ', required parameter", default='')
@@ -390,10 +948,123 @@ def main():
     parser.add_argument('-p', '--precision', type=float, dest="precision",
                         help="The precision with which templates will be searched in the screen image",
                         default=0.0001)
+    parser.add_argument('-c', '--cache-mb', type=float, dest="cache_mb",
+                        help="Memory budget for decoded templates in megabytes",
+                        default=TemplateCache.default_budget_mb)
+    parser.add_argument('-w', '--workers', type=int, dest="workers",
+                        help="Number of processes the templates are searched in, 1 - without extra processes",
+                        default=1)
+    parser.add_argument('--no-cache', action='store_false', dest="use_result_cache",
+                        help="Do not take results from the result cache and do not store them there")
+    parser.add_argument('--watch', type=str, dest="watch_dir",
+                        help="Folder to watch for new screenshots, they are checked as soon as they appear, "
+                             "-i is not needed then", default='')
+    parser.add_argument('-f', '--format', type=str, dest="output_format", choices=['table', 'jsonl', 'csv'],
+                        help="Format of the output: fixed-width table, JSON lines or CSV", default='table')
+    parser.add_argument('-o', '--output', type=str, dest="output_path",
+                        help="File the results are added to, default - thresholds.<txt|jsonl|csv>", default='')
+    parser.add_argument('-q', '--quiet', action='store_true', dest="quiet",
+                        help="Do not print results to the console")
+    parser.add_argument('-e', '--engine', type=str, dest="engine", choices=list(ENGINES),
+                        help="Search engine: opencv - exhaustive cv2.matchTemplate, fft - DFT correlation which "
+                             "reuses the screenshot spectrum, pyramid - coarse-to-fine search", default='opencv')
+    parser.add_argument('-s', '--scales', type=str, dest="scales",
+                        help="Scales the templates are searched at, comma separated or start:stop:step, ex.: "
+                             "1,1.25,1.5 - templates captured at 100%% DPI on screenshots at 100%%, 125%% and 150%%, "
+                             "the best scale is reported in the SCALE column", default='1')
+    parser.add_argument('--timings', action='store_true', dest="timings",
+                        help="Print the time of every stage of the search and the slowest templates at the end")
+    parser.add_argument('--trace', type=str, dest="trace_path",
+                        help="Save the time of every stage to the file in Chrome trace-event format", default='')
+    parser.add_argument('--profile', type=str, dest="profile_path", nargs='?', const='check_images.prof',
+                        help="Run under cProfile, save the statistics to the file (default - check_images.prof) and "
+                             "print the slowest functions", default='')
+    parser.add_argument('--expect', action='store_true', dest="expect",
+                        help="Pass/fail check: every template should be found as many times as expect.ini in its "
+                             "folder says (at least once by default), the run stops at the first failed template, "
+                             "exit code: 0 - passed, 1 - failed, 2 - error")
+    parser.add_argument('-m', '--memory-mb', type=float, dest="memory_mb",
+                        help="Memory budget for decoded screenshots in megabytes, the next screenshots are decoded in "
+                             "advance while they fit into it", default=ScreenshotStream.default_memory_mb)
+    parser.add_argument('--decode-threads', type=int, dest="decode_threads",
+                        help="Number of threads which decode the next screenshots and templates in advance",
+                        default=PrefetchingDecoder.default_threads)
+    parser.add_argument('--video', type=str, dest="video_path",
+                        help="Video file whose frames are checked instead of screenshots, the results are labelled "
+                             "by the timestamps of the frames, -i is not needed then", default='')
+    parser.add_argument('--stride', type=int, dest="stride",
+                        help="Every N-th frame of the video is checked", default=1)
+    parser.add_argument('--incremental', action='store_true', dest="incremental",
+                        help="Compare every screenshot with the previous one and search the templates again only "
+                             "around the changed areas, opencv engine at the original scale only")
+    parser.add_argument('--verify-incremental', action='store_true', dest="verify_incremental",
+                        help="Incremental search which also searches every template on the whole screenshot and "
+                             "prints the templates whose results differ, exit code 1 if there are any")
+    parser.add_argument('--colour', type=str, dest="colour", choices=ColourVerifier.colour_spaces,
+                        help="Colour mode: the points found on grayscale images are checked in BGR or HSV channel by "
+                             "channel, the score of the worst channel is reported in the COLOUR column")
+    parser.add_argument('--min-colour', type=float, dest="min_colour",
+                        help="Points with the lower colour score are dropped in the colour mode", default=0.9)
+    parser.add_argument('--dedup', type=str, dest="dedup", choices=TemplateIndex.modes,
+                        help="Search duplicates of templates once and report their results for all of them: exact - "
+                             "the same pixels, near - also nearly the same ones (ex.: re-exported with another "
+                             "quality), the index is kept in check_images.index.sqlite next to the output")
     options = parser.parse_args()
-
-    check = CheckImages(options.path_to_tmpls, options.scr_img_path, options.min_threshold, options.precision)
-    check.run()
+    if options.expect and options.watch_dir:
+        parser.error('--expect cannot be used with --watch')
+    if options.video_path and (options.expect or options.watch_dir or options.colour):
+        parser.error('--video cannot be used with --expect, --watch or --colour')
+
+    if options.expect and (options.incremental or options.verify_incremental or options.dedup):
+        parser.error('--expect cannot be used with --incremental, --verify-incremental or --dedup')
+
+    if options.verify_incremental:
+        check = run_from_options(options)
+        if check.mismatches:
+            sys.exit(1)
+        return
+    if not options.expect:
+        run_from_options(options)
+        return
+    try:
+        check = run_from_options(options)
+    except Exception:
+        traceback.print_exc()
+        sys.exit(2)
+    if check.failures:
+        sys.exit(1)
+    print('PASSED')
+
+
+def run_from_options(options) -> CheckImages:
+    timer = StageTimer(trace=bool(options.trace_path)) if options.timings or options.trace_path else None
+    check = CheckImages(options.path_to_tmpls,
+                        None if options.watch_dir or options.video_path else options.scr_img_path,
+                        options.min_threshold, options.precision, options.cache_mb, options.workers,
+                        options.use_result_cache, options.output_format, options.output_path, options.quiet,
+                        options.engine, timer, MultiScaleMatcher.parse_scales(options.scales), options.expect,
+                        options.memory_mb, options.decode_threads, options.incremental, options.verify_incremental,
+                        options.colour, options.min_colour, options.dedup)
+    profiler = cProfile.Profile() if options.profile_path else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        if options.watch_dir:
+            check.run_watch(options.watch_dir)
+        elif options.video_path:
+            check.run_video(options.video_path, options.stride)
+        else:
+            check.run()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(options.profile_path)
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+        if timer is not None and options.timings:
+            print(timer.summary())
+        if timer is not None and options.trace_path:
+            timer.save_trace(options.trace_path)
+    return check
 
 
 if __name__ == '__main__':
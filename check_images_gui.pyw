@@ -3,8 +3,13 @@
 
 import wx
 import os
+import time
+import threading
 from ci import CheckImages
+from matching import MultiScaleMatcher
 from settings import SettingsData, SettingsUtils
+from stage_timer import StageTimer
+from atlas import TemplateAtlas
 
 
 class GUIUtils:
@@ -79,6 +84,15 @@ class DropTarget(wx.FileDropTarget, GUIUtils):
                         short_path = self.format_file_name(full_filename, max_length)
                         self.element.Append(short_path)
                         self.l_filepaths.append((full_filename, short_path))
+            elif TemplateAtlas.is_atlas(filename):
+                # Если это атлас шаблонов (python atlas.py), добавляем все шаблоны из него без чтения картинок
+                for full_filename in TemplateAtlas.open(filename).paths():
+                    if self.check_file_presence(full_filename, self.l_filepaths):
+                        continue
+                    max_length = self.get_max_text_length(self.element, full_filename)
+                    short_path = self.format_file_name(full_filename, max_length)
+                    self.element.Append(short_path)
+                    self.l_filepaths.append((full_filename, short_path))
             else:
                 if not self.check_file_extension(filename):
                     continue
@@ -91,6 +105,89 @@ class DropTarget(wx.FileDropTarget, GUIUtils):
         return True
 
 
+class SearchWorker(threading.Thread):
+    """
+    Поток, в котором выполняется поиск, чтобы окно не зависало во время поиска. Поток подставляется в CheckImages
+    вместо консоли, собирает вывод и прогресс и передает их в окно пачками через wx.CallAfter не чаще, чем раз
+    в interval секунд, чтобы текстовое поле не перерисовывалось на каждую строку.
+    """
+    interval = 0.1
+
+    def __init__(self, window, tmpl_paths, scr_paths, settings):
+        super().__init__(daemon=True)
+        self.window = window
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.chunks = []
+        self.progress = (0, 0)
+        self.last_post = 0.0
+        self.posted = False
+        self.timer = StageTimer() if settings.timings else None
+        self.check = CheckImages(tmpl_paths,
+                                 scr_paths,
+                                 self,
+                                 settings.min_threshold,
+                                 settings.precision,
+                                 settings.direction,
+                                 settings.save_txt,
+                                 settings.save_to,
+                                 settings.cache_mb,
+                                 settings.workers,
+                                 settings.engine,
+                                 progress=self.on_progress,
+                                 cancel_event=self.cancel_event,
+                                 use_result_cache=settings.result_cache,
+                                 timer=self.timer,
+                                 scales=MultiScaleMatcher.parse_scales(settings.scales))
+
+    def AppendText(self, text):
+        # Вызывается из потока поиска вместо wx.TextCtrl.AppendText
+        with self.lock:
+            self.chunks.append(text)
+        self.post()
+
+    def on_progress(self, done, total):
+        with self.lock:
+            self.progress = (done, total)
+        self.post()
+
+    def post(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.posted or now - self.last_post < self.interval:
+                return
+            self.posted = True
+            self.last_post = now
+        wx.CallAfter(self.flush)
+
+    def flush(self):
+        # Выполняется в потоке окна
+        with self.lock:
+            text = ''.join(self.chunks)
+            self.chunks.clear()
+            done, total = self.progress
+            self.posted = False
+
+        if text:
+            self.window.console_text.AppendText(text)
+        if total:
+            self.window.gauge.SetRange(total)
+            self.window.gauge.SetValue(done)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            self.check.run()
+            if self.timer is not None:
+                self.AppendText(self.timer.summary() + '\n')
+        except Exception as e:
+            self.AppendText(f'Ошибка: {e}\n')
+        finally:
+            wx.CallAfter(self.window.on_search_done)
+
+
 class CIMainWindow(wx.Frame, GUIUtils):
     def __init__(self, parent, title):
         super().__init__(parent, title=title, size=(1280, 800))
@@ -101,6 +198,8 @@ class CIMainWindow(wx.Frame, GUIUtils):
         self.last_selected_index_left = wx.NOT_FOUND
         self.last_selected_index_right = wx.NOT_FOUND
 
+        self.search_worker = None
+
         self.settings = SettingsData()
         self.s_utils = SettingsUtils()
         self.s_utils.load_settings()
@@ -189,14 +288,19 @@ class CIMainWindow(wx.Frame, GUIUtils):
         # Добавляем получившиеся элементы в вертикальный сайзер
         vbox.Add(hbox_top, 1, wx.EXPAND)
 
-        # Кнопки "Искать", "Очистить", "Настройки"
+        # Кнопки "Искать", "Стоп", "Очистить", "Настройки" и индикатор прогресса
         hbox_bottom_buttons = wx.BoxSizer(wx.HORIZONTAL)
-        btn_search = wx.Button(panel_top, label="Искать", size=(80, 30))
+        self.btn_search = wx.Button(panel_top, label="Искать", size=(80, 30))
+        self.btn_cancel = wx.Button(panel_top, label="Стоп", size=(80, 30))
+        self.btn_cancel.Disable()
+        self.gauge = wx.Gauge(panel_top, range=100, size=(200, 30))
         btn_clear_bottom = wx.Button(panel_top, label="Очистить", size=(80, 30))
         btn_settings = wx.Button(panel_top, label="Настройки", size=(80, 30))
 
         hbox_bottom_buttons.AddStretchSpacer()
-        hbox_bottom_buttons.Add(btn_search, 0, wx.EXPAND | wx.RIGHT, 15)
+        hbox_bottom_buttons.Add(self.btn_search, 0, wx.EXPAND | wx.RIGHT, 15)
+        hbox_bottom_buttons.Add(self.btn_cancel, 0, wx.EXPAND | wx.RIGHT | wx.LEFT, 15)
+        hbox_bottom_buttons.Add(self.gauge, 0, wx.EXPAND | wx.RIGHT | wx.LEFT, 15)
         hbox_bottom_buttons.Add(btn_clear_bottom, 0, wx.EXPAND | wx.RIGHT | wx.LEFT, 15)
         hbox_bottom_buttons.Add(btn_settings, 0, wx.EXPAND | wx.LEFT, 100)
         hbox_bottom_buttons.AddStretchSpacer()
@@ -241,7 +345,8 @@ class CIMainWindow(wx.Frame, GUIUtils):
         self.Bind(wx.EVT_BUTTON, self.on_minus, btn_minus_right)
         self.Bind(wx.EVT_BUTTON, self.on_clear, btn_clear_right)
 
-        self.Bind(wx.EVT_BUTTON, self.on_search, btn_search)
+        self.Bind(wx.EVT_BUTTON, self.on_search, self.btn_search)
+        self.Bind(wx.EVT_BUTTON, self.on_cancel_search, self.btn_cancel)
         self.Bind(wx.EVT_BUTTON, self.on_clear_bottom, btn_clear_bottom)
         self.Bind(wx.EVT_BUTTON, self.show_settings_dialog, btn_settings)
 
@@ -295,20 +400,30 @@ class CIMainWindow(wx.Frame, GUIUtils):
             self.l_right_selection.clear()
 
     def on_search(self, event):
-        if not self.l_left_selection or not self.l_right_selection:
+        if not self.l_left_selection or not self.l_right_selection or self.search_worker is not None:
             return
 
         scr_paths = [double_path[0] for double_path in self.l_left_selection]
         tmpl_paths = [double_path[0] for double_path in self.l_right_selection]
-        check = CheckImages(tmpl_paths,
-                            scr_paths,
-                            self.console_text,
-                            self.settings.min_threshold,
-                            self.settings.precision,
-                            self.settings.direction,
-                            self.settings.save_txt,
-                            self.settings.save_to)
-        check.run()
+
+        # Поиск выполняется в отдельном потоке, окно остается отзывчивым
+        self.search_worker = SearchWorker(self, tmpl_paths, scr_paths, self.settings)
+        self.btn_search.Disable()
+        self.btn_cancel.Enable()
+        self.gauge.SetValue(0)
+        self.search_worker.start()
+
+    def on_cancel_search(self, event):
+        if self.search_worker is not None:
+            self.search_worker.cancel()
+            self.btn_cancel.Disable()
+
+    def on_search_done(self):
+        # Выводим то, что еще не успело попасть в консоль
+        self.search_worker.flush()
+        self.search_worker = None
+        self.btn_search.Enable()
+        self.btn_cancel.Disable()
 
     def on_clear_bottom(self, event):
         self.console_text.SetValue("")
@@ -356,7 +471,7 @@ class CIMainWindow(wx.Frame, GUIUtils):
 
     def show_settings_dialog(self, event):
         # Создание и отображение диалогового окна
-        dlg = SettingsDialog(self, title="Настройки", size=(640, 400))
+        dlg = SettingsDialog(self, title="Настройки", size=(640, 480))
         dlg.ShowModal()
         dlg.Destroy()
 
@@ -411,6 +526,44 @@ class SettingsDialog(wx.Dialog):
         gbs.Add(self.text_save_to, pos=(5, 0), span=(1, 5), flag=wx.EXPAND | wx.LEFT | wx.RIGHT, border=5)
         gbs.Add(self.btn_browse, pos=(5, 5), flag=wx.LEFT | wx.RIGHT, border=5)
 
+        # Память под кэш шаблонов
+        label_cache_mb = wx.StaticText(panel, label="Кэш шаблонов, МБ")
+        self.spin_cache_mb = wx.SpinCtrl(panel, min=16, max=65536)
+        gbs.Add(label_cache_mb, pos=(6, 0), flag=wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+        gbs.Add(self.spin_cache_mb, pos=(6, 2), span=(1, 3), flag=wx.EXPAND | wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+
+        # Количество процессов для поиска
+        label_workers = wx.StaticText(panel, label="Процессов для поиска")
+        self.spin_workers = wx.SpinCtrl(panel, min=1, max=256)
+        gbs.Add(label_workers, pos=(7, 0), flag=wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+        gbs.Add(self.spin_workers, pos=(7, 2), span=(1, 3), flag=wx.EXPAND | wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+
+        # Выпадающий список движков поиска, порядок как в SettingsUtils.engines
+        label_dropdown_engine = wx.StaticText(panel, label="Движок поиска")
+        choices = ["OpenCV, полный перебор", "Быстрый поиск по пирамиде", "Корреляция через FFT"]
+        self.dropdown_engine = wx.Choice(panel, choices=choices)
+        gbs.Add(label_dropdown_engine, pos=(8, 0), flag=wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+        gbs.Add(self.dropdown_engine, pos=(8, 2), span=(1, 3),
+                flag=wx.EXPAND | wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+
+        # Галочка "Кэш результатов"
+        label_checkbox_result_cache = wx.StaticText(panel, label="Кэш результатов")
+        self.checkbox_result_cache = wx.CheckBox(panel)
+        gbs.Add(label_checkbox_result_cache, pos=(9, 0), flag=wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+        gbs.Add(self.checkbox_result_cache, pos=(9, 2), flag=wx.EXPAND | wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+
+        # Галочка "Время этапов поиска"
+        label_checkbox_timings = wx.StaticText(panel, label="Время этапов поиска")
+        self.checkbox_timings = wx.CheckBox(panel)
+        gbs.Add(label_checkbox_timings, pos=(10, 0), flag=wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+        gbs.Add(self.checkbox_timings, pos=(10, 2), flag=wx.EXPAND | wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+
+        # Масштабы поиска: шаблон снят при 100% DPI, скриншоты при 100%, 125% и 150% - "1, 1.25, 1.5"
+        label_scales = wx.StaticText(panel, label="Масштабы поиска")
+        self.text_scales = wx.TextCtrl(panel)
+        gbs.Add(label_scales, pos=(11, 0), flag=wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+        gbs.Add(self.text_scales, pos=(11, 2), span=(1, 3), flag=wx.EXPAND | wx.LEFT | wx.TOP | wx.RIGHT, border=5)
+
         vbox.Add(gbs, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.TOP, 8)
         gbs.AddGrowableCol(3)
 
@@ -477,6 +630,15 @@ class SettingsDialog(wx.Dialog):
                           "Неправильный порог", wx.OK | wx.ICON_ERROR)
             return
 
+        # Проверка масштабов
+        try:
+            MultiScaleMatcher.parse_scales(self.text_scales.GetValue())
+        except ValueError:
+            wx.MessageBox("Масштабы задаются через запятую (1, 1.25, 1.5)\nили диапазоном начало:конец:шаг (0.8:1.5:0.1),"
+                          "\nкаждый в пределах 0.1...10.",
+                          "Неправильные масштабы", wx.OK | wx.ICON_ERROR)
+            return
+
         # Проверка пути сохранения файла
         if self.checkbox_save_txt.GetValue():
             save_path = self.text_save_to.GetValue()
@@ -493,6 +655,12 @@ class SettingsDialog(wx.Dialog):
         embedded_folders = self.checkbox_embedded_folders.GetValue()
         save_txt = self.checkbox_save_txt.GetValue()
         save_to = self.text_save_to.GetValue()
+        cache_mb = self.spin_cache_mb.GetValue()
+        workers = self.spin_workers.GetValue()
+        engine = self.s_utils.engines[self.dropdown_engine.GetSelection()]
+        result_cache = self.checkbox_result_cache.GetValue()
+        timings = self.checkbox_timings.GetValue()
+        scales = self.text_scales.GetValue().strip()
 
         if (
                 min_threshold != self.d_loaded['min_threshold'] or
@@ -500,10 +668,18 @@ class SettingsDialog(wx.Dialog):
                 direction != self.d_loaded['direction'] or
                 embedded_folders != self.d_loaded['embedded_folders'] or
                 save_txt != self.d_loaded['save_txt'] or
-                save_to != self.d_loaded['save_to']
+                save_to != self.d_loaded['save_to'] or
+                cache_mb != self.d_loaded['cache_mb'] or
+                workers != self.d_loaded['workers'] or
+                engine != self.d_loaded['engine'] or
+                result_cache != self.d_loaded['result_cache'] or
+                timings != self.d_loaded['timings'] or
+                scales != self.d_loaded['scales']
         ):
             # Если значения отличаются, сохраняем изменения в файл конфигурации
-            self.s_utils.save_settings(min_threshold, precision, direction, embedded_folders, save_txt, save_to)
+            self.s_utils.save_settings(min_threshold, precision, direction, embedded_folders, save_txt, save_to,
+                                       cache_mb, workers, engine, result_cache, timings,
+                                       scales)
 
         self.EndModal(wx.ID_OK)
 
@@ -531,6 +707,12 @@ class SettingsDialog(wx.Dialog):
         self.checkbox_embedded_folders.SetValue(self.settings.embedded_folders)
         self.checkbox_save_txt.SetValue(self.settings.save_txt)
         self.text_save_to.SetValue(self.settings.save_to)
+        self.spin_cache_mb.SetValue(int(self.settings.cache_mb))
+        self.spin_workers.SetValue(int(self.settings.workers))
+        self.dropdown_engine.SetSelection(self.s_utils.engines.index(self.settings.engine))
+        self.checkbox_result_cache.SetValue(self.settings.result_cache)
+        self.checkbox_timings.SetValue(self.settings.timings)
+        self.text_scales.SetValue(self.settings.scales)
 
         # Активируем/деактивируем текстовое поле и кнопку "Обзор"
         self.text_save_to.Enable(self.settings.save_txt)
@@ -542,6 +724,12 @@ class SettingsDialog(wx.Dialog):
         self.d_loaded['embedded_folders'] = self.settings.embedded_folders
         self.d_loaded['save_txt'] = self.settings.save_txt
         self.d_loaded['save_to'] = self.settings.save_to
+        self.d_loaded['cache_mb'] = int(self.settings.cache_mb)
+        self.d_loaded['workers'] = int(self.settings.workers)
+        self.d_loaded['engine'] = self.settings.engine
+        self.d_loaded['result_cache'] = self.settings.result_cache
+        self.d_loaded['timings'] = self.settings.timings
+        self.d_loaded['scales'] = self.settings.scales
 
 
 if __name__ == '__main__':
@@ -0,0 +1,27 @@
+@ECHO off
+
+REM 	Сервис поиска держит шаблоны TEMPLATES (папку, файл или атлас) в памяти и ищет их на скриншотах, которые
+REM присылает тонкий клиент client.py (check_images.bat с USE_SERVICE=1). Так на каждый скриншот не тратится время
+REM на запуск Python, загрузку OpenCV и чтение шаблонов. Скриншоты одного запроса ищутся параллельно.
+REM 	Сервис запускается один раз перед тестами и работает до Ctrl+C. Он принимает запросы только с этого компьютера
+REM (http://127.0.0.1:8765). Несколько наборов шаблонов задаются ключами --set имя=путь, клиент выбирает набор
+REM ключом -s имя.
+
+SET HOME_DIR=D:\My_documents\Programming\Python\Check Images
+SET TEMPLATES=F:\work\autotest\tests\launcher\l_screens\games\393
+
+REM All parameters:
+REM -t, --templates - folder, template file or atlas of the set named default
+REM --set           - named template set: name=path, can be repeated, optional parameter
+REM -n, --min       - minimum threshold value in range, default=0.6, optional parameter
+REM -p, --precision - the precision of thresholds in results, default=0.0001, optional parameter
+REM -c, --cache-mb  - memory budget for decoded templates in megabytes, all templates should fit, default=512, optional parameter
+REM -w, --workers   - number of threads which search screenshots, default=number of CPUs, optional parameter
+REM -e, --engine    - search engine: opencv, fft or pyramid, default=opencv, optional parameter
+REM -s, --scales    - scales the templates are searched at, ex.: 1,1.25,1.5, default=1, optional parameter
+REM --port          - port to listen on, default=8765, optional parameter
+REM -v, --verbose   - print every request, optional parameter
+
+python "%HOME_DIR%\service.py" -t "%TEMPLATES%"
+
+pause
@@ -1,10 +1,17 @@
 # Check images by OpenCV with GUI
 # Version 1.0
 
-import cv2
-import numpy
 import os
 import datetime
+from tmpl_cache import TemplateCache
+from decoder import PrefetchingDecoder
+from screenshots import ScreenshotStream
+from matching import make_matcher
+from incremental import IncrementalMatcher
+from parallel import ParallelMatcher
+from result_cache import ResultCache
+from roi import RoiManifest
+from stage_timer import NULL_TIMER
 
 
 class InitServiceOutputInfo:
@@ -13,16 +20,18 @@ class InitServiceOutputInfo:
     to the console and to the file.
     """
 
-    def __init__(self, tmpl_paths: list, precision: float, direction: (0 | 1)):
+    def __init__(self, tmpl_paths: list, precision: float, direction: (0 | 1), with_scale=False):
         """
         :param tmpls_dict:    dict, contains pairs - {path to template images: list of images, ...}
         :param path_to_tmpls: tuple, 2 items: 0 - str, path to one image file or folder with image files, folder
                               1 - str, filename if the input is one file, else - empty string
         :param precision:     float
+        :param with_scale:    bool, add the SCALE column of the multi-scale search
         """
         self.__tmpl_paths = tmpl_paths
         self.__prec = precision
         self.__direction = direction
+        self.__with_scale = with_scale
 
         self.__img_indent = 0
         self.__count_indent = 0
@@ -68,6 +77,8 @@ class InitServiceOutputInfo:
 
         header = f'IMAGE{" " * (self.__img_indent - 5)}|COUNT   |THRESHOLD{" " * (self.__threshold_indent - 9)}|' \
                  f'X{" " * (self.__coord_indent - 1)}|Y{" " * (self.__coord_indent - 1)}'
+        if self.__with_scale:
+            header += '|SCALE'
 
         print('-' * max_length,
               screenshot,
@@ -115,7 +126,9 @@ class OutputInfo:
                  coord_indent: int,
                  count=None,
                  x=None,
-                 y=None):
+                 y=None,
+                 with_scale=False,
+                 scale=None):
         """
         :param path_to_tmpls: str, path to folder with image templates
         :param thr:           float
@@ -128,6 +141,8 @@ class OutputInfo:
         :param count:         int, count of found templates on screen image
         :param x:             int, x coordinate, where template found on screen image
         :param y:             int, y coordinate, where template found on screen image
+        :param with_scale:    bool, add the scale column of the multi-scale search
+        :param scale:         float, scale at which the template is found
         """
         self.__filename = filename
         self.__thr = thr
@@ -139,6 +154,8 @@ class OutputInfo:
         self.__count = count if count is not None else ''
         self.__x = x
         self.__y = y
+        self.__with_scale = with_scale
+        self.__scale = scale
 
     def print_one_found_entry(self) -> str:
         one_entry = f'{self.__filename}{" " * (self.__tmpl_indent - len(self.__filename))}|' \
@@ -146,6 +163,8 @@ class OutputInfo:
                     f'{self.__thr}{" " * (self.__threshold_indent - len(str(self.__thr)))}|' \
                     f'{self.__x}{" " * (self.__coord_indent - len(str(self.__x)))}|' \
                     f'{self.__y}{" " * (self.__coord_indent - len(str(self.__y)))}'
+        if self.__with_scale:
+            one_entry += f'|{self.__scale}'
         print(one_entry)
 
         return one_entry + '\n'
@@ -156,6 +175,8 @@ class OutputInfo:
                     f'Not found{" " * (self.__threshold_indent - 9)}|' \
                     f'None{" " * (self.__coord_indent - 4)}|' \
                     f'None{" " * (self.__coord_indent - 4)}'
+        if self.__with_scale:
+            one_entry += '|None'
         print(one_entry)
 
         return one_entry + '\n'
@@ -170,7 +191,18 @@ class CheckImages:
                  precision,
                  direction,
                  save_txt,
-                 save_to,):
+                 save_to,
+                 cache_mb=None,
+                 workers=1,
+                 engine='opencv',
+                 progress=None,
+                 cancel_event=None,
+                 use_result_cache=True,
+                 timer=None,
+                 scales=None,
+                 decode_threads=None,
+                 incremental=False,
+                 verify_incremental=False):
 
         self.__direction: (0 | 1) = direction
         if 0 == self.__direction:
@@ -180,65 +212,108 @@ class CheckImages:
             self.__tmpl_paths: [str] = screen_imgs
             self.__screen_imgs: [str] = tmpl_paths
 
-        self.__console_window = console   # wx.TextCtrl object
+        self.__console_window = console   # wx.TextCtrl or any object with AppendText(str) method
         self.__min_threshold: float = min_threshold
         self.__precision: float = precision
         self.__save_txt: bool = save_txt
         self.__save_to: str = save_to
 
+        self.__cache_mb = cache_mb
+        self.__workers: int = workers
+        self.__engine: str = engine   # Key of matching.ENGINES: 'opencv', 'pyramid' or 'fft'
+        self.__progress = progress           # callable(done: int, total: int), called after every template
+        self.__cancel_event = cancel_event   # threading.Event, the search stops as soon as it is set
+        self.__use_result_cache: bool = use_result_cache
+        self.__result_cache = None
+        self.__timer = timer or NULL_TIMER   # stage_timer.StageTimer, records the time of every stage of the search
+        # Scales of the multi-scale search, ex.: [1, 1.25, 1.5], None - only the original scale
+        self.__scales = None if not scales or list(scales) == [1.0] else sorted(set(scales))
+        self.__decode_threads = decode_threads   # Threads which decode the next screenshots and templates in advance
+        self.__decoder = None
+
         self.__output_preparing = None
-        self.__height = None
-        self.__width = None
+        self.__tmpl_cache = TemplateCache(cache_mb)   # Templates are decoded once for all screenshots
+        # Templates are searched again only around the changed areas of the next screenshot, opencv engine only
+        self.__incremental: bool = incremental or verify_incremental
+        if self.__incremental and (self.__engine != 'opencv' or self.__scales is not None):
+            error = 'The incremental search works only with the opencv engine at the original scale'
+            raise ValueError(error)
+        if self.__incremental:
+            self.__matcher = IncrementalMatcher(self.__min_threshold, verify_incremental, self.__timer)
+        else:
+            self.__matcher = make_matcher(self.__engine, self.__min_threshold, self.__scales, self.__timer)
+        self.__pool = None
+        self.__roi_manifest = RoiManifest()   # Regions of the screenshot where templates are searched
 
     def __round_threshold(self, thr: float) -> float:
         multiplier = 10 ** (len(str(self.__precision)) - 2)
         thr = int(thr * multiplier)
         return thr / multiplier
 
-    def __any_img_to_grayscale(self, path: str) -> numpy.ndarray:
-        img_rgb = cv2.imread(path)
-        return cv2.cvtColor(img_rgb, cv2.COLOR_BGR2GRAY)
-
-    def __find_one_image(self, img: str, scr_img: numpy.ndarray) -> numpy.ndarray:
-        img = self.__any_img_to_grayscale(img)
-        self.__height, self.__width = img.shape
-
-        return cv2.matchTemplate(img, scr_img, cv2.TM_CCOEFF_NORMED)
-
-    def __filter_near_points(self, d_found_tmpl: dict) -> [((int, int), float)]:   # [((x, y), threshold), ...]
-        prev_coords = None
-        max_correlation = -1
-        coords_with_max_correlation = None
-        all_points_list = []
-
-        if self.__width <= 18 and self.__height <= 18:
-            search_area = int(self.__width * 2), int(self.__height * 2)
-        else:
-            search_area = self.__width, self.__height
-
-        for coords in sorted(d_found_tmpl.keys()):
-            if prev_coords is None:  # First point in dict
-                max_correlation = d_found_tmpl[coords]
-                coords_with_max_correlation = (coords, d_found_tmpl[coords])
+    def __prefetched_templates(self, tmpl_paths: [str]):
+        for tmpl_path, future in zip(tmpl_paths, self.__decoder.prefetch(self.__tmpl_cache.get, tmpl_paths)):
+            started = self.__timer.start()   # Only the time the search waits for the template
+            tmpl_img = future.result()
+            self.__timer.name(tmpl_img, tmpl_path)
+            self.__timer.stop('decode', started, tmpl_img)
+            yield tmpl_img
+
+    def __is_cancelled(self) -> bool:
+        return self.__cancel_event is not None and self.__cancel_event.is_set()
+
+    def __method(self) -> str:
+        method = f'TM_CCOEFF_NORMED/{self.__engine}'   # Like in check_images, the engines differ in the last digits
+        if self.__incremental:
+            method += '/tiled'   # Values of the tiled map differ in the last digits
+        if self.__scales is not None:
+            method += f'/scales={",".join(map(str, self.__scales))}'
+        return method
+
+    def __needs_image(self, scr_path: str) -> bool:
+        if self.__result_cache is None:
+            return True
+        rois = [self.__roi_manifest.roi_for(tmpl_path) for tmpl_path in self.__tmpl_paths]
+        return not self.__result_cache.has_all(scr_path, self.__tmpl_paths, self.__min_threshold, self.__method(),
+                                               rois)
+
+    def __find_all_templates(self, screenshot):
+        """
+        Yields found points for every template on the screenshot in the order of templates,
+        ex.: [((849, 69), 0.8667161), ...]. The screenshot is decoded only if some result is not in the cache.
+        :param screenshot: screenshots.Screenshot
+        """
+        def match_templates(tmpl_paths: [str]):
+            started = self.__timer.start()   # Only the time the search waits for the screenshot
+            scr_img = screenshot.image
+            self.__timer.stop('decode', started)
+            rois = [self.__roi_manifest.roi_for(tmpl_path) for tmpl_path in tmpl_paths]
+            if self.__pool is not None:
+                yield from self.__pool.find_all(scr_img, tmpl_paths, rois)
+            elif self.__incremental:
+                yield from self.__matcher.find_all_many(scr_img, self.__prefetched_templates(tmpl_paths), rois,
+                                                        tmpl_paths)
             else:
-                if abs(coords[0] - prev_coords[0]) < search_area[0] or \
-                        abs(coords[1] - prev_coords[1]) < search_area[1]:
-                    if d_found_tmpl[coords] > max_correlation:
-                        max_correlation = d_found_tmpl[coords]
-                        coords_with_max_correlation = (coords, d_found_tmpl[coords])
-                else:
-                    all_points_list.append(coords_with_max_correlation)
-                    max_correlation = d_found_tmpl[coords]
-            prev_coords = coords
-        if coords_with_max_correlation is not None:     # Add the last point if any point has been found
-            all_points_list.append(coords_with_max_correlation)
+                yield from self.__matcher.find_all_many(scr_img, self.__prefetched_templates(tmpl_paths), rois)
 
-        return list(set(all_points_list))
+        if self.__result_cache is not None:
+            rois = [self.__roi_manifest.roi_for(tmpl_path) for tmpl_path in self.__tmpl_paths]
+            yield from self.__result_cache.find_all(screenshot.path, self.__tmpl_paths, self.__min_threshold,
+                                                    self.__method(), match_templates, rois)
+        else:
+            yield from match_templates(self.__tmpl_paths)
 
     def __find_thresholds_for_all_images(self):
         all_info = []
-        for scr_path in self.__screen_imgs:
-            scr_img_gray = self.__any_img_to_grayscale(scr_path)
+        done = 0
+        mismatches = 0   # Mismatches of the incremental search which are already printed
+        total = len(self.__screen_imgs) * len(self.__tmpl_paths)
+        # Screenshots are decoded like templates, because with direction 1 they can be templates of an atlas
+        for screenshot in ScreenshotStream(self.__screen_imgs, TemplateCache.decode, decoder=self.__decoder,
+                                           needs_image=self.__needs_image):
+            if self.__is_cancelled():
+                break
+            scr_path = screenshot.path
+            self.__timer.set_screenshot(scr_path)
             header_info = self.__output_preparing.print_header(scr_path)
             all_info.append(header_info[0])    # ------------------------------------------------------
             all_info.append(header_info[1])    # |   SCREENSHOT - D:\Python\Check Images\i1_2.png     |
@@ -254,15 +329,10 @@ class CheckImages:
             self.__console_window.AppendText(header_info[3])
             self.__console_window.AppendText(header_info[0])
 
-            for tmpl_path in self.__tmpl_paths:
-                d_found_tmpl = dict()  # ex.: {(994, 1): 0.66438675, (994, 2): 0.99708754, (994, 3): 0.6657746}
-                searching = self.__find_one_image(tmpl_path, scr_img_gray)
-                location = numpy.where(searching >= self.__min_threshold)
-
-                for coords in zip(*location[::-1]):
-                    if d_found_tmpl.get(coords) is None:
-                        d_found_tmpl[coords] = searching[coords[1], coords[0]]
-                all_points_list = self.__filter_near_points(d_found_tmpl)   # [((849, 69), 0.8667161), ...]
+            for tmpl_path, all_points_list in zip(self.__tmpl_paths, self.__find_all_templates(screenshot)):
+                if self.__is_cancelled():
+                    break
+                started = self.__timer.start()
                 num_tmpls_found = len(all_points_list)
 
                 one_entry = ''
@@ -279,7 +349,9 @@ class CheckImages:
                                                          self.__output_preparing.coord_indent,
                                                          num_tmpls_found if 0 == idx else '',
                                                          x,
-                                                         y)
+                                                         y,
+                                                         self.__scales is not None,
+                                                         coords_thr[2] if len(coords_thr) > 2 else None)
                         # exit.webp    |  1     |0.8136      |994     |2
                         one_entry = one_entry_to_output.print_one_found_entry()
                         self.__console_window.AppendText(one_entry)
@@ -293,13 +365,30 @@ class CheckImages:
                                                      self.__output_preparing.coord_indent,
                                                      count=0,
                                                      x=None,
-                                                     y=None)
+                                                     y=None,
+                                                     with_scale=self.__scales is not None)
                     # fg_win.webp    |  0     |Not found   |None    |None
                     one_entry = one_entry_to_output.print_one_not_found_entry()
                     self.__console_window.AppendText(one_entry)
                 all_info.append(one_entry)
+                self.__timer.stop('write', started, tmpl_path)
+                done += 1
+                if self.__progress is not None:
+                    self.__progress(done, total)
+            if self.__incremental:
+                for tmpl_path in self.__matcher.mismatches[mismatches:]:
+                    one_entry = f'MISMATCH: {os.path.basename(tmpl_path)} - the incremental search differs from ' \
+                                f'the full one\n'
+                    all_info.append(one_entry)
+                    self.__console_window.AppendText(one_entry)
+                mismatches = len(self.__matcher.mismatches)
             all_info.append('\n\n')
             self.__console_window.AppendText('\n\n')
+            self.__matcher.release()   # Buffers of the screenshot are not kept until the next one
+
+        if self.__is_cancelled():
+            self.__console_window.AppendText('Search cancelled, results are not saved\n\n')
+            return
 
         if self.__save_txt:
             with open(self.__save_to, 'at', encoding='utf-8') as f:
@@ -308,8 +397,27 @@ class CheckImages:
     def run(self):
         self.__output_preparing = InitServiceOutputInfo(self.__tmpl_paths,
                                                         self.__precision,
-                                                        self.__direction)
-        self.__find_thresholds_for_all_images()
+                                                        self.__direction,
+                                                        self.__scales is not None)
+        if self.__workers > 1 and not self.__incremental:
+            self.__pool = ParallelMatcher(self.__workers, self.__min_threshold, self.__cache_mb, self.__engine,
+                                          self.__scales)
+        if self.__use_result_cache:
+            self.__result_cache = ResultCache.next_to(self.__save_to)
+        self.__decoder = PrefetchingDecoder(self.__decode_threads)
+        try:
+            self.__find_thresholds_for_all_images()
+        finally:
+            self.__decoder.close()
+            self.__decoder = None
+            if self.__incremental:
+                self.__matcher.reset()
+            if self.__pool is not None:
+                self.__pool.close()
+                self.__pool = None
+            if self.__result_cache is not None:
+                self.__result_cache.close()
+                self.__result_cache = None
 
 
 if __name__ == '__main__':
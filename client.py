@@ -0,0 +1,147 @@
+# Thin client of the matching service (service.py), it does not import OpenCV, so it starts instantly
+# Usage: python client.py -s default -i "D:\Capture\1.png * D:\Capture\2.png" [-f jsonl] [-o thresholds.jsonl]
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import urllib.parse
+from output import JsonlWriter, CsvWriter
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.__socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.__socket_path)
+
+
+class ServiceClient:
+    """
+    The class sends requests to the matching service over localhost HTTP or over the Unix socket.
+    Usage:
+        client = ServiceClient(port=8765)
+        for result in client.match('default', ['D:\\Capture\\1.png']):
+            print(result['screenshot'], result['templates'])
+    Every result: {'screenshot': path, 'time_ms': float, 'with_scale': bool - hits have the scale,
+                   'templates': [{'template': relative path, 'count': int, 'time_ms': float,
+                                  'hits': [[x, y, threshold], ...] or [[x, y, threshold, scale], ...]}, ...]}
+    """
+
+    default_host = '127.0.0.1'
+    default_port = 8765
+
+    def __init__(self, host=None, port=None, socket_path=None, timeout=600):
+        """
+        :param host:        str, host of the service, None - default
+        :param port:        int, port of the service, None - default
+        :param socket_path: str, path to the Unix socket of the service, then `host` and `port` are not used
+        :param timeout:     float, seconds to wait for the response
+        """
+        self.__host = host or self.default_host
+        self.__port = port or self.default_port
+        self.__socket_path = socket_path
+        self.__timeout = timeout
+
+    def __request(self, method: str, url: str, body=None, content_type='application/json'):
+        if self.__socket_path:
+            connection = _UnixHTTPConnection(self.__socket_path, self.__timeout)
+        else:
+            connection = http.client.HTTPConnection(self.__host, self.__port, timeout=self.__timeout)
+        try:
+            headers = {'Content-Type': content_type} if body is not None else {}
+            connection.request(method, url, body=body, headers=headers)
+            response = connection.getresponse()
+            answer = json.loads(response.read().decode('utf-8') or '{}')
+        finally:
+            connection.close()
+        if response.status != 200:
+            error = f'Service error {response.status}: {answer.get("error", response.reason)}'
+            raise RuntimeError(error)
+        return answer
+
+    def health(self) -> dict:
+        """
+        :return: dict, {'status': 'ok', 'sets': {name: number of templates, ...}}
+        """
+        return self.__request('GET', '/health')
+
+    def reload(self) -> dict:
+        """
+        Lists the templates of all sets again, ex.: after templates were added to the folder.
+        """
+        return self.__request('POST', '/reload', b'{}')
+
+    def match(self, set_name: str, scr_paths: [str]) -> [dict]:
+        """
+        Searches the templates of the set on the screenshots in one batch, the service reads the files itself.
+        :return: list of results in the order of `scr_paths`
+        """
+        body = json.dumps({'set': set_name, 'screenshots': [os.path.abspath(path) for path in scr_paths]})
+        return self.__request('POST', '/match', body.encode('utf-8'))['results']
+
+    def match_bytes(self, set_name: str, data: bytes, name='') -> dict:
+        """
+        Searches the templates of the set on the screenshot sent as the content of the image file.
+        :param name: str, name of the screenshot in the result
+        """
+        query = urllib.parse.urlencode({'set': set_name, 'name': name})
+        return self.__request('POST', f'/match?{query}', data, 'application/octet-stream')['results'][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='-p or --param <value>')
+    parser.add_argument('-i', '--image', type=str, dest="scr_img_path", required=True,
+                        help="Path to screen image(-s) where templates will be searched, delimiter is ' * '")
+    parser.add_argument('-s', '--set', type=str, dest="set_name",
+                        help="Name of the template set of the service", default='default')
+    parser.add_argument('--host', type=str, dest="host",
+                        help="Host of the service", default=ServiceClient.default_host)
+    parser.add_argument('--port', type=int, dest="port",
+                        help="Port of the service", default=ServiceClient.default_port)
+    parser.add_argument('--socket', type=str, dest="socket_path",
+                        help="Unix socket of the service instead of the host and port", default='')
+    parser.add_argument('--upload', action='store_true', dest="upload",
+                        help="Send the content of screenshots instead of their paths")
+    parser.add_argument('-f', '--format', type=str, dest="output_format", choices=['jsonl', 'csv'],
+                        help="Format of the output: JSON lines or CSV", default='jsonl')
+    parser.add_argument('-o', '--output', type=str, dest="output_path",
+                        help="File the results are added to, default - thresholds.<jsonl|csv>", default='')
+    parser.add_argument('-q', '--quiet', action='store_true', dest="quiet",
+                        help="Do not print results to the console")
+    options = parser.parse_args()
+
+    client = ServiceClient(options.host, options.port, options.socket_path or None)
+    scr_paths = options.scr_img_path.split(' * ')
+    try:
+        if options.upload:
+            results = []
+            for scr_path in scr_paths:
+                with open(scr_path, 'rb') as f:
+                    results.append(client.match_bytes(options.set_name, f.read(), scr_path))
+        else:
+            results = client.match(options.set_name, scr_paths)
+    except (OSError, RuntimeError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+
+    writer_class = CsvWriter if options.output_format == 'csv' else JsonlWriter
+    output_path = options.output_path or 'thresholds.' + writer_class.default_extension
+    with_scale = any(result['with_scale'] for result in results)
+    with writer_class(output_path, options.quiet, with_scale) as writer:
+        for result in results:
+            writer.start_screenshot(result['screenshot'])
+            for tmpl in result['templates']:
+                writer.write_template(result['screenshot'], tmpl['template'], tmpl['template'],
+                                      [tuple(hit) for hit in tmpl['hits']], tmpl['time_ms'])
+            writer.end_screenshot()
+
+
+if __name__ == '__main__':
+    main()
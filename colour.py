@@ -0,0 +1,131 @@
+import os
+import collections
+import cv2
+import numpy
+from decoder import imread_colour
+from matching import MaskedTemplate
+
+
+class ColourVerifier:
+    """
+    Second stage of the colour matching mode. Templates are searched on grayscale images as usual, it is the cheap
+    prefilter, and only the found points are checked in colour: the window of the colour screenshot under the point is
+    compared with the colour template channel by channel. The score of a channel is 1 - mean absolute difference /
+    range of the channel, the colour score of the point is the score of the worst channel, so red and blue buttons of
+    the same shape both have the high grayscale threshold, but only one of them has the high colour score. Points with
+    the colour score below `min_score` are dropped.
+    In HSV the difference of the hue is circular and it is weighted by the saturation of both pixels, because the hue
+    of grey pixels means nothing. Transparent pixels of the template are not compared.
+    The colour screenshot is decoded only when some template is found on it, colour templates are kept in a small LRU
+    cache. Points get the colour score as the last item: ((x, y), threshold, [scale,] colour score).
+    """
+
+    colour_spaces = ['bgr', 'hsv']
+    max_templates = 256   # Colour templates kept in memory
+
+    def __init__(self, min_score=0.9, colour_space='bgr'):
+        """
+        :param min_score:    float, points with the lower colour score are dropped, 0 - only the score is added
+        :param colour_space: str, 'bgr' or 'hsv'
+        """
+        if colour_space not in self.colour_spaces:
+            error = f'colour_space={colour_space} but it should be one of {self.colour_spaces}'
+            raise ValueError(error)
+        if not isinstance(min_score, (int, float)) or not 0 <= min_score <= 1:
+            error = f'min_score={min_score} but it should be a number in range 0 ... 1'
+            raise ValueError(error)
+
+        self.__min_score = float(min_score)
+        self.__colour_space = colour_space
+        self.__templates = collections.OrderedDict()   # {(path, mtime, size): (BGR image, mask or None), ...}
+        self.__scr_path = None
+        self.__scr_img = None
+
+    @property
+    def method(self) -> str:
+        """
+        :return: str, part of the method name in the result cache, ex.: 'colour=bgr>=0.9'
+        """
+        return f'colour={self.__colour_space}>={self.__min_score!r}'
+
+    def __template(self, tmpl_path: str) -> (numpy.ndarray, numpy.ndarray):
+        stat = os.stat(tmpl_path)
+        key = (os.path.abspath(tmpl_path), stat.st_mtime_ns, stat.st_size)
+        template = self.__templates.get(key)
+        if template is None:
+            img, alpha = imread_colour(tmpl_path)
+            mask = alpha >= MaskedTemplate.opaque_alpha if alpha is not None else None
+            template = (img, mask if mask is not None and mask.any() and not mask.all() else None)
+            self.__templates[key] = template
+            while len(self.__templates) > self.max_templates:
+                self.__templates.popitem(last=False)
+        else:
+            self.__templates.move_to_end(key)
+        return template
+
+    def __screenshot(self, scr_path: str) -> numpy.ndarray:
+        if scr_path != self.__scr_path:
+            self.__scr_img = imread_colour(scr_path)[0]
+            self.__scr_path = scr_path
+        return self.__scr_img
+
+    def __differences(self, window: numpy.ndarray, tmpl_img: numpy.ndarray) -> numpy.ndarray:
+        """
+        :return: numpy.ndarray H x W x 3 of float32, differences of the channels scaled to 0 ... 1
+        """
+        if self.__colour_space == 'bgr':
+            return cv2.absdiff(window, tmpl_img).astype(numpy.float32) / 255
+        window = cv2.cvtColor(window, cv2.COLOR_BGR2HSV).astype(numpy.float32)
+        tmpl_img = cv2.cvtColor(tmpl_img, cv2.COLOR_BGR2HSV).astype(numpy.float32)
+        diff = numpy.abs(window - tmpl_img)
+        hue = numpy.minimum(diff[:, :, 0], 180 - diff[:, :, 0]) / 90   # Hue of OpenCV is 0 ... 179
+        diff[:, :, 0] = hue * numpy.minimum(window[:, :, 1], tmpl_img[:, :, 1]) / 255
+        diff[:, :, 1:] /= 255
+        return diff
+
+    def score(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, mask: numpy.ndarray, x: int, y: int) -> float:
+        """
+        Compares the window of the colour screenshot with the top left point (x, y) with the colour template.
+        :param mask: numpy.ndarray of bool, opaque pixels of the template, None - all pixels
+        :return: float, score of the worst channel, 0 ... 1
+        """
+        height = min(tmpl_img.shape[0], scr_img.shape[0] - y)
+        width = min(tmpl_img.shape[1], scr_img.shape[1] - x)
+        if height <= 0 or width <= 0 or x < 0 or y < 0:
+            return 0.0
+        diff = self.__differences(scr_img[y:y + height, x:x + width], tmpl_img[:height, :width])
+        diff = diff.reshape(-1, 3) if mask is None else diff[mask[:height, :width]]
+        if not len(diff):
+            return 0.0
+        return float(1 - diff.mean(axis=0).max())
+
+    def verify(self, scr_path: str, tmpl_path: str, points: list) -> list:
+        """
+        Adds the colour score to every found point of the template and drops the points below `min_score`.
+        :param points: list, [((x, y), threshold), ...] or [((x, y), threshold, scale), ...]
+        :return: list, [((x, y), threshold, colour score), ...] or [((x, y), threshold, scale, colour score), ...]
+        """
+        if not points:
+            return []
+        scr_img = self.__screenshot(scr_path)
+        tmpl_img, mask = self.__template(tmpl_path)
+        verified = []
+        for pt in points:
+            scaled_img, scaled_mask = tmpl_img, mask
+            if len(pt) > 2 and pt[2] != 1.0:   # The template is `scale` times bigger on the screenshot
+                size = (max(1, round(tmpl_img.shape[1] * pt[2])), max(1, round(tmpl_img.shape[0] * pt[2])))
+                scaled_img = cv2.resize(tmpl_img, size, interpolation=cv2.INTER_AREA if pt[2] < 1 else
+                                        cv2.INTER_LINEAR)
+                if mask is not None:
+                    scaled_mask = cv2.resize(mask.astype(numpy.uint8), size, interpolation=cv2.INTER_NEAREST) > 0
+            colour_score = round(self.score(scr_img, scaled_img, scaled_mask, int(pt[0][0]), int(pt[0][1])), 4)
+            if colour_score >= self.__min_score:
+                verified.append(tuple(pt) + (colour_score,))
+        return verified
+
+    def release(self):
+        """
+        Drops the colour image of the last screenshot.
+        """
+        self.__scr_path = None
+        self.__scr_img = None
@@ -0,0 +1,163 @@
+import os
+import struct
+import collections
+import concurrent.futures
+import cv2
+import numpy
+
+
+def imread_grayscale(path: str) -> numpy.ndarray:
+    """
+    Decodes the image file straight to the grayscale image, without the colour buffer and the conversion. The values
+    of colour PNG files may differ by 1 from cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2GRAY) due to the rounding
+    of libpng.
+    """
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        error = f'Image {path} can not be read'
+        raise IOError(error)
+    return img
+
+
+def has_alpha(path: str) -> bool:
+    """
+    Checks by the headers of the file, without decoding, if the PNG or WEBP image has transparency: the alpha channel
+    or the transparent colour (tRNS) of PNG, the alpha flag of WEBP.
+    """
+    with open(path, 'rb') as f:
+        signature = f.read(12)
+        if signature[:8] == b'\x89PNG\r\n\x1a\n':
+            f.seek(8)
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return False
+                length, chunk_type = struct.unpack('>I4s', header)
+                if chunk_type == b'IHDR':
+                    if f.read(13)[9] in (4, 6):   # Colour types: grayscale + alpha, RGBA
+                        return True
+                    f.seek(4, os.SEEK_CUR)
+                    continue
+                if chunk_type == b'tRNS':
+                    return True
+                if chunk_type in (b'IDAT', b'IEND'):
+                    return False
+                f.seek(length + 4, os.SEEK_CUR)   # Data and CRC
+
+        if signature[:4] == b'RIFF' and signature[8:12] == b'WEBP':
+            chunk_type, data = f.read(4), f.read(9)
+            if chunk_type == b'VP8X':
+                return bool(data[4] & 0x10)
+            if chunk_type == b'VP8L':
+                return bool(struct.unpack('<I', data[5:9])[0] >> 28 & 1)
+    return False
+
+
+def imread_grayscale_alpha(path: str) -> (numpy.ndarray, numpy.ndarray):
+    """
+    Decodes the image file to the grayscale image and its alpha channel. Files without transparency are decoded
+    by imread_grayscale(), so their pixels are the same.
+    :return: tuple (grayscale image, alpha channel or None)
+    """
+    if not has_alpha(path):
+        return imread_grayscale(path), None
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        error = f'Image {path} can not be read'
+        raise IOError(error)
+    if img.dtype == numpy.uint16:   # 16-bit PNG, IMREAD_GRAYSCALE reduces it to 8 bits too
+        img = (img >> 8).astype(numpy.uint8)
+    if img.ndim < 3 or img.shape[2] != 4:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img, None
+    return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY), img[:, :, 3]
+
+
+def imread_colour(path: str) -> (numpy.ndarray, numpy.ndarray):
+    """
+    Decodes the image file to the BGR image and its alpha channel, grayscale files are converted to BGR.
+    :return: tuple (BGR image, alpha channel or None)
+    """
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED if has_alpha(path) else cv2.IMREAD_COLOR)
+    if img is None:
+        error = f'Image {path} can not be read'
+        raise IOError(error)
+    if img.dtype == numpy.uint16:
+        img = (img >> 8).astype(numpy.uint8)
+    if img.ndim < 3:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR), None
+    if img.shape[2] == 4:
+        return img[:, :, :3], img[:, :, 3]
+    return img, None
+
+
+def decode_grayscale(data: bytes) -> numpy.ndarray:
+    """
+    Decodes the image file content (png, jpg, webp) from memory straight to the grayscale image.
+    """
+    img = cv2.imdecode(numpy.frombuffer(data, dtype=numpy.uint8), cv2.IMREAD_GRAYSCALE) if data else None
+    if img is None:
+        error = 'Image data can not be decoded'
+        raise IOError(error)
+    return img
+
+
+class PrefetchingDecoder:
+    """
+    Pool of threads which decode images in advance while the search is busy with the current screenshot or template.
+    OpenCV releases the GIL while it reads and decodes a file, so big PNG and WEBP files are decoded concurrently.
+    The number of images which are decoded ahead of the consumer is limited by `depth`.
+    Usage:
+        with PrefetchingDecoder(threads=4, depth=8) as decoder:
+            for tmpl_path, future in zip(tmpl_paths, decoder.prefetch(imread_grayscale, tmpl_paths)):
+                tmpl_img = future.result()
+    """
+
+    default_threads = min(4, os.cpu_count() or 1)
+    default_depth = 8
+
+    def __init__(self, threads=None, depth=None):
+        """
+        :param threads: int, number of decoding threads, None - default
+        :param depth:   int, maximum number of images decoded ahead by prefetch(), None - default
+        """
+        threads = threads if threads is not None else self.default_threads
+        depth = depth if depth is not None else self.default_depth
+        if not isinstance(threads, int) or threads < 1:
+            error = f'threads={threads} but it should be a positive integer'
+            raise ValueError(error)
+        if not isinstance(depth, int) or depth < 1:
+            error = f'depth={depth} but it should be a positive integer'
+            raise ValueError(error)
+
+        self.__depth = depth
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix='decoder')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def submit(self, decode, path: str) -> concurrent.futures.Future:
+        return self.__executor.submit(decode, path)
+
+    def prefetch(self, decode, paths):
+        """
+        Yields the future of `decode`(path) for every path in their order, at most `depth` of them are decoded ahead.
+        If the generator is closed before the end, the decodes which have not started yet are cancelled.
+        :param decode: callable(str) -> numpy.ndarray, it is called from the decoding threads
+        """
+        pending = collections.deque()
+        try:
+            for path in paths:
+                pending.append(self.__executor.submit(decode, path))
+                if len(pending) >= self.__depth:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,91 @@
+import os
+import configparser
+from atlas import TemplateAtlas
+
+
+class ExpectationManifest:
+    """
+    The class finds how many times every template is expected on the screenshot in the pass/fail mode. Expectations
+    are set in the file expect.ini in the folder of the template, section is the file name of the template:
+        [ok_button.png]
+        ; at least once, it is the default, so the section may be omitted
+        min_count = 1
+        [error_dialog.png]
+        ; should not be on the screenshot
+        count = 0
+        [star.png]
+        ; exactly 3 times
+        count = 3
+        [row.png]
+        ; from 2 to 10 times
+        min_count = 2
+        max_count = 10
+    The section [DEFAULT] sets the expectation of all templates of the folder which have no own section.
+    """
+
+    manifest_name = 'expect.ini'
+
+    def __init__(self):
+        self.__d_manifests = dict()   # {folder: configparser.ConfigParser or None, ...}
+
+    def __manifest(self, folder: str):
+        if folder not in self.__d_manifests:
+            manifest_path = os.path.join(folder, self.manifest_name)
+            config = None
+            member = TemplateAtlas.member(manifest_path)   # The manifest of a folder packed into an atlas
+            if member is not None and member[0].file_text(member[1]) is not None:
+                config = configparser.ConfigParser(default_section='')
+                config.read_string(member[0].file_text(member[1]))
+            elif os.path.isfile(manifest_path):
+                config = configparser.ConfigParser(default_section='')   # [DEFAULT] is not merged into sections
+                config.read(manifest_path, encoding='utf-8')
+            self.__d_manifests[folder] = config
+        return self.__d_manifests[folder]
+
+    def expectation_for(self, tmpl_path: str) -> (int, int):
+        """
+        :return: tuple (min_count, max_count), max_count is None if the number of occurrences is not limited
+        """
+        folder, filename = os.path.split(tmpl_path)
+        config = self.__manifest(folder)
+        if config is None:
+            return 1, None
+        if config.has_section(filename):
+            section = config[filename]
+        elif config.has_section('DEFAULT'):
+            section = config['DEFAULT']
+        else:
+            return 1, None
+
+        try:
+            count = section.getint('count')
+            min_count = section.getint('min_count', fallback=count if count is not None else 1)
+            max_count = section.getint('max_count', fallback=count)
+        except ValueError:
+            error = f'Expectation of {filename} in {os.path.join(folder, self.manifest_name)} should be integers: ' \
+                    f'count or min_count and max_count'
+            raise ValueError(error)
+        if min_count < 0 or (max_count is not None and max_count < min_count):
+            error = f'Expectation of {filename} in {os.path.join(folder, self.manifest_name)} is min_count=' \
+                    f'{min_count}, max_count={max_count} but it should be 0 <= min_count <= max_count'
+            raise ValueError(error)
+
+        return min_count, max_count
+
+    @staticmethod
+    def limit(expectation: (int, int)) -> int:
+        """
+        Returns the number of occurrences after which the search can stop: one more than `max_count` is enough to fail,
+        `min_count` is enough to pass if the number is not limited.
+        """
+        min_count, max_count = expectation
+        return max_count + 1 if max_count is not None else min_count
+
+    @staticmethod
+    def describe(expectation: (int, int)) -> str:
+        min_count, max_count = expectation
+        if max_count is None:
+            return f'at least {min_count}'
+        if min_count == max_count:
+            return f'exactly {min_count}'
+        return f'from {min_count} to {max_count}'
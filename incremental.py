@@ -0,0 +1,241 @@
+import itertools
+import cv2
+import numpy
+from matching import PointClusterer, TemplateMatcher
+from stage_timer import NULL_TIMER
+
+
+class IncrementalMatcher:
+    """
+    The class searches the templates on a series of screenshots which differ in small areas (the next step of the same
+    test), and searches again only where the screenshot has changed. The screenshot is compared with the one
+    the template was searched on last time, the changed pixels are grouped into dirty rectangles. The correlation map
+    can change only at the positions whose template window overlaps a dirty rectangle, and a peak only where its
+    neighbourhood overlaps them, so the peaks of the rest of the map are carried forward and the map is calculated
+    only around the dirty rectangles. The kept and the new peaks are clustered together, as by TemplateMatcher.
+    cv2.matchTemplate gives slightly different values (~1e-5) for the same position on crops of different sizes, and
+    a changed pixel changes the rounding of the whole crop (the correlation is calculated by DFT), so the map is always
+    calculated by the fixed grid of tiles - on the first screenshot too - and a tile is either reused as a whole or
+    calculated again. The reused values are bit-identical to a full calculation, so the results are identical to
+    a full search by tiles, `verify` checks it on every template. The thresholds may differ from the TemplateMatcher
+    ones in the last digits.
+    Only the original scale and TM_CCOEFF_NORMED of OpenCV are supported, the other engines build their maps
+    differently.
+    """
+
+    tile_size = 256   # Minimum size of a tile of the correlation map, it is 4 template sizes for big templates
+    cell_size = 16    # Changed pixels are grouped into dirty rectangles by cells of this size
+
+    def __init__(self, min_threshold: float, verify=False, timer=None):
+        """
+        :param min_threshold: float, points with correlation below this value are not taken into account
+        :param verify:        bool, search every template by all tiles too and record the templates whose results
+                              differ in `mismatches`
+        :param timer:         stage_timer.StageTimer, records the time of the stages, None - nothing is recorded
+        """
+        self.__min_threshold = min_threshold
+        self.__verify = verify
+        self.__timer = timer or NULL_TIMER
+        self.__matcher = TemplateMatcher(min_threshold, self.__timer)   # For templates bigger than the screenshot
+        self.__scr_img = None        # The current screenshot
+        self.__scr_number = 0        # Number of the current screenshot
+        self.__d_screenshots = dict()   # {number: screenshot, ...} - screenshots the kept peaks were found on
+        self.__d_dirty = dict()      # {number: dirty rectangles of the current screenshot against it, ...}
+        self.__d_states = dict()     # {key: (number of the screenshot, template shape, roi, peaks), ...}
+        self.__tiles = [0, 0]        # Calculated tiles, all tiles of the searched templates
+        self.__mismatches = []       # [key, ...]
+
+    @property
+    def tiles(self) -> (int, int):
+        """
+        :return: tuple, (calculated tiles of the correlation maps, all tiles of the maps), the share of work done
+        """
+        return tuple(self.__tiles)
+
+    @property
+    def mismatches(self) -> list:
+        """
+        :return: list, keys of the templates whose incremental results differed from the full search, `verify` only
+        """
+        return self.__mismatches
+
+    def __dirty_rects(self, previous: numpy.ndarray, current: numpy.ndarray) -> [(int, int, int, int)]:
+        """
+        :return: list, [(x, y, width, height), ...] - rectangles which cover all changed pixels
+        """
+        started = self.__timer.start()
+        changed = cv2.absdiff(previous, current)
+        height, width = changed.shape[:2]
+        cell = self.cell_size
+        rows, cols = -(-height // cell), -(-width // cell)
+        padded = numpy.zeros((rows * cell, cols * cell), dtype=numpy.uint8)
+        padded[:height, :width] = changed if changed.ndim == 2 else changed.max(axis=2)
+        cells = (padded.reshape(rows, cell, cols, cell).max(axis=(1, 3)) > 0).astype(numpy.uint8)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(cells, connectivity=8)
+        rects = [(int(x) * cell, int(y) * cell, min(width, int(x + w) * cell) - int(x) * cell,
+                  min(height, int(y + h) * cell) - int(y) * cell) for x, y, w, h, _ in stats[1:count]]
+        self.__timer.stop('diff', started)
+        return rects
+
+    def __start_screenshot(self, scr_img: numpy.ndarray):
+        if scr_img is self.__scr_img:
+            return
+        self.__scr_img = scr_img
+        self.__scr_number += 1
+        self.__d_screenshots[self.__scr_number] = scr_img
+        self.__d_dirty = dict()
+        # Screenshots which are not a base of any template are dropped
+        used = {state[0] for state in self.__d_states.values()} | {self.__scr_number}
+        self.__d_screenshots = {number: img for number, img in self.__d_screenshots.items() if number in used}
+
+    def __dirty_since(self, number: int) -> [(int, int, int, int)]:
+        if number not in self.__d_dirty:
+            self.__d_dirty[number] = self.__dirty_rects(self.__d_screenshots[number], self.__scr_img)
+        return self.__d_dirty[number]
+
+    def __tile_side(self, tmpl_shape: tuple) -> int:
+        return max(self.tile_size, 4 * max(tmpl_shape[:2]))
+
+    def __calculate(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, region: (int, int, int, int),
+                    d_tiles: dict) -> numpy.ndarray:
+        """
+        Returns the correlation map in the `region` (x0, y0, x1, y1) of the map, assembled from the tiles. Calculated
+        tiles are stored in `d_tiles`, {(row, col): map of the tile, ...}, so the overlapping regions share them.
+        """
+        height, width = tmpl_img.shape[:2]
+        map_h, map_w = scr_img.shape[0] - height + 1, scr_img.shape[1] - width + 1
+        size = self.__tile_side(tmpl_img.shape)
+        x0, y0, x1, y1 = region
+        searching = numpy.empty((y1 - y0, x1 - x0), dtype=numpy.float32)
+        for row, col in itertools.product(range(y0 // size, (y1 - 1) // size + 1),
+                                          range(x0 // size, (x1 - 1) // size + 1)):
+            tile = d_tiles.get((row, col))
+            if tile is None:
+                top, left = row * size, col * size
+                bottom, right = min(map_h, top + size), min(map_w, left + size)
+                started = self.__timer.start()
+                tile = TemplateMatcher.match(scr_img[top:bottom + height - 1, left:right + width - 1], tmpl_img)
+                self.__timer.stop('match', started, tmpl_img)
+                d_tiles[(row, col)] = tile
+            top, left = row * size, col * size
+            part = tile[max(y0, top) - top:min(y1, top + tile.shape[0]) - top,
+                        max(x0, left) - left:min(x1, left + tile.shape[1]) - left]
+            searching[max(y0, top) - y0:max(y0, top) - y0 + part.shape[0],
+                      max(x0, left) - x0:max(x0, left) - x0 + part.shape[1]] = part
+        return searching
+
+    def __peaks(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, dirty: [(int, int, int, int)],
+                peaks: numpy.ndarray) -> numpy.ndarray:
+        """
+        Returns the peaks of the correlation map of the cropped screenshot: the `peaks` of the previous screenshot
+        outside the affected areas of the `dirty` rectangles and the new peaks inside them, in the row-major order of
+        the map like TemplateMatcher.find_peaks() returns them.
+        :param dirty: list, [(x, y, width, height), ...] in the coordinates of the cropped screenshot
+        :param peaks: numpy.ndarray N x 3 or None - the whole map is calculated
+        """
+        height, width = tmpl_img.shape[:2]
+        map_h, map_w = scr_img.shape[0] - height + 1, scr_img.shape[1] - width + 1
+        if peaks is None:
+            dirty = [(0, 0, scr_img.shape[1], scr_img.shape[0])]
+            peaks = numpy.empty((0, 3), dtype=numpy.float64)
+
+        d_tiles = dict()
+        keep = numpy.ones(len(peaks), dtype=bool)
+        new_peaks = []
+        size = self.__tile_side(tmpl_img.shape)
+        margin_x, margin_y = width // 2 + 1, height // 2 + 1   # Half of the window of TemplateMatcher.find_peaks()
+        for x, y, w, h in dirty:
+            # Tiles with the positions whose window overlaps the rectangle, then the positions whose neighbourhood
+            # overlaps these tiles, the peaks there are found again on the map with their whole neighbourhood
+            affected = (max(0, x - width + 1), max(0, y - height + 1), min(map_w, x + w), min(map_h, y + h))
+            if affected[0] >= affected[2] or affected[1] >= affected[3]:
+                continue
+            affected = (affected[0] // size * size, affected[1] // size * size,
+                        min(map_w, -(-affected[2] // size) * size), min(map_h, -(-affected[3] // size) * size))
+            inner = (max(0, affected[0] - margin_x), max(0, affected[1] - margin_y),
+                     min(map_w, affected[2] + margin_x), min(map_h, affected[3] + margin_y))
+            outer = (max(0, inner[0] - margin_x), max(0, inner[1] - margin_y),
+                     min(map_w, inner[2] + margin_x), min(map_h, inner[3] + margin_y))
+            keep &= ~((peaks[:, 0] >= inner[0]) & (peaks[:, 0] < inner[2]) &
+                      (peaks[:, 1] >= inner[1]) & (peaks[:, 1] < inner[3]))
+
+            searching = self.__calculate(scr_img, tmpl_img, outer, d_tiles)
+            started = self.__timer.start()
+            found = TemplateMatcher.find_peaks(searching, self.__min_threshold, (width, height))
+            found[:, 0] += outer[0]
+            found[:, 1] += outer[1]
+            found = found[(found[:, 0] >= inner[0]) & (found[:, 0] < inner[2]) &
+                          (found[:, 1] >= inner[1]) & (found[:, 1] < inner[3])]
+            self.__timer.stop('peaks', started, tmpl_img, candidates=len(found))
+            new_peaks.append(found)
+
+        self.__tiles[0] += len(d_tiles)
+        self.__tiles[1] += -(-map_h // size) * -(-map_w // size)
+
+        merged = numpy.concatenate([peaks[keep]] + new_peaks)
+        merged = numpy.unique(merged, axis=0)   # Peaks of overlapping rectangles are found twice
+        return merged[numpy.lexsort((merged[:, 0], merged[:, 1]))]
+
+    def find_all(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, roi=None, key=None) -> \
+            [((int, int), float)]:
+        """
+        Returns all occurrences of the template on the screenshot, ex.: [((849, 69), 0.8667161), ...].
+        :param roi: tuple (x, y, width, height), the template is searched only inside this region of the screenshot,
+                    None - on the whole screenshot
+        :param key: hashable, identifies the template between screenshots (ex.: its path), None - the template is
+                    searched on the whole screenshot and nothing is kept
+        """
+        if scr_img.shape[0] < tmpl_img.shape[0] or scr_img.shape[1] < tmpl_img.shape[1]:
+            return self.__matcher.find_all(scr_img, tmpl_img)
+        self.__start_screenshot(scr_img)
+
+        offset_x = offset_y = 0
+        if roi is not None:
+            scr_img, (offset_x, offset_y) = TemplateMatcher.crop(scr_img, tmpl_img.shape, roi)
+        state = self.__d_states.get(key) if key is not None else None
+        peaks, dirty = None, None
+        if state is not None and state[1] == tmpl_img.shape and state[2] == roi and \
+                self.__d_screenshots[state[0]].shape == self.__scr_img.shape:
+            peaks = state[3]
+            dirty = [(x - offset_x, y - offset_y, w, h) for x, y, w, h in self.__dirty_since(state[0])]
+        peaks = self.__peaks(scr_img, tmpl_img, dirty, peaks)
+        if key is not None:
+            self.__d_states[key] = (self.__scr_number, tmpl_img.shape, roi, peaks)
+
+        height, width = tmpl_img.shape[:2]
+        started = self.__timer.start()
+        points = PointClusterer(width, height).cluster(peaks)
+        self.__timer.stop('cluster', started, tmpl_img)
+
+        if self.__verify and dirty is not None:
+            full = PointClusterer(width, height).cluster(self.__peaks(scr_img, tmpl_img, None, None))
+            if full != points:
+                self.__mismatches.append(key)
+        return [((x + offset_x, y + offset_y), thr) for (x, y), thr in points]
+
+    def find_all_many(self, scr_img: numpy.ndarray, tmpl_imgs, rois: list, keys=None):
+        """
+        Yields all occurrences of every template from the iterable `tmpl_imgs` on the screenshot, in their order.
+        :param keys: list, keys of the templates, see find_all()
+        """
+        for tmpl_img, roi, key in zip(tmpl_imgs, rois, keys if keys is not None else itertools.repeat(None)):
+            yield self.find_all(scr_img, tmpl_img, roi, key)
+
+    def find_first(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, limit: int, roi=None) -> \
+            [((int, int), float)]:
+        return self.__matcher.find_first(scr_img, tmpl_img, limit, roi)
+
+    def release(self):
+        """
+        The screenshot and the peaks are kept on purpose, they are the base of the next screenshot, see reset().
+        """
+        self.__matcher.release()
+
+    def reset(self):
+        """
+        Drops all kept screenshots and peaks, the next screenshot is searched completely.
+        """
+        self.__scr_img = None
+        self.__d_screenshots = dict()
+        self.__d_dirty = dict()
+        self.__d_states = dict()
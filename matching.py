@@ -0,0 +1,786 @@
+import collections
+import itertools
+import math
+import cv2
+import numpy
+from stage_timer import NULL_TIMER
+
+
+class PointClusterer:
+    """
+    The class groups candidate points which lie within the footprint of the template from each other and leaves one
+    point with the maximum correlation per group. Points are processed from the best to the worst one, a point is
+    dropped if an already kept point is nearer than the footprint on both axes. Kept points are stored in a grid of
+    footprint-sized cells, so only the 3 x 3 neighbouring cells have to be checked for every point and the whole
+    clustering takes O(n log n) time (sorting).
+    """
+
+    def __init__(self, width: int, height: int):
+        """
+        :param width:  int, width of the template
+        :param height: int, height of the template
+        """
+        if width <= 18 and height <= 18:   # Small templates are often found with a shift, so the area is doubled
+            self.__search_area = int(width * 2), int(height * 2)
+        else:
+            self.__search_area = int(width), int(height)
+
+    @property
+    def search_area(self) -> (int, int):
+        return max(1, self.__search_area[0]), max(1, self.__search_area[1])
+
+    def cluster(self, peaks: numpy.ndarray) -> [((int, int), float)]:   # [((x, y), threshold), ...]
+        """
+        :param peaks: numpy.ndarray N x 3, each row is (x, y, correlation), extra columns (ex.: the scale) are added
+                      to the kept points: ((x, y), threshold, scale)
+        """
+        area_w, area_h = self.search_area
+        d_cells = dict()   # {(cell x, cell y): [(x, y), ...], ...} - kept points
+        all_points_list = []
+
+        for row in peaks[numpy.argsort(-peaks[:, 2], kind='stable')]:
+            x, y, correlation = int(row[0]), int(row[1]), row[2]
+            cell_x, cell_y = x // area_w, y // area_h
+
+            is_near = False
+            for neighbour in ((cell_x + dx, cell_y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)):
+                for kept_x, kept_y in d_cells.get(neighbour, ()):
+                    if abs(x - kept_x) < area_w and abs(y - kept_y) < area_h:
+                        is_near = True
+                        break
+                if is_near:
+                    break
+
+            if not is_near:
+                d_cells.setdefault((cell_x, cell_y), []).append((x, y))
+                all_points_list.append(((x, y), float(correlation)) + tuple(float(value) for value in row[3:]))
+
+        return all_points_list
+
+
+class MaskedTemplate(numpy.ndarray):
+    """
+    Grayscale template with transparent pixels (the alpha channel of PNG or WEBP). Only the opaque pixels (alpha not
+    below `opaque_alpha`) are compared with the screenshot, so the background behind an icon does not lower
+    the correlation. Everything that does not depend on the screenshot is calculated once, when the template is
+    decoded, and is kept with it in TemplateCache: the mask, the opaque pixels minus their mean and the norm of
+    them. If the opaque pixels fill a rectangle (the template has only transparent margins), the template is cropped
+    to it and searched by the usual unmasked method, see `opaque_box`.
+    The object is the grayscale image itself, so it goes everywhere a template goes. Arrays derived from it (slices,
+    copies) are plain templates without the mask.
+    """
+
+    opaque_alpha = 128
+
+    def __new__(cls, gray: numpy.ndarray, mask: numpy.ndarray):
+        obj = numpy.asarray(gray).view(cls)
+        obj.alpha_mask = mask
+        ys, xs = numpy.nonzero(mask)
+        box = (int(xs.min()), int(ys.min()), int(xs.max() - xs.min() + 1), int(ys.max() - ys.min() + 1))
+        if box[2] * box[3] == len(xs):
+            obj.opaque_box = box
+            obj.weights = obj.norm = None
+        else:
+            obj.opaque_box = None
+            obj.weights = numpy.where(mask > 0, gray - gray[mask > 0].mean(), 0).astype(numpy.float64)
+            obj.norm = float(numpy.sqrt(numpy.sum(obj.weights ** 2)))
+        return obj
+
+    def __array_finalize__(self, obj):
+        self.alpha_mask = None
+        self.opaque_box = None
+        self.weights = None
+        self.norm = None
+
+    @classmethod
+    def from_alpha(cls, gray: numpy.ndarray, alpha: numpy.ndarray) -> numpy.ndarray:
+        """
+        Returns the MaskedTemplate, or the grayscale image itself if all pixels are opaque (or all are transparent,
+        then there is nothing to compare and the template is searched as it is).
+        :param alpha: numpy.ndarray, the alpha channel of the template or None
+        """
+        if alpha is None:
+            return gray
+        mask = (alpha >= cls.opaque_alpha).astype(numpy.uint8)
+        if mask.all() or not mask.any():
+            return gray
+        return cls(gray, mask)
+
+    @staticmethod
+    def is_masked(tmpl_img: numpy.ndarray) -> bool:
+        return getattr(tmpl_img, 'alpha_mask', None) is not None
+
+    @property
+    def opaque(self) -> numpy.ndarray:
+        """
+        :return: numpy.ndarray, the plain template cropped to `opaque_box`
+        """
+        x, y, width, height = self.opaque_box
+        return numpy.asarray(self)[y:y + height, x:x + width]
+
+    @property
+    def nbytes_with_mask(self) -> int:
+        return self.nbytes + self.alpha_mask.nbytes + (self.weights.nbytes if self.weights is not None else 0)
+
+
+class TemplateMatcher:
+    """
+    The class searches for all occurrences of one grayscale template on one grayscale screenshot. The result is
+    the list of the top left points of found occurrences with the threshold (correlation) of each one. The class is
+    the common matching core of check_images.CheckImages, ci.CheckImages and their worker processes.
+    """
+
+    band_rows = 256   # Minimum number of rows of the correlation map calculated at once by find_first()
+
+    def __init__(self, min_threshold: float, timer=None):
+        """
+        :param min_threshold: float, points with correlation below this value are not taken into account
+        :param timer:         stage_timer.StageTimer, records the time of the stages, None - nothing is recorded
+        """
+        self.__min_threshold = min_threshold
+        self.__timer = timer or NULL_TIMER
+        self.__height = None
+        self.__width = None
+
+    @staticmethod
+    def match(scr_img: numpy.ndarray, tmpl_img: numpy.ndarray) -> numpy.ndarray:
+        if MaskedTemplate.is_masked(tmpl_img) and \
+                scr_img.shape[0] >= tmpl_img.shape[0] and scr_img.shape[1] >= tmpl_img.shape[1]:
+            if tmpl_img.opaque_box is not None:
+                return cv2.matchTemplate(*TemplateMatcher.unmask(scr_img, tmpl_img), cv2.TM_CCOEFF_NORMED)
+            return TemplateMatcher.match_masked(scr_img, tmpl_img)
+        return cv2.matchTemplate(scr_img, numpy.asarray(tmpl_img), cv2.TM_CCOEFF_NORMED)
+
+    @staticmethod
+    def match_masked(scr_img: numpy.ndarray, tmpl_img: MaskedTemplate) -> numpy.ndarray:
+        """
+        TM_CCOEFF_NORMED over the opaque pixels of the template only. With the mask M, n opaque pixels, the template
+        T' = M * (T - mean of the opaque pixels) and a window W of the screenshot:
+            R = sum(T' * W) / sqrt(sum(T' ** 2) * (sum(M * W ** 2) - sum(M * W) ** 2 / n))
+        T' and its norm are stored in the template, the three sums are correlations of the screenshot with T' and M.
+        Windows without contrast under the mask get 0 and a template without contrast gets 1 everywhere, like
+        cv2.matchTemplate does for plain templates (with a mask it returns NaN in both cases).
+        """
+        height, width = tmpl_img.shape[:2]
+        map_h, map_w = scr_img.shape[0] - height + 1, scr_img.shape[1] - width + 1
+        count = float(numpy.count_nonzero(tmpl_img.alpha_mask))
+        if tmpl_img.norm ** 2 < numpy.finfo(numpy.float64).eps * count:
+            return numpy.ones((map_h, map_w), dtype=numpy.float32)
+        scr = scr_img.astype(numpy.float64)
+        mask = tmpl_img.alpha_mask.astype(numpy.float64)
+
+        def correlate(img: numpy.ndarray, kernel: numpy.ndarray) -> numpy.ndarray:
+            return cv2.filter2D(img, -1, kernel, anchor=(0, 0), borderType=cv2.BORDER_CONSTANT)[:map_h, :map_w]
+
+        numerator = correlate(scr, tmpl_img.weights)
+        window_sum = correlate(scr, mask)
+        window_var = correlate(scr * scr, mask) - window_sum * window_sum / count
+        denominator = numpy.sqrt(numpy.maximum(window_var, 0) * tmpl_img.norm ** 2)
+        result = numpy.zeros((map_h, map_w), dtype=numpy.float32)
+        contrast = (window_var > 1e-6 * count) & (denominator > 0)
+        numpy.divide(numerator, denominator, out=result, where=contrast, casting='unsafe')
+        return numpy.clip(result, -1, 1, out=result)
+
+    @staticmethod
+    def unmask(scr_img: numpy.ndarray, tmpl_img: MaskedTemplate) -> (numpy.ndarray, numpy.ndarray):
+        """
+        Fast path of the templates with only transparent margins: returns the part of the screenshot where the opaque
+        rectangle of the template can be and the plain template cropped to it. The correlation map of them has
+        the same size as the map of the whole template and its points are the top left points of the whole template.
+        """
+        x, y, width, height = tmpl_img.opaque_box
+        tmpl_h, tmpl_w = tmpl_img.shape[:2]
+        scr_h, scr_w = scr_img.shape[:2]
+        return scr_img[y:scr_h - (tmpl_h - y - height), x:scr_w - (tmpl_w - x - width)], tmpl_img.opaque
+
+    @staticmethod
+    def crop(scr_img: numpy.ndarray, tmpl_shape: tuple, roi: (int, int, int, int)) -> (numpy.ndarray, (int, int)):
+        """
+        Returns the view (without copying) of the region of interest (x, y, width, height) of the screenshot and
+        the offset of the region. The region is enlarged to the size of the template and moved inside the screenshot
+        if needed.
+        """
+        x, y, width, height = roi
+        scr_h, scr_w = scr_img.shape[:2]
+        width, height = min(scr_w, max(width, tmpl_shape[1])), min(scr_h, max(height, tmpl_shape[0]))
+        x, y = min(max(0, x), scr_w - width), min(max(0, y), scr_h - height)
+        return scr_img[y:y + height, x:x + width], (x, y)
+
+    @staticmethod
+    def find_peaks(searching: numpy.ndarray, min_threshold: float, window: (int, int)) -> numpy.ndarray:
+        """
+        Non-maximum suppression of the correlation map: a point is a peak if it is not below `min_threshold` and
+        it is the maximum in the `window` (width, height) around it. The whole map is processed by OpenCV/NumPy,
+        so low thresholds do not produce millions of Python objects.
+        :return: numpy.ndarray N x 3 of float64, each row is (x, y, correlation)
+        """
+        searching = numpy.ascontiguousarray(searching, dtype=numpy.float32)
+        if searching.size == 0 or cv2.minMaxLoc(searching)[1] < min_threshold:
+            return numpy.empty((0, 3), dtype=numpy.float64)
+
+        kernel = numpy.ones((max(1, window[1]), max(1, window[0])), dtype=numpy.uint8)
+        dilated = cv2.dilate(searching, kernel)
+        ys, xs = numpy.nonzero((searching >= min_threshold) & (searching >= dilated))
+
+        return numpy.column_stack((xs, ys, searching[ys, xs])).astype(numpy.float64)
+
+    @staticmethod
+    def take_first(searching: numpy.ndarray, min_threshold: float, area: (int, int), limit: int,
+                   found: list, offset_y=0):
+        """
+        Moves the best points of the correlation map to `found` one by one until there are `limit` points or the rest
+        of the map is below `min_threshold`. The `area` (width, height) around every taken point is suppressed, points
+        near the points which are already in `found` (ex.: from the previous band) are skipped. The map is changed.
+        :param found:    list, [((x, y), threshold), ...], new points are added to it
+        :param offset_y: int, y of the first row of the map on the screenshot
+        """
+        area_w, area_h = area
+        while len(found) < limit:
+            _, max_val, _, (x, y) = cv2.minMaxLoc(searching)
+            if max_val < min_threshold:
+                break
+            searching[max(0, y - area_h + 1):y + area_h, max(0, x - area_w + 1):x + area_w] = -1
+            y += offset_y
+            if all(abs(x - found_x) >= area_w or abs(y - found_y) >= area_h for (found_x, found_y), _ in found):
+                found.append(((x, y), float(max_val)))
+
+    def find_first(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, limit: int, roi=None) -> \
+            [((int, int), float)]:
+        """
+        Returns up to `limit` occurrences of the template, ex.: [((849, 69), 0.8667161)]. The screenshot is searched
+        by horizontal bands from the top and the search stops as soon as `limit` occurrences are found, so a template
+        which is on the screenshot is usually found without calculating the whole correlation map. The points are
+        not always the best ones of their clusters, so it is for pass/fail checks, not for thresholds.
+        """
+        if limit <= 0:
+            return []
+        if scr_img.shape[0] < tmpl_img.shape[0] or scr_img.shape[1] < tmpl_img.shape[1]:
+            return self.find_all(scr_img, tmpl_img)[:limit]
+
+        offset_x = offset_y = 0
+        if roi is not None:
+            scr_img, (offset_x, offset_y) = self.crop(scr_img, tmpl_img.shape, roi)
+        height, width = tmpl_img.shape[:2]
+        area = PointClusterer(width, height).search_area
+        band = max(self.band_rows, 4 * height)
+        found = []
+        for top in range(0, scr_img.shape[0] - height + 1, band):
+            started = self.__timer.start()
+            searching = self.match(scr_img[top:top + band + height - 1], tmpl_img)
+            self.__timer.stop('match', started, tmpl_img)
+
+            started = self.__timer.start()
+            before = len(found)
+            self.take_first(searching, self.__min_threshold, area, limit, found, top)
+            self.__timer.stop('peaks', started, tmpl_img, candidates=len(found) - before)   # The timer sums the bands
+            if len(found) >= limit:
+                break
+
+        return [((x + offset_x, y + offset_y), thr) for (x, y), thr in found]
+
+    def find_all(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, roi=None) -> [((int, int), float)]:
+        """
+        Returns all occurrences of the template on the screenshot, ex.: [((849, 69), 0.8667161), ...]. If the template
+        is bigger than the screenshot, they swap roles like in cv2.matchTemplate.
+        :param roi: tuple (x, y, width, height), the template is searched only inside this region of the screenshot,
+                    None - on the whole screenshot
+        """
+        if scr_img.shape[0] < tmpl_img.shape[0] or scr_img.shape[1] < tmpl_img.shape[1]:
+            self.__height, self.__width = scr_img.shape[:2]
+        else:
+            self.__height, self.__width = tmpl_img.shape[:2]
+            if roi is not None:
+                scr_img, (offset_x, offset_y) = self.crop(scr_img, tmpl_img.shape, roi)
+                return [((x + offset_x, y + offset_y), thr) for (x, y), thr in self.find_all(scr_img, tmpl_img)]
+
+        started = self.__timer.start()
+        searching = self.match(scr_img, tmpl_img)
+        self.__timer.stop('match', started, tmpl_img)
+
+        started = self.__timer.start()
+        peaks = self.find_peaks(searching, self.__min_threshold, (self.__width, self.__height))
+        self.__timer.stop('peaks', started, tmpl_img, candidates=len(peaks))
+
+        started = self.__timer.start()
+        points = PointClusterer(self.__width, self.__height).cluster(peaks)
+        self.__timer.stop('cluster', started, tmpl_img)
+        return points
+
+    def find_all_many(self, scr_img: numpy.ndarray, tmpl_imgs, rois: list):
+        """
+        Yields all occurrences of every template from the iterable `tmpl_imgs` on the screenshot, in their order.
+        """
+        for tmpl_img, roi in zip(tmpl_imgs, rois):
+            yield self.find_all(scr_img, tmpl_img, roi)
+
+    def release(self):
+        """
+        Drops the data of the last screenshot, the matcher keeps nothing between calls.
+        """
+        pass
+
+
+class PyramidMatcher:
+    """
+    Coarse-to-fine variant of TemplateMatcher. The screenshot and the template are downscaled by 2 ** level
+    (Gaussian pyramid), the template is searched on the small screenshot with the threshold lowered by
+    `coarse_margin`, and only the regions around the coarse candidates are searched again at full resolution.
+    The correlation of the reported points is calculated at full resolution, so it is the same as in the exhaustive
+    search. Templates which become smaller than `min_coarse_side` on the coarse level and templates with transparent
+    pixels (the mask is lost on the coarse level) are searched exhaustively.
+    The pyramid of the screenshot is built once and reused for all templates searched on it.
+    """
+
+    min_coarse_side = 16
+    max_levels = 3
+
+    def __init__(self, min_threshold: float, coarse_margin=0.15, timer=None):
+        """
+        :param min_threshold: float
+        :param coarse_margin: float, how much the threshold is lowered on the coarse level, the bigger the margin,
+                              the less candidates are lost on the coarse level and the slower is the search
+        :param timer:         stage_timer.StageTimer, records the time of the stages, None - nothing is recorded
+        """
+        self.__min_threshold = min_threshold
+        self.__coarse_margin = coarse_margin
+        self.__timer = timer or NULL_TIMER
+        self.__exhaustive = TemplateMatcher(min_threshold, self.__timer)
+        self.__scr_img = None
+        self.__scr_levels = []   # [full resolution, 1/2, 1/4, ...]
+
+    def __levels_for(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray) -> int:
+        if scr_img.shape[0] < tmpl_img.shape[0] or scr_img.shape[1] < tmpl_img.shape[1]:
+            return 0
+        level = 0
+        min_side = min(tmpl_img.shape[:2])
+        while level < self.max_levels and min_side // 2 ** (level + 1) >= self.min_coarse_side:
+            level += 1
+        return level
+
+    def __screenshot_level(self, scr_img: numpy.ndarray, level: int) -> numpy.ndarray:
+        if scr_img is not self.__scr_img:
+            self.__scr_img = scr_img
+            self.__scr_levels = [scr_img]
+        while len(self.__scr_levels) <= level:
+            self.__scr_levels.append(cv2.pyrDown(self.__scr_levels[-1]))
+        return self.__scr_levels[level]
+
+    def find_all(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, roi=None) -> [((int, int), float)]:
+        """
+        Returns all occurrences of the template on the screenshot, ex.: [((849, 69), 0.8667161), ...].
+        :param roi: tuple (x, y, width, height), the region is small, so it is searched exhaustively
+        """
+        level = self.__levels_for(scr_img, tmpl_img)
+        if level == 0 or roi is not None or MaskedTemplate.is_masked(tmpl_img):
+            return self.__exhaustive.find_all(scr_img, tmpl_img, roi)
+
+        height, width = tmpl_img.shape[:2]
+        scale = 2 ** level
+        coarse_tmpl = tmpl_img
+        for _ in range(level):
+            coarse_tmpl = cv2.pyrDown(coarse_tmpl)
+        coarse_scr = self.__screenshot_level(scr_img, level)
+        if coarse_scr.shape[0] < coarse_tmpl.shape[0] or coarse_scr.shape[1] < coarse_tmpl.shape[1]:
+            return self.__exhaustive.find_all(scr_img, tmpl_img)
+
+        started = self.__timer.start()
+        coarse_map = TemplateMatcher.match(coarse_scr, coarse_tmpl)
+        self.__timer.stop('match', started, tmpl_img)
+        started = self.__timer.start()
+        candidates = TemplateMatcher.find_peaks(coarse_map, self.__min_threshold - self.__coarse_margin,
+                                                coarse_tmpl.shape[1::-1])
+        self.__timer.stop('peaks', started, tmpl_img)
+
+        # Every coarse point covers `scale` full resolution points, the error of the downscaling is about one more
+        # coarse point. The region is widened by half of the template, so non-maximum suppression near its edges
+        # sees the same neighbours as on the full map.
+        margin = 2 * scale
+        pad_x, pad_y = width // 2, height // 2
+        max_x, max_y = scr_img.shape[1] - width, scr_img.shape[0] - height
+        all_peaks = []
+        for coarse_x, coarse_y, _ in candidates:
+            x0, y0 = int(coarse_x) * scale - margin, int(coarse_y) * scale - margin
+            x1, y1 = int(coarse_x) * scale + margin, int(coarse_y) * scale + margin
+            roi_x0, roi_y0 = max(0, x0 - pad_x), max(0, y0 - pad_y)
+            roi_x1, roi_y1 = min(max_x, x1 + pad_x), min(max_y, y1 + pad_y)
+            if roi_x0 > roi_x1 or roi_y0 > roi_y1:
+                continue
+
+            roi = scr_img[roi_y0:roi_y1 + height, roi_x0:roi_x1 + width]   # View, no copy
+            started = self.__timer.start()
+            searching = TemplateMatcher.match(roi, tmpl_img)
+            self.__timer.stop('match', started, tmpl_img)
+            started = self.__timer.start()
+            peaks = TemplateMatcher.find_peaks(searching, self.__min_threshold, (width, height))
+            peaks[:, 0] += roi_x0
+            peaks[:, 1] += roi_y0
+            inside = (peaks[:, 0] >= x0) & (peaks[:, 0] <= x1) & (peaks[:, 1] >= y0) & (peaks[:, 1] <= y1)
+            all_peaks.append(peaks[inside])
+            self.__timer.stop('peaks', started, tmpl_img, candidates=int(numpy.count_nonzero(inside)))
+
+        if not all_peaks:
+            return []
+        started = self.__timer.start()
+        points = PointClusterer(width, height).cluster(numpy.concatenate(all_peaks))
+        self.__timer.stop('cluster', started, tmpl_img)
+        return points
+
+    def find_all_many(self, scr_img: numpy.ndarray, tmpl_imgs, rois: list):
+        """
+        Yields all occurrences of every template from the iterable `tmpl_imgs` on the screenshot, in their order.
+        """
+        for tmpl_img, roi in zip(tmpl_imgs, rois):
+            yield self.find_all(scr_img, tmpl_img, roi)
+
+    def find_first(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, limit: int, roi=None) -> \
+            [((int, int), float)]:
+        """
+        Returns up to `limit` best occurrences of the template. The coarse-to-fine search is already cheap, so all
+        occurrences are found and the best ones are returned.
+        """
+        return self.find_all(scr_img, tmpl_img, roi)[:max(0, limit)]
+
+    def release(self):
+        """
+        Drops the pyramid of the last screenshot.
+        """
+        self.__scr_img = None
+        self.__scr_levels = []
+
+    def recall_report(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, precision: float) -> dict:
+        """
+        Compares the pyramid search with the exhaustive one. A point of the exhaustive search is recalled if the pyramid
+        search found the same point with the correlation which differs not more than `precision`.
+        :return: dict, {'expected': int, 'recalled': int, 'recall': float, 'missed': [((x, y), threshold), ...],
+                        'extra': [((x, y), threshold), ...]}
+        """
+        expected = self.__exhaustive.find_all(scr_img, tmpl_img)
+        found = dict(self.find_all(scr_img, tmpl_img))
+        missed = [pt for pt in expected if pt[0] not in found or abs(found[pt[0]] - pt[1]) > precision]
+        expected_coords = {pt[0] for pt in expected}
+        extra = [pt for pt in found.items() if pt[0] not in expected_coords]
+
+        return {'expected': len(expected),
+                'recalled': len(expected) - len(missed),
+                'recall': 1.0 if not expected else (len(expected) - len(missed)) / len(expected),
+                'missed': missed,
+                'extra': extra}
+
+
+class FFTMatcher:
+    """
+    Variant of TemplateMatcher which calculates the same normalized correlation (TM_CCOEFF_NORMED) through the DFT.
+    For a template T with n pixels and a window W of the screenshot:
+        R = sum((T - mean(T)) * W) / sqrt(sum((T - mean(T)) ** 2) * (sum(W ** 2) - sum(W) ** 2 / n))
+    the numerator is the correlation of the screenshot with the zero-mean template (inverse DFT of the product of
+    the spectra), the sums of the windows are exact integer box sums. The spectrum of the screenshot is calculated
+    once per screenshot, so every template costs one forward and one inverse DFT of the screenshot size, while
+    cv2.matchTemplate transforms the screenshot for every template again. The DFTs are calculated for all rows: with
+    `nonzeroRows` OpenCV leaves its fast path and the same DFT is 3 - 4 times slower.
+    The norms of the windows depend only on the size of the template, find_all_many() takes templates in batches of
+    `batch_size` and searches every batch grouped by the size, so they are calculated once per size in a batch and
+    only the norms of the last `max_window_norms` sizes are kept.
+    Windows without contrast get 0 and a template without contrast gets 1 everywhere, like in cv2.matchTemplate.
+    Templates with a region of interest are searched exhaustively, the region is small, and so are templates with
+    transparent pixels and images which are not 8-bit.
+    """
+
+    batch_size = 32
+    max_window_norms = 4
+
+    def __init__(self, min_threshold: float, timer=None):
+        """
+        :param min_threshold: float
+        :param timer:         stage_timer.StageTimer, records the time of the stages, None - nothing is recorded
+        """
+        self.__min_threshold = min_threshold
+        self.__timer = timer or NULL_TIMER
+        self.__exhaustive = TemplateMatcher(min_threshold, self.__timer)
+        self.__scr_img = None
+        self.__fft_shape = None
+        self.__scr_spectrum = None
+        self.__scr_squares = None
+        self.__d_window_norms = collections.OrderedDict()   # {(height, width): 1 / sqrt(variances * n) or 0, ...}
+
+    def __prepare_screenshot(self, scr_img: numpy.ndarray):
+        if scr_img is self.__scr_img:
+            return
+        height, width = scr_img.shape[:2]
+        self.__fft_shape = (cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width))
+        padded = numpy.zeros(self.__fft_shape, dtype=numpy.float32)
+        padded[:height, :width] = scr_img
+        self.__scr_spectrum = cv2.dft(padded)
+        self.__scr_squares = cv2.multiply(scr_img, scr_img, dtype=cv2.CV_16U)
+        self.__d_window_norms = collections.OrderedDict()
+        self.__scr_img = scr_img
+
+    def __window_norm(self, height: int, width: int) -> numpy.ndarray:
+        """
+        :return: numpy.ndarray of float32, 1 / sqrt(sum(W ** 2) - sum(W) ** 2 / n) of every window, 0 - no contrast
+        """
+        window_norm = self.__d_window_norms.get((height, width))
+        if window_norm is not None:
+            self.__d_window_norms.move_to_end((height, width))
+            return window_norm
+
+        # Every step is one pass of OpenCV, NumPy would make a temporary array of every operation
+        count = height * width
+        map_h, map_w = self.__scr_img.shape[0] - height + 1, self.__scr_img.shape[1] - width + 1
+        window_sum = cv2.boxFilter(self.__scr_img, cv2.CV_32S, (width, height), anchor=(0, 0), normalize=False,
+                                   borderType=cv2.BORDER_CONSTANT)[:map_h, :map_w]
+        if count * 255 ** 2 < 2 ** 31:
+            squares, depth = self.__scr_squares, cv2.CV_32S
+        else:   # boxFilter sums 16-bit images in 32-bit integers even to CV_64F, float32 ones in float64
+            squares, depth = self.__scr_squares.astype(numpy.float32), cv2.CV_64F
+        window_sqsum = cv2.boxFilter(squares, depth, (width, height), anchor=(0, 0), normalize=False,
+                                     borderType=cv2.BORDER_CONSTANT)[:map_h, :map_w]
+        window_var = cv2.subtract(window_sqsum, cv2.multiply(window_sum, window_sum, scale=1 / count,
+                                                             dtype=cv2.CV_64F), dtype=cv2.CV_64F)
+        # The sums are exact, sum(W ** 2) - sum(W) ** 2 / n of an 8-bit window with contrast is at least (n - 1) / n,
+        # so the windows below 0.25 are flat ones with the rounding noise, they get 0 like in cv2.matchTemplate
+        window_var = cv2.threshold(window_var.astype(numpy.float32), 0.25, 0, cv2.THRESH_TOZERO)[1]
+        window_norm = cv2.divide(1.0, cv2.sqrt(window_var))   # inf for flat windows
+        window_norm = cv2.threshold(window_norm, 2, 0, cv2.THRESH_TOZERO_INV)[1]
+
+        self.__d_window_norms[(height, width)] = window_norm
+        while len(self.__d_window_norms) > self.max_window_norms:
+            self.__d_window_norms.popitem(last=False)
+        return window_norm
+
+    def match_many(self, scr_img: numpy.ndarray, tmpl_imgs: [numpy.ndarray]) -> [numpy.ndarray]:
+        """
+        Returns the correlation maps of all templates, they are the same as cv2.matchTemplate(..., TM_CCOEFF_NORMED)
+        returns within float rounding. Every template should be an 8-bit image not bigger than the screenshot.
+        Templates are processed grouped by their size, the maps are returned in the order of `tmpl_imgs`.
+        """
+        self.__prepare_screenshot(scr_img)
+        scr_h, scr_w = scr_img.shape[:2]
+        maps = [None] * len(tmpl_imgs)
+        for idx in sorted(range(len(tmpl_imgs)), key=lambda idx: tmpl_imgs[idx].shape[:2]):
+            tmpl_img = tmpl_imgs[idx]
+            started = self.__timer.start()
+            height, width = tmpl_img.shape[:2]
+            zero_mean = tmpl_img.astype(numpy.float64)
+            zero_mean -= zero_mean.mean()
+            tmpl_norm = float(numpy.sum(zero_mean ** 2))
+            if tmpl_norm < numpy.finfo(numpy.float64).eps * height * width:
+                maps[idx] = numpy.ones((scr_h - height + 1, scr_w - width + 1), dtype=numpy.float32)
+                self.__timer.stop('match', started, tmpl_img)
+                continue
+
+            padded = numpy.zeros(self.__fft_shape, dtype=numpy.float32)
+            padded[:height, :width] = zero_mean
+            spectrum = cv2.mulSpectrums(self.__scr_spectrum, cv2.dft(padded), 0, conjB=True)
+            result = cv2.idft(spectrum, flags=cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT)[:scr_h - height + 1,
+                                                                                  :scr_w - width + 1]
+            result = cv2.multiply(result, self.__window_norm(height, width), scale=1 / math.sqrt(tmpl_norm))
+            maps[idx] = numpy.clip(result, -1, 1, out=result)
+            self.__timer.stop('match', started, tmpl_img)
+
+        return maps
+
+    def __fits(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, roi) -> bool:
+        return roi is None and scr_img.shape[0] >= tmpl_img.shape[0] and scr_img.shape[1] >= tmpl_img.shape[1] and \
+            scr_img.dtype == numpy.uint8 and tmpl_img.dtype == numpy.uint8 and not MaskedTemplate.is_masked(tmpl_img)
+
+    def __points(self, searching: numpy.ndarray, tmpl_img: numpy.ndarray) -> [((int, int), float)]:
+        height, width = tmpl_img.shape[:2]
+        started = self.__timer.start()
+        peaks = TemplateMatcher.find_peaks(searching, self.__min_threshold, (width, height))
+        self.__timer.stop('peaks', started, tmpl_img, candidates=len(peaks))
+        started = self.__timer.start()
+        points = PointClusterer(width, height).cluster(peaks)
+        self.__timer.stop('cluster', started, tmpl_img)
+        return points
+
+    def find_first(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, limit: int, roi=None) -> \
+            [((int, int), float)]:
+        """
+        Returns up to `limit` best occurrences of the template, the suppression stops as soon as they are found.
+        """
+        if not self.__fits(scr_img, tmpl_img, roi):
+            return self.__exhaustive.find_first(scr_img, tmpl_img, limit, roi)
+        searching = self.match_many(scr_img, [tmpl_img])[0]
+        height, width = tmpl_img.shape[:2]
+        found = []
+        started = self.__timer.start()
+        TemplateMatcher.take_first(searching, self.__min_threshold, PointClusterer(width, height).search_area,
+                                   limit, found)
+        self.__timer.stop('peaks', started, tmpl_img, candidates=len(found))
+        return found
+
+    def find_all(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, roi=None) -> [((int, int), float)]:
+        """
+        Returns all occurrences of the template on the screenshot, ex.: [((849, 69), 0.8667161), ...].
+        """
+        if not self.__fits(scr_img, tmpl_img, roi):
+            return self.__exhaustive.find_all(scr_img, tmpl_img, roi)
+        return self.__points(self.match_many(scr_img, [tmpl_img])[0], tmpl_img)
+
+    def find_all_many(self, scr_img: numpy.ndarray, tmpl_imgs, rois: list):
+        """
+        Yields all occurrences of every template from the iterable `tmpl_imgs` on the screenshot, in their order.
+        Templates of a batch are searched grouped by their size, only the found points wait until they are yielded.
+        """
+        tmpl_imgs = iter(tmpl_imgs)
+        rois = iter(rois)
+        while True:
+            batch = list(itertools.islice(zip(tmpl_imgs, rois), self.batch_size))
+            if not batch:
+                return
+            d_points = dict()
+            for idx in sorted(range(len(batch)), key=lambda idx: batch[idx][0].shape[:2]):
+                d_points[idx] = self.find_all(scr_img, *batch[idx])
+            for idx in range(len(batch)):
+                yield d_points.pop(idx)
+
+    def release(self):
+        """
+        Drops the spectrum and the window norms of the last screenshot.
+        """
+        self.__scr_img = None
+        self.__fft_shape = None
+        self.__scr_spectrum = None
+        self.__scr_squares = None
+        self.__d_window_norms = collections.OrderedDict()
+
+
+# Search engines which can be chosen for a run, all of them have find_all() and find_all_many()
+ENGINES = {'opencv': TemplateMatcher,
+           'pyramid': PyramidMatcher,
+           'fft': FFTMatcher}
+
+
+class MultiScaleMatcher:
+    """
+    The class searches for the template at several scales, ex.: a template captured at 100% DPI on screenshots taken
+    at 125% or 150% DPI. Scale s means that the template is s times bigger on the screenshot, so the screenshot is
+    resized by 1 / s and the template is searched on it by the usual engine. Resized screenshots are built once per
+    screenshot and shared by all templates, every scale has its own engine, so caches of the engines (the pyramid,
+    the spectrum) are reused too. Points are converted back to the coordinates of the original screenshot and
+    the occurrences found at several scales are clustered, the scale with the best correlation wins. Found points
+    have the third item - the scale: ((x, y), threshold, scale).
+    """
+
+    def __init__(self, min_threshold: float, scales: [float], engine='opencv', timer=None):
+        """
+        :param min_threshold: float
+        :param scales:        list of float, ex.: [0.8, 1.0, 1.25, 1.5]
+        :param engine:        str, key of ENGINES which searches at every scale
+        :param timer:         stage_timer.StageTimer, records the time of the stages, None - nothing is recorded
+        """
+        self.__scales = sorted(set(scales))
+        self.__timer = timer or NULL_TIMER
+        self.__d_matchers = {scale: ENGINES[engine](min_threshold, timer=self.__timer) for scale in self.__scales}
+        self.__scr_img = None
+        self.__d_scr_imgs = dict()   # {scale: resized screenshot, ...}
+
+    @staticmethod
+    def parse_scales(text: str) -> [float]:
+        """
+        Parses the list of scales: '0.8,1,1.25,1.5' or the range 'start:stop:step', ex.: '0.8:1.5:0.1'.
+        """
+        text = text.strip()
+        try:
+            if ':' in text:
+                start, stop, step = (float(value) for value in text.split(':'))
+                if step <= 0:
+                    raise ValueError
+                count = int(round((stop - start) / step)) + 1
+                scales = [round(start + idx * step, 4) for idx in range(count)]
+            else:
+                scales = [float(value) for value in text.split(',') if value.strip()]
+        except ValueError:
+            error = f'scales={text} but it should be a comma separated list or start:stop:step, ex.: 0.8,1,1.25'
+            raise ValueError(error)
+        if not scales or any(not (0.1 <= scale <= 10) for scale in scales):
+            error = f'scales={text} but every scale should be in range 0.1 - 10'
+            raise ValueError(error)
+
+        return scales
+
+    def __screenshot_at(self, scr_img: numpy.ndarray, scale: float) -> numpy.ndarray:
+        if scr_img is not self.__scr_img:
+            self.__scr_img = scr_img
+            self.__d_scr_imgs = {1.0: scr_img}
+        if scale not in self.__d_scr_imgs:
+            started = self.__timer.start()
+            interpolation = cv2.INTER_AREA if scale > 1 else cv2.INTER_LINEAR
+            self.__d_scr_imgs[scale] = cv2.resize(scr_img, None, fx=1 / scale, fy=1 / scale,
+                                                  interpolation=interpolation)
+            self.__timer.stop('resize', started)
+        return self.__d_scr_imgs[scale]
+
+    def find_all(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, roi=None) -> [((int, int), float, float)]:
+        """
+        Returns all occurrences of the template at all scales, ex.: [((849, 69), 0.8667161, 1.25), ...].
+        :param roi: tuple (x, y, width, height) in the coordinates of the original screenshot
+        """
+        all_peaks = []
+        for scale in self.__scales:
+            scaled_scr = self.__screenshot_at(scr_img, scale)
+            if scale != 1.0 and (scaled_scr.shape[0] < tmpl_img.shape[0] or scaled_scr.shape[1] < tmpl_img.shape[1]):
+                continue   # Roles are swapped only at the original scale, as in the single scale search
+            scaled_roi = None if roi is None else tuple(int(round(value / scale)) for value in roi)
+            for (x, y), thr in self.__d_matchers[scale].find_all(scaled_scr, tmpl_img, scaled_roi):
+                all_peaks.append((round(x * scale), round(y * scale), thr, scale))
+
+        if not all_peaks:
+            return []
+        height, width = tmpl_img.shape[:2]
+        min_scale = self.__scales[0]
+        started = self.__timer.start()
+        points = PointClusterer(max(1, int(width * min_scale)), max(1, int(height * min_scale))).cluster(
+            numpy.array(all_peaks, dtype=numpy.float64))
+        self.__timer.stop('cluster', started, tmpl_img)
+        return points
+
+    def find_first(self, scr_img: numpy.ndarray, tmpl_img: numpy.ndarray, limit: int, roi=None) -> \
+            [((int, int), float, float)]:
+        """
+        Returns up to `limit` occurrences of the template, ex.: [((849, 69), 0.8667161, 1.25)]. Scales are searched
+        from the nearest to 1 and the search stops as soon as `limit` occurrences are found.
+        """
+        height, width = tmpl_img.shape[:2]
+        area_w, area_h = PointClusterer(width, height).search_area
+        found = []
+        for scale in sorted(self.__scales, key=lambda value: abs(value - 1)):
+            if len(found) >= limit:
+                break
+            scaled_scr = self.__screenshot_at(scr_img, scale)
+            if scale != 1.0 and (scaled_scr.shape[0] < tmpl_img.shape[0] or scaled_scr.shape[1] < tmpl_img.shape[1]):
+                continue
+            scaled_roi = None if roi is None else tuple(int(round(value / scale)) for value in roi)
+            for (x, y), thr in self.__d_matchers[scale].find_first(scaled_scr, tmpl_img, limit - len(found),
+                                                                   scaled_roi):
+                x, y = round(x * scale), round(y * scale)
+                if all(abs(x - found_x) >= area_w or abs(y - found_y) >= area_h for (found_x, found_y), *_ in found):
+                    found.append(((x, y), thr, scale))
+
+        return found[:limit]
+
+    def find_all_many(self, scr_img: numpy.ndarray, tmpl_imgs, rois: list):
+        """
+        Yields all occurrences of every template from the iterable `tmpl_imgs` on the screenshot, in their order.
+        """
+        for tmpl_img, roi in zip(tmpl_imgs, rois):
+            yield self.find_all(scr_img, tmpl_img, roi)
+
+    def release(self):
+        """
+        Drops the resized copies of the last screenshot and the data of the matchers of all scales.
+        """
+        self.__scr_img = None
+        self.__d_scr_imgs = dict()
+        for matcher in self.__d_matchers.values():
+            matcher.release()
+
+
+def make_matcher(engine: str, min_threshold: float, scales=None, timer=None):
+    """
+    Creates the matcher of the engine, MultiScaleMatcher if there are other scales than 1.
+    :param scales: list of float or None - only the original scale
+    """
+    if scales and list(scales) != [1.0]:
+        return MultiScaleMatcher(min_threshold, scales, engine, timer)
+    return ENGINES[engine](min_threshold, timer=timer)
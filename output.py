@@ -0,0 +1,132 @@
+import csv
+import json
+
+
+class OutputWriter:
+    """
+    Base class of the output backends. A backend gets the results of every template on every screenshot and writes
+    them to the file through a big buffer, the file is flushed after every screenshot. Optionally every record is
+    printed to the console too.
+    Order of calls: start_screenshot(), write_template() for every template, end_screenshot(), ..., close().
+    """
+
+    buffer_size = 1024 * 1024
+    default_extension = 'txt'
+
+    def __init__(self, path: str, quiet=False, with_scale=False, with_colour=False):
+        """
+        :param path:        str, path to the output file, results are added to the end of the file
+        :param quiet:       bool, do not print results to the console
+        :param with_scale:  bool, hits have the scale of the multi-scale search: (x, y, threshold, scale)
+        :param with_colour: bool, hits have the colour score as the last item: (x, y, threshold, [scale,] colour)
+        """
+        self.__file = open(path, 'at', encoding='utf-8', buffering=self.buffer_size, newline='')
+        self.__quiet = quiet
+        self.__with_scale = with_scale
+        self.__with_colour = with_colour
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def file(self):
+        return self.__file
+
+    @property
+    def quiet(self):
+        return self.__quiet
+
+    @property
+    def with_scale(self):
+        return self.__with_scale
+
+    @property
+    def with_colour(self):
+        return self.__with_colour
+
+    def write(self, text: str):
+        self.__file.write(text)
+
+    def start_screenshot(self, scr_path: str):
+        pass
+
+    def write_template(self, scr_path: str, tmpl_path: str, tmpl_name: str, hits: [(int, int, float)],
+                       time_ms: float):
+        """
+        :param scr_path:  str, path to the screenshot
+        :param tmpl_path: str, path to the template
+        :param tmpl_name: str, file name of the template with subdirs inside the templates folder
+        :param hits:      list, [(x, y, threshold), ...] or [(x, y, threshold, scale), ...] if `with_scale`,
+                          the colour score is the last item if `with_colour`, empty if the template is not found
+        :param time_ms:   float, time spent on the template in milliseconds
+        """
+        raise NotImplementedError
+
+    def end_screenshot(self):
+        self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+
+class JsonlWriter(OutputWriter):
+    """
+    Writes one JSON object per line for every found occurrence of the template, ex.:
+    {"screenshot": "i1.png", "template": "sub/e.png", "count": 2, "threshold": 0.8136, "x": 994, "y": 2, "time_ms": 3.1}
+    A template which is not found gets one line with count 0 and null threshold and coordinates. The multi-scale search
+    adds the "scale" field, the colour mode adds the "colour" field.
+    """
+
+    default_extension = 'jsonl'
+
+    def write_template(self, scr_path: str, tmpl_path: str, tmpl_name: str, hits: [(int, int, float)],
+                       time_ms: float):
+        for hit in hits or [(None, None, None, None)]:
+            record = {'screenshot': scr_path,
+                      'template': tmpl_name,
+                      'count': len(hits),
+                      'threshold': hit[2],
+                      'x': hit[0],
+                      'y': hit[1],
+                      'time_ms': round(time_ms, 3)}
+            if self.with_scale:
+                record['scale'] = hit[3]
+            if self.with_colour:
+                record['colour'] = hit[-1]
+            line = json.dumps(record, ensure_ascii=False)
+            self.write(line + '\n')
+            if not self.quiet:
+                print(line)
+
+
+class CsvWriter(OutputWriter):
+    """
+    Writes one CSV row for every found occurrence of the template, the header is written to the new file only.
+    A template which is not found gets one row with count 0 and empty threshold and coordinates. The multi-scale search
+    adds the scale column, the colour mode adds the colour column.
+    """
+
+    default_extension = 'csv'
+    header = ('screenshot', 'template', 'count', 'threshold', 'x', 'y', 'time_ms')
+
+    def __init__(self, path: str, quiet=False, with_scale=False, with_colour=False):
+        super().__init__(path, quiet, with_scale, with_colour)
+        self.__csv = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.__csv.writerow(self.header + (('scale',) if with_scale else ()) +
+                                (('colour',) if with_colour else ()))
+
+    def write_template(self, scr_path: str, tmpl_path: str, tmpl_name: str, hits: [(int, int, float)],
+                       time_ms: float):
+        for hit in hits or [('', '', '', '', '')]:
+            row = (scr_path, tmpl_name, len(hits), hit[2], hit[0], hit[1], round(time_ms, 3))
+            if self.with_scale:
+                row += (hit[3],)
+            if self.with_colour:
+                row += (hit[-1],)
+            self.__csv.writerow(row)
+            if not self.quiet:
+                print(','.join(map(str, row)))
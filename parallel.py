@@ -0,0 +1,105 @@
+import concurrent.futures
+from multiprocessing import shared_memory
+import numpy
+from matching import ENGINES, make_matcher
+from tmpl_cache import TemplateCache
+
+
+class _MatchWorker:
+    """
+    Lives in every worker process of ParallelMatcher. Keeps the matcher, the template cache of the process and
+    the view of the current screenshot in shared memory, so the screenshot is attached only once for all its jobs.
+    """
+
+    def __init__(self, min_threshold: float, cache_mb, engine: str, scales):
+        self.__matcher = make_matcher(engine, min_threshold, scales)
+        self.__tmpl_cache = TemplateCache(cache_mb)
+        self.__shm = None
+        self.__scr_img = None
+
+    def __attach_screenshot(self, shm_name: str, shape: tuple) -> numpy.ndarray:
+        if self.__shm is None or self.__shm.name != shm_name:
+            if self.__shm is not None:
+                self.__scr_img = None
+                self.__shm.close()
+            self.__shm = shared_memory.SharedMemory(name=shm_name)
+            self.__scr_img = numpy.ndarray(shape, dtype=numpy.uint8, buffer=self.__shm.buf)
+        return self.__scr_img
+
+    def run_job(self, job: (str, tuple, str, tuple)) -> [((int, int), float)]:
+        shm_name, shape, tmpl_path, roi = job
+        scr_img = self.__attach_screenshot(shm_name, shape)
+        tmpl_img = self.__tmpl_cache.get(tmpl_path)
+        return self.__matcher.find_all(scr_img, tmpl_img, roi)
+
+
+_worker = None   # _MatchWorker of the current worker process
+
+
+def _init_worker(min_threshold: float, cache_mb, engine: str, scales):
+    global _worker
+    _worker = _MatchWorker(min_threshold, cache_mb, engine, scales)
+
+
+def _run_job(job: (str, tuple, str, tuple)) -> [((int, int), float)]:
+    return _worker.run_job(job)
+
+
+class ParallelMatcher:
+    """
+    The class fans (screenshot, template) jobs out across a pool of processes. The decoded screenshot is placed into
+    shared memory once and every worker reads it from there, only the template path is sent with a job. Results are
+    returned in the order of the templates, so the output does not depend on the number of workers.
+    Usage:
+        with ParallelMatcher(4, 0.6) as pool:
+            results = pool.find_all(scr_img_gray, tmpl_paths)
+    """
+
+    def __init__(self, workers: int, min_threshold: float, cache_mb=None, engine='opencv', scales=None):
+        """
+        :param workers:       int, number of worker processes
+        :param min_threshold: float
+        :param cache_mb:      int or float, memory budget for decoded templates of each worker in megabytes
+        :param engine:        str, search engine, one of matching.ENGINES
+        :param scales:        list of float, scales of the multi-scale search, None - only the original scale
+        """
+        if not isinstance(workers, int) or workers < 1:
+            error = f'workers={workers} but it should be a positive integer'
+            raise ValueError(error)
+        if engine not in ENGINES:
+            error = f'engine={engine} but it should be one of: {", ".join(ENGINES)}'
+            raise ValueError(error)
+
+        self.__workers = workers
+        self.__executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                                 initializer=_init_worker,
+                                                                 initargs=(min_threshold, cache_mb, engine, scales))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+
+    def find_all(self, scr_img: numpy.ndarray, tmpl_paths: [str], rois=None):
+        """
+        Searches all templates on one screenshot. Yields the list of found points for every template, in the same
+        order as `tmpl_paths`, as soon as it is ready. If the generator is closed before the end, the jobs which
+        have not started yet are cancelled.
+        :param rois: list of regions of interest (x, y, width, height) or None for every template, None - search
+                     all templates on the whole screenshot
+        """
+        scr_img = numpy.ascontiguousarray(scr_img, dtype=numpy.uint8)
+        shm = shared_memory.SharedMemory(create=True, size=max(scr_img.nbytes, 1))
+        try:
+            numpy.ndarray(scr_img.shape, dtype=numpy.uint8, buffer=shm.buf)[...] = scr_img
+            rois = rois if rois is not None else [None] * len(tmpl_paths)
+            jobs = [(shm.name, scr_img.shape, tmpl_path, roi) for tmpl_path, roi in zip(tmpl_paths, rois)]
+            chunksize = max(1, len(jobs) // (self.__workers * 4))
+            yield from self.__executor.map(_run_job, jobs, chunksize=chunksize)
+        finally:
+            shm.close()
+            shm.unlink()
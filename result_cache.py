@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from atlas import TemplateAtlas
+
+
+class ResultCache:
+    """
+    Persistent cache of search results, stored in SQLite database next to the file with thresholds. The key of
+    a result is the hash of the content of the screenshot and the template files, the minimum threshold and
+    the method of the search, so a pair is served from the cache only if none of them has changed. The value is the list
+    of clustered points. Content hashes of files are stored too and recalculated only when the modification time or
+    the size of the file changes. Results which were not used for `max_age_days` are deleted when the cache is opened,
+    then the least recently used ones are deleted while there are more than `max_entries` results or they take more
+    than `max_mb` megabytes (keys and points, a template found many times costs more than a row). SQLite reuses
+    the pages of the deleted rows, so the file stops growing at about this size but does not shrink.
+    Outcomes of the pass/fail checks of screenshots and templates are stored too, so the ones which failed recently
+    are checked first next time.
+    """
+
+    version = 3   # Change it when the search algorithm changes, it invalidates all stored results
+    default_filename = 'check_images.cache.sqlite'
+
+    def __init__(self, path: str, max_age_days=30, max_entries=200000, max_mb=256):
+        """
+        :param path:         str, path to the database file
+        :param max_age_days: int or float, results which were not used longer are deleted
+        :param max_entries:  int, maximum number of stored results (rows)
+        :param max_mb:       int or float, maximum size of stored results in megabytes
+        """
+        self.__path = path
+        self.__max_age = max_age_days * 24 * 3600
+        self.__max_entries = max_entries
+        self.__max_bytes = int(max_mb * 1024 * 1024)
+        self.__lock = threading.Lock()
+        self.__d_file_hashes = dict()   # {(path, mtime, size): hash, ...}
+
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.executescript("""
+            CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, points TEXT NOT NULL, used_at REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at);
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, size INTEGER NOT NULL,
+                                              digest TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS outcomes (path TEXT PRIMARY KEY, runs INTEGER NOT NULL,
+                                                 failures INTEGER NOT NULL, failed_at REAL);
+        """)
+        self.__evict()
+
+    @classmethod
+    def next_to(cls, thresholds_path: str, **kwargs):
+        """
+        Opens the cache in the folder of the file with thresholds.
+        """
+        folder = os.path.dirname(os.path.abspath(thresholds_path))
+        return cls(os.path.join(folder, cls.default_filename), **kwargs)
+
+    def __evict(self):
+        with self.__lock, self.__connection:
+            self.__connection.execute('DELETE FROM results WHERE used_at < ?', (time.time() - self.__max_age,))
+            count = self.__connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            if count > self.__max_entries:
+                self.__connection.execute('DELETE FROM results WHERE key IN '
+                                          '(SELECT key FROM results ORDER BY used_at LIMIT ?)',
+                                          (count - self.__max_entries,))
+            size = self.__connection.execute('SELECT SUM(LENGTH(key) + LENGTH(points)) FROM results').fetchone()[0]
+            if size is not None and size > self.__max_bytes:
+                # Running total from the most recently used result, the ones beyond the budget are deleted
+                self.__connection.execute('DELETE FROM results WHERE key IN (SELECT key FROM '
+                                          '(SELECT key, SUM(LENGTH(key) + LENGTH(points)) OVER '
+                                          '(ORDER BY used_at DESC, key ROWS UNBOUNDED PRECEDING) AS total '
+                                          'FROM results) WHERE total > ?)',
+                                          (self.__max_bytes,))
+
+    def file_hash(self, path: str) -> str:
+        """
+        Returns the hash of the content of the file. The file is read only if it has changed since the last time.
+        The hash of a template of an atlas is taken from the atlas, it is the hash of the source file.
+        """
+        member = TemplateAtlas.member(path)
+        if member is not None:
+            atlas, name = member
+            return atlas.digest(name)
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stat_key = (path, stat.st_mtime_ns, stat.st_size)
+        digest = self.__d_file_hashes.get(stat_key)
+        if digest is not None:
+            return digest
+
+        with self.__lock:
+            row = self.__connection.execute('SELECT mtime, size, digest FROM files WHERE path = ?',
+                                            (path,)).fetchone()
+        if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            digest = row[2]
+        else:
+            sha = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            with self.__lock, self.__connection:
+                self.__connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                          (path, stat.st_mtime_ns, stat.st_size, digest))
+
+        self.__d_file_hashes[stat_key] = digest
+        return digest
+
+    def make_key(self, scr_path: str, tmpl_path: str, min_threshold: float, method: str, roi=None) -> str:
+        """
+        :param method: str, the search method including the engine, ex.: 'TM_CCOEFF_NORMED/pyramid', the thresholds of
+                       the engines may differ in the last digits, so their results are never shared
+        """
+        key = f'{self.version}|{self.file_hash(scr_path)}|{self.file_hash(tmpl_path)}|{min_threshold!r}|{method}' \
+              f'|{roi}'
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys: [str]) -> dict:
+        """
+        :return: dict, {key: [((x, y), threshold), ...], ...} only for the keys which are in the cache, points of
+                 the multi-scale search have the scale too: ((x, y), threshold, scale)
+        """
+        d_found = dict()
+        now = time.time()
+        with self.__lock, self.__connection:
+            for start in range(0, len(keys), 500):   # SQLite limits the number of parameters in one query
+                part = keys[start:start + 500]
+                marks = ','.join('?' * len(part))
+                for key, points in self.__connection.execute(
+                        f'SELECT key, points FROM results WHERE key IN ({marks})', part):
+                    d_found[key] = [((row[0], row[1]), row[2]) + tuple(row[3:]) for row in json.loads(points)]
+            self.__connection.executemany('UPDATE results SET used_at = ? WHERE key = ?',
+                                          ((now, key) for key in d_found))
+        return d_found
+
+    def put_many(self, d_results: dict):
+        """
+        :param d_results: dict, {key: [((x, y), threshold), ...], ...}
+        """
+        now = time.time()
+        rows = [(key, json.dumps([[int(pt[0][0]), int(pt[0][1]), float(pt[1])] + [float(value) for value in pt[2:]]
+                                  for pt in points]), now)
+                for key, points in d_results.items()]
+        with self.__lock, self.__connection:
+            self.__connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', rows)
+
+    def has_all(self, scr_path: str, tmpl_paths: [str], min_threshold: float, method: str, rois=None) -> bool:
+        """
+        Returns True if results of all templates on the screenshot are in the cache, so the screenshot is not needed.
+        """
+        rois = rois if rois is not None else [None] * len(tmpl_paths)
+        keys = list({self.make_key(scr_path, tmpl_path, min_threshold, method, roi)
+                     for tmpl_path, roi in zip(tmpl_paths, rois)})
+        found = 0
+        with self.__lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                marks = ','.join('?' * len(part))
+                found += self.__connection.execute(f'SELECT COUNT(*) FROM results WHERE key IN ({marks})',
+                                                   part).fetchone()[0]
+        return found == len(keys)
+
+    def find_all(self, scr_path: str, tmpl_paths: [str], min_threshold: float, method: str, find_missing, rois=None):
+        """
+        Yields found points for every template in the order of `tmpl_paths`. Results of unchanged pairs are taken
+        from the cache, the rest are calculated by `find_missing` and stored.
+        :param find_missing: callable([str]) -> iterable, yields found points for the given templates in their order
+        :param rois:         list of regions of interest of the templates, they are a part of the key
+        """
+        rois = rois if rois is not None else [None] * len(tmpl_paths)
+        keys = [self.make_key(scr_path, tmpl_path, min_threshold, method, roi)
+                for tmpl_path, roi in zip(tmpl_paths, rois)]
+        d_cached = self.get_many(keys)
+        missing = [tmpl_path for tmpl_path, key in zip(tmpl_paths, keys) if key not in d_cached]
+
+        d_new = dict()
+        calculated = iter(find_missing(missing)) if missing else iter(())
+        try:
+            for key in keys:
+                if key in d_cached:
+                    yield d_cached[key]
+                else:
+                    points = next(calculated)
+                    d_new[key] = points
+                    yield points
+        finally:
+            self.put_many(d_new)
+
+    def record_outcomes(self, d_outcomes: dict):
+        """
+        :param d_outcomes: dict, {path to the screenshot or template: bool, True - passed, ...}
+        """
+        now = time.time()
+        with self.__lock, self.__connection:
+            for path, passed in d_outcomes.items():
+                path = os.path.abspath(path)
+                self.__connection.execute('INSERT OR IGNORE INTO outcomes VALUES (?, 0, 0, NULL)', (path,))
+                if passed:
+                    self.__connection.execute('UPDATE outcomes SET runs = runs + 1 WHERE path = ?', (path,))
+                else:
+                    self.__connection.execute('UPDATE outcomes SET runs = runs + 1, failures = failures + 1, '
+                                              'failed_at = ? WHERE path = ?', (now, path))
+
+    def failure_stats(self, paths: [str]) -> dict:
+        """
+        :return: dict, {path: (share of failed checks, time of the last failure or 0), ...} only for the paths which
+                 were checked before
+        """
+        d_abs_paths = {os.path.abspath(path): path for path in paths}
+        abs_paths = list(d_abs_paths)
+        d_stats = dict()
+        with self.__lock:
+            for start in range(0, len(abs_paths), 500):
+                part = abs_paths[start:start + 500]
+                marks = ','.join('?' * len(part))
+                for path, runs, failures, failed_at in self.__connection.execute(
+                        f'SELECT path, runs, failures, failed_at FROM outcomes WHERE path IN ({marks})', part):
+                    d_stats[d_abs_paths[path]] = (failures / runs if runs else 0.0, failed_at or 0.0)
+        return d_stats
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
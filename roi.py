@@ -0,0 +1,66 @@
+import os
+import re
+import configparser
+from atlas import TemplateAtlas
+
+
+class RoiManifest:
+    """
+    The class finds the region of interest (the area of the screenshot where the template can be) for every template.
+    There are two ways to set the region:
+    1. Name of the template file ends with @x,y,width,height, ex.: ok_button@1200,900,300,100.png
+    2. File roi.ini in the folder of the template, section is the file name of the template:
+        [ok_button.png]
+        x = 1200
+        y = 900
+        width = 300
+        height = 100
+    The file name has priority over roi.ini. Templates without the region are searched on the whole screenshot.
+    """
+
+    manifest_name = 'roi.ini'
+    __name_pattern = re.compile(r'@(\d+),(\d+),(\d+),(\d+)\.\w+$')
+
+    def __init__(self):
+        self.__d_manifests = dict()   # {folder: configparser.ConfigParser or None, ...}
+
+    def __manifest(self, folder: str):
+        if folder not in self.__d_manifests:
+            manifest_path = os.path.join(folder, self.manifest_name)
+            config = None
+            member = TemplateAtlas.member(manifest_path)   # The manifest of a folder packed into an atlas
+            if member is not None and member[0].file_text(member[1]) is not None:
+                config = configparser.ConfigParser()
+                config.read_string(member[0].file_text(member[1]))
+            elif os.path.isfile(manifest_path):
+                config = configparser.ConfigParser()
+                config.read(manifest_path, encoding='utf-8')
+            self.__d_manifests[folder] = config
+        return self.__d_manifests[folder]
+
+    def roi_for(self, tmpl_path: str) -> (int, int, int, int):
+        """
+        :return: tuple (x, y, width, height) or None if the region is not set
+        """
+        folder, filename = os.path.split(tmpl_path)
+        found = self.__name_pattern.search(filename)
+        if found:
+            return tuple(int(value) for value in found.groups())
+
+        config = self.__manifest(folder)
+        if config is None or not config.has_section(filename):
+            return None
+
+        try:
+            section = config[filename]
+            roi = (section.getint('x'), section.getint('y'), section.getint('width'), section.getint('height'))
+        except (TypeError, ValueError):
+            error = f'Region of {filename} in {os.path.join(folder, self.manifest_name)} should be 4 integers: ' \
+                    f'x, y, width, height'
+            raise ValueError(error)
+        if None in roi:
+            error = f'Region of {filename} in {os.path.join(folder, self.manifest_name)} should have x, y, width ' \
+                    f'and height'
+            raise ValueError(error)
+
+        return roi
@@ -0,0 +1,128 @@
+import collections
+import numpy
+
+
+class Screenshot:
+    """
+    One screenshot of ScreenshotStream. The image is decoded on the first access to `image` (or taken from
+    the prefetching thread) and is dropped by release(), so only the screenshots which are checked or prefetched now
+    are in memory.
+    """
+
+    def __init__(self, path: str, decode, future=None):
+        """
+        :param path:   str, path to the screenshot
+        :param decode: callable(str) -> numpy.ndarray, decodes the screenshot to the grayscale image
+        :param future: concurrent.futures.Future, the image which is being decoded in advance, None - decode on demand
+        """
+        self.__path = path
+        self.__decode = decode
+        self.__future = future
+        self.__image = None
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def decoded(self) -> bool:
+        return self.__image is not None
+
+    @property
+    def image(self) -> numpy.ndarray:
+        if self.__image is None:
+            self.__image = self.__future.result() if self.__future is not None else self.__decode(self.__path)
+            self.__future = None
+        return self.__image
+
+    def release(self):
+        if self.__future is not None:
+            self.__future.cancel()
+            self.__future = None
+        self.__image = None
+
+
+class ScreenshotStream:
+    """
+    The class iterates over the screenshots and yields Screenshot objects one at a time. The previous screenshot is
+    released as soon as the next one is taken, so memory does not grow with the number of screenshots. With `decoder`
+    the next screenshots are decoded by its threads while the current one is checked. The decoded screenshots
+    in memory (the current one and the prefetched ones) must fit into `memory_mb`, the size of the next screenshot is
+    estimated by the size of the last decoded one. The current screenshot is always decoded, even if it alone does not
+    fit into the budget.
+    Usage:
+        for screenshot in ScreenshotStream(scr_paths, imread_grayscale, memory_mb=256, decoder=decoder):
+            check(screenshot.path, screenshot.image)
+    """
+
+    default_memory_mb = 256
+
+    def __init__(self, paths, decode, memory_mb=None, decoder=None, needs_image=None):
+        """
+        :param paths:       iterable of str, paths to screenshots, it is read ahead only with `decoder`
+        :param decode:      callable(str) -> numpy.ndarray, decodes the screenshot to the grayscale image, it is called
+                            from the threads of `decoder`
+        :param memory_mb:   int or float, memory budget for decoded screenshots in megabytes, None - default
+        :param decoder:     decoder.PrefetchingDecoder, decodes the next screenshots in advance, None - every
+                            screenshot is decoded on demand
+        :param needs_image: callable(str) -> bool, False - the screenshot is not decoded in advance, because it may
+                            be not needed at all (ex.: all its results are in the result cache), None - always True
+        """
+        memory_mb = memory_mb if memory_mb is not None else self.default_memory_mb
+        if memory_mb <= 0:
+            error = f'memory_mb={memory_mb} but it should be a positive number'
+            raise ValueError(error)
+
+        self.__paths = paths
+        self.__decode = decode
+        self.__budget = int(memory_mb * 1024 * 1024)
+        self.__decoder = decoder
+        self.__needs_image = needs_image
+        self.__image_size = None   # Bytes of the last decoded screenshot
+
+    def __decode_and_measure(self, path: str) -> numpy.ndarray:
+        img = self.__decode(path)
+        self.__image_size = img.nbytes
+        return img
+
+    def __depth(self) -> int:
+        """
+        Returns how many screenshots can be decoded in memory at once, the current one included.
+        """
+        if self.__decoder is None or self.__image_size is None:
+            return 1
+        return max(1, self.__budget // max(1, self.__image_size))
+
+    def __iter__(self):
+        if self.__decoder is None:
+            for path in self.__paths:
+                screenshot = Screenshot(path, self.__decode_and_measure)
+                try:
+                    yield screenshot
+                finally:
+                    screenshot.release()
+            return
+
+        paths = iter(self.__paths)
+        pending = collections.deque()   # Screenshots which are being decoded in advance
+        try:
+            while True:
+                while len(pending) < self.__depth():
+                    path = next(paths, None)
+                    if path is None:
+                        break
+                    future = None
+                    if self.__needs_image is None or self.__needs_image(path):
+                        future = self.__decoder.submit(self.__decode_and_measure, path)
+                    pending.append(Screenshot(path, self.__decode_and_measure, future))
+                if not pending:
+                    break
+
+                screenshot = pending.popleft()
+                try:
+                    yield screenshot
+                finally:
+                    screenshot.release()
+        finally:
+            for screenshot in pending:
+                screenshot.release()
@@ -0,0 +1,319 @@
+# Local matching service: keeps templates in memory and searches them on screenshots sent by client.py
+# Usage: python service.py -t "D:\Templates" [--set launcher="D:\Launcher.atlas"] [--port 8765 | --socket FILE]
+
+import argparse
+import concurrent.futures
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from client import ServiceClient
+from decoder import imread_grayscale, decode_grayscale, PrefetchingDecoder
+from matching import ENGINES, MultiScaleMatcher, make_matcher
+from roi import RoiManifest
+from tmpl_cache import TemplateCache
+
+
+class MatchService:
+    """
+    The class keeps named template sets decoded in memory and searches them on screenshots. Every set is a folder of
+    templates (with subfolders), one template file or an atlas compiled by atlas.py. Screenshots of one request
+    (a batch) are decoded and searched concurrently by the pool of `workers` threads, every thread has its own
+    matcher; OpenCV releases the GIL, so the threads run in parallel.
+    Usage:
+        service = MatchService({'default': 'D:\\Templates'})
+        results = service.match('default', ['D:\\Capture\\1.png'])
+    The results have the format of client.ServiceClient.match().
+    """
+
+    def __init__(self, d_sets: dict, min_threshold=0.6, precision=0.0001, engine='opencv', scales=None, workers=None,
+                 cache_mb=None):
+        """
+        :param d_sets:        dict, {name of the set: path to the folder, template file or atlas, ...}
+        :param min_threshold: float
+        :param precision:     float, thresholds in results are truncated to it
+        :param engine:        str, search engine, one of matching.ENGINES
+        :param scales:        list of float, scales of the multi-scale search, None - only the original scale
+        :param workers:       int, number of threads which search screenshots, None - number of CPUs
+        :param cache_mb:      int or float, memory budget for decoded templates in megabytes, all templates of all
+                              sets should fit into it to stay in memory, None - default
+        """
+        if not d_sets:
+            error = 'There should be at least one template set'
+            raise ValueError(error)
+        if engine not in ENGINES:
+            error = f'engine={engine} but it should be one of: {", ".join(ENGINES)}'
+            raise ValueError(error)
+
+        self.__d_set_roots = dict(d_sets)
+        self.__min_threshold = min_threshold
+        self.__precision = precision
+        self.__engine = engine
+        self.__scales = None if not scales or list(scales) == [1.0] else sorted(set(scales))
+        self.__tmpl_cache = TemplateCache(cache_mb)
+        self.__roi_manifest = RoiManifest()
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                                                thread_name_prefix='matcher')
+        self.__local = threading.local()   # Matcher of every thread of the pool
+        self.__lock = threading.Lock()
+        self.__d_sets = dict()   # {name: [(path, name of the template inside the set), ...], ...}
+        self.reload()
+
+    def reload(self) -> dict:
+        """
+        Lists the templates of all sets again and decodes the new and changed ones.
+        :return: dict, {name of the set: number of templates, ...}
+        """
+        d_sets = {name: TemplateCache.list_templates(root) for name, root in self.__d_set_roots.items()}
+        with PrefetchingDecoder() as decoder:
+            all_paths = [path for templates in d_sets.values() for path, _ in templates]
+            for future in decoder.prefetch(self.__tmpl_cache.get, all_paths):
+                future.result()
+        with self.__lock:
+            self.__d_sets = d_sets
+        return self.sets()
+
+    def sets(self) -> dict:
+        with self.__lock:
+            return {name: len(templates) for name, templates in self.__d_sets.items()}
+
+    def __matcher(self):
+        matcher = getattr(self.__local, 'matcher', None)
+        if matcher is None:
+            matcher = make_matcher(self.__engine, self.__min_threshold, self.__scales)
+            self.__local.matcher = matcher
+        return matcher
+
+    def __round_threshold(self, thr: float) -> float:
+        multiplier = 10 ** (len(str(self.__precision)) - 2)
+        thr = int(thr * multiplier)
+        return thr / multiplier
+
+    def __match_one(self, templates: [(str, str)], scr_name: str, scr_source) -> dict:
+        """
+        :param scr_source: str - path to the screenshot, bytes - content of the image file
+        """
+        started = time.perf_counter()
+        scr_img = imread_grayscale(scr_source) if isinstance(scr_source, str) else decode_grayscale(scr_source)
+        matcher = self.__matcher()
+        d_result = {'screenshot': scr_name, 'with_scale': self.__scales is not None, 'templates': []}
+        try:
+            tmpl_started = time.perf_counter()
+            tmpl_imgs = (self.__tmpl_cache.get(path) for path, _ in templates)
+            rois = [self.__roi_manifest.roi_for(path) for path, _ in templates]
+            for (_, tmpl_name), points in zip(templates, matcher.find_all_many(scr_img, tmpl_imgs, rois)):
+                hits = [[int(pt[0][0]), int(pt[0][1]), self.__round_threshold(float(pt[1]))] +
+                        [float(value) for value in pt[2:]] for pt in sorted(points)]
+                finished = time.perf_counter()
+                d_result['templates'].append({'template': tmpl_name,
+                                              'count': len(hits),
+                                              'hits': hits,
+                                              'time_ms': round((finished - tmpl_started) * 1000, 3)})
+                tmpl_started = finished
+        finally:
+            matcher.release()
+        d_result['time_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return d_result
+
+    def match(self, set_name: str, screenshots: list) -> [dict]:
+        """
+        Searches all templates of the set on the screenshots of the batch concurrently.
+        :param screenshots: list, [path, ...] or [(name, content of the image file), ...]
+        :return: list of results in the order of `screenshots`
+        """
+        with self.__lock:
+            templates = self.__d_sets.get(set_name)
+        if templates is None:
+            error = f'Template set {set_name} not found, there are: {", ".join(self.__d_sets)}'
+            raise KeyError(error)
+
+        futures = [self.__executor.submit(self.__match_one, templates, screenshot, screenshot)
+                   if isinstance(screenshot, str) else self.__executor.submit(self.__match_one, templates, *screenshot)
+                   for screenshot in screenshots]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /health                  - {'status': 'ok', 'sets': {name: number of templates, ...}}
+    POST /reload                  - lists the templates of all sets again, answers like /health
+    POST /match                   - JSON {'set': name, 'screenshots': [path, ...]} or {'set': name, 'screenshot': path}
+    POST /match?set=name&name=... - the body is the content of the image file
+    /match answers {'results': [...]}, errors are answered with {'error': text} and the status 400, 404 or 500.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def __send_json(self, status: int, answer: dict):
+        body = json.dumps(answer, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __handle(self, action):
+        try:
+            self.__send_json(200, action())
+        except KeyError as e:
+            self.__send_json(404, {'error': e.args[0] if e.args else str(e)})
+        except (ValueError, IOError) as e:
+            self.__send_json(400, {'error': str(e)})
+        except Exception as e:
+            self.__send_json(500, {'error': f'{type(e).__name__}: {e}'})
+
+    def __health(self) -> dict:
+        return {'status': 'ok', 'sets': self.server.service.sets()}
+
+    def __match(self) -> dict:
+        url = urllib.parse.urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            request = json.loads(body.decode('utf-8'))
+            if not isinstance(request, dict):
+                error = 'the request should be a JSON object'
+                raise ValueError(error)
+            if 'screenshots' in request:
+                screenshots = request['screenshots']
+                if not isinstance(screenshots, list) or not all(isinstance(path, str) for path in screenshots):
+                    error = 'screenshots should be a list of paths'
+                    raise ValueError(error)
+            elif 'screenshot' in request:
+                screenshots = [request['screenshot']]
+                if not isinstance(screenshots[0], str):
+                    error = 'screenshot should be a path'
+                    raise ValueError(error)
+            else:
+                error = 'the request should have screenshots (a list of paths) or screenshot (a path)'
+                raise ValueError(error)
+            set_name = request.get('set', 'default')
+            if not isinstance(set_name, str):
+                error = 'set should be a name of the template set'
+                raise ValueError(error)
+            return {'results': self.server.service.match(set_name, screenshots)}
+
+        query = dict(urllib.parse.parse_qsl(url.query))
+        return {'results': self.server.service.match(query.get('set', 'default'), [(query.get('name', ''), body)])}
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path == '/health':
+            self.__handle(self.__health)
+        else:
+            self.__send_json(404, {'error': f'{self.path} not found'})
+
+    def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/match':
+            self.__handle(self.__match)
+        elif path == '/reload':
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.__handle(lambda: {'status': 'ok', 'sets': self.server.service.reload()})
+        else:
+            self.__send_json(404, {'error': f'{self.path} not found'})
+
+    def address_string(self) -> str:
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    service = None
+    verbose = False
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+        service = None
+        verbose = False
+
+
+def serve(service: MatchService, host=None, port=None, socket_path=None, verbose=False):
+    """
+    Answers requests until Ctrl+C.
+    :param socket_path: str, path to the Unix socket instead of `host` and `port`
+    """
+    if socket_path:
+        if not hasattr(socket, 'AF_UNIX'):
+            error = 'Unix sockets are not supported on this system, use --port'
+            raise ValueError(error)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = _UnixHTTPServer(socket_path, _RequestHandler)
+        address = socket_path
+    else:
+        server = _HTTPServer((host or ServiceClient.default_host, port or ServiceClient.default_port),
+                             _RequestHandler)
+        address = f'http://{server.server_address[0]}:{server.server_address[1]}'
+    server.service = service
+    server.verbose = verbose
+    print(f'Serving {service.sets()} on {address}, press Ctrl+C to stop', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='-p or --param <value>')
+    parser.add_argument('-t', '--templates', type=str, dest="path_to_tmpls",
+                        help="Folder, template file or atlas of the set named default", default='')
+    parser.add_argument('--set', type=str, dest="sets", action='append', default=[],
+                        help="Named template set: name=path, can be repeated")
+    parser.add_argument('-n', '--min', type=float, dest="min_threshold",
+                        help="Minimum threshold value in range", default=0.6)
+    parser.add_argument('-p', '--precision', type=float, dest="precision",
+                        help="The precision of thresholds in results", default=0.0001)
+    parser.add_argument('-c', '--cache-mb', type=float, dest="cache_mb",
+                        help="Memory budget for decoded templates in megabytes, all templates should fit into it",
+                        default=TemplateCache.default_budget_mb)
+    parser.add_argument('-w', '--workers', type=int, dest="workers",
+                        help="Number of threads which search screenshots, default - number of CPUs", default=None)
+    parser.add_argument('-e', '--engine', type=str, dest="engine", choices=list(ENGINES),
+                        help="Search engine", default='opencv')
+    parser.add_argument('-s', '--scales', type=str, dest="scales",
+                        help="Scales the templates are searched at, ex.: 1,1.25,1.5", default='1')
+    parser.add_argument('--host', type=str, dest="host",
+                        help="Host to listen on, only local connections are accepted by default",
+                        default=ServiceClient.default_host)
+    parser.add_argument('--port', type=int, dest="port",
+                        help="Port to listen on", default=ServiceClient.default_port)
+    parser.add_argument('--socket', type=str, dest="socket_path",
+                        help="Unix socket to listen on instead of the host and port", default='')
+    parser.add_argument('-v', '--verbose', action='store_true', dest="verbose",
+                        help="Print every request")
+    options = parser.parse_args()
+
+    d_sets = dict()
+    if options.path_to_tmpls:
+        d_sets['default'] = options.path_to_tmpls
+    for item in options.sets:
+        name, separator, path = item.partition('=')
+        if not separator or not name or not path:
+            parser.error(f'--set {item} should be name=path')
+        d_sets[name] = path
+    if not d_sets:
+        parser.error('-t or --set is required')
+
+    service = MatchService(d_sets, options.min_threshold, options.precision, options.engine,
+                           MultiScaleMatcher.parse_scales(options.scales), options.workers, options.cache_mb)
+    serve(service, options.host, options.port, options.socket_path, options.verbose)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import os
 import configparser
+from matching import MultiScaleMatcher
 
 
 class BaseSettingsDescriptor:
@@ -35,6 +36,12 @@ class SettingsData:
     default_embedded_folders = BaseSettingsDescriptor(False)
     default_save_txt = BaseSettingsDescriptor(True)
     default_save_to = BaseSettingsDescriptor(os.path.join(os.getcwd(), 'thresholds.txt'))
+    default_cache_mb = BaseSettingsDescriptor(512)
+    default_workers = BaseSettingsDescriptor(1)
+    default_engine = BaseSettingsDescriptor('opencv')
+    default_result_cache = BaseSettingsDescriptor(True)
+    default_timings = BaseSettingsDescriptor(False)
+    default_scales = BaseSettingsDescriptor('1')
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
@@ -48,10 +55,17 @@ class SettingsData:
         self.embedded_folders = SettingsDescriptor(None)
         self.save_txt = SettingsDescriptor(None)
         self.save_to = SettingsDescriptor(None)
+        self.cache_mb = SettingsDescriptor(None)
+        self.workers = SettingsDescriptor(None)
+        self.engine = SettingsDescriptor(None)
+        self.result_cache = SettingsDescriptor(None)
+        self.timings = SettingsDescriptor(None)
+        self.scales = SettingsDescriptor(None)
 
 
 class SettingsUtils:
     _instance = None
+    engines = ('opencv', 'pyramid', 'fft')   # Ключи matching.ENGINES
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
@@ -82,6 +96,26 @@ class SettingsUtils:
         if not os.path.isabs(self.settings.save_to) or any(char in forbidden_symbols for char in self.settings.save_to):
             self.settings.save_to = self.settings.default_save_to
 
+        if not (16 <= int(self.settings.cache_mb) <= 65536):
+            self.settings.cache_mb = self.settings.default_cache_mb
+
+        if not (1 <= int(self.settings.workers) <= 256):
+            self.settings.workers = self.settings.default_workers
+
+        if self.settings.engine not in self.engines:
+            self.settings.engine = self.settings.default_engine
+
+        if not isinstance(self.settings.result_cache, bool):
+            self.settings.result_cache = self.settings.default_result_cache
+
+        if not isinstance(self.settings.timings, bool):
+            self.settings.timings = self.settings.default_timings
+
+        try:
+            MultiScaleMatcher.parse_scales(self.settings.scales)
+        except ValueError:
+            self.settings.scales = self.settings.default_scales
+
     def load_settings(self):
         config = configparser.ConfigParser()
 
@@ -96,6 +130,16 @@ class SettingsUtils:
             self.settings.embedded_folders = config.getboolean('Settings', 'EmbeddedFolders')
             self.settings.save_txt = config.getboolean('Settings', 'SaveTxt')
             self.settings.save_to = config.get('Settings', 'SaveTo')
+            self.settings.cache_mb = config.getint('Settings', 'CacheMB', fallback=self.settings.default_cache_mb)
+            self.settings.workers = config.getint('Settings', 'Workers', fallback=self.settings.default_workers)
+            # Старые файлы настроек хранят только флаг Pyramid
+            pyramid = config.getboolean('Settings', 'Pyramid', fallback=False)
+            self.settings.engine = config.get('Settings', 'Engine',
+                                              fallback='pyramid' if pyramid else self.settings.default_engine)
+            self.settings.result_cache = config.getboolean('Settings', 'ResultCache',
+                                                           fallback=self.settings.default_result_cache)
+            self.settings.timings = config.getboolean('Settings', 'Timings', fallback=self.settings.default_timings)
+            self.settings.scales = config.get('Settings', 'Scales', fallback=self.settings.default_scales)
 
             self.check_settings_on_load()
 
@@ -107,8 +151,15 @@ class SettingsUtils:
             self.settings.embedded_folders = self.settings.default_embedded_folders
             self.settings.save_txt = self.settings.default_save_txt
             self.settings.save_to = self.settings.default_save_to
-
-    def save_settings(self, value1, value2, value3, value4, value5, value6):
+            self.settings.cache_mb = self.settings.default_cache_mb
+            self.settings.workers = self.settings.default_workers
+            self.settings.engine = self.settings.default_engine
+            self.settings.result_cache = self.settings.default_result_cache
+            self.settings.timings = self.settings.default_timings
+            self.settings.scales = self.settings.default_scales
+
+    def save_settings(self, value1, value2, value3, value4, value5, value6, value7, value8, value9, value10,
+                      value11, value12):
         config = configparser.ConfigParser()
 
         self.settings.min_threshold = value1
@@ -117,6 +168,12 @@ class SettingsUtils:
         self.settings.embedded_folders = value4
         self.settings.save_txt = value5
         self.settings.save_to = value6
+        self.settings.cache_mb = value7
+        self.settings.workers = value8
+        self.settings.engine = value9
+        self.settings.result_cache = value10
+        self.settings.timings = value11
+        self.settings.scales = value12
 
         # Устанавливаем значения параметров
         config['Settings'] = {
@@ -126,6 +183,12 @@ class SettingsUtils:
             'EmbeddedFolders': str(self.settings.embedded_folders),
             'SaveTxt': str(self.settings.save_txt),
             'SaveTo': self.settings.save_to,
+            'CacheMB': str(self.settings.cache_mb),
+            'Workers': str(self.settings.workers),
+            'Engine': self.settings.engine,
+            'ResultCache': str(self.settings.result_cache),
+            'Timings': str(self.settings.timings),
+            'Scales': self.settings.scales,
         }
 
         # Сохраняем конфигурацию в файл
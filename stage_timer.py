@@ -0,0 +1,155 @@
+import os
+import json
+import threading
+import time
+
+
+class NullStageTimer:
+    """
+    Timer which records nothing, it is used when the instrumentation is off. Its methods do not even read the clock,
+    so the search is not slowed down.
+    """
+
+    enabled = False
+
+    def start(self) -> float:
+        return 0.0
+
+    def stop(self, stage: str, started: float, tmpl=None, **args):
+        pass
+
+    def name(self, tmpl_img, tmpl_path: str):
+        pass
+
+    def set_screenshot(self, scr_path: str):
+        pass
+
+
+NULL_TIMER = NullStageTimer()
+
+
+class StageTimer(NullStageTimer):
+    """
+    The class records the time of every stage of the search for every (screenshot, template) pair:
+        decode  - decoding of the screenshot or of the template (a template from the cache takes almost no time)
+        resize  - resizing of the screenshot to another scale in the multi-scale search
+        match   - calculation of the correlation map
+        peaks   - non-maximum suppression of the map, `candidates` - number of points before clustering
+        cluster - grouping of the candidates into found occurrences
+        write   - output of the results of the template
+    Matchers do not know the paths of templates, so the engine names every decoded template image with name() after
+    set_screenshot(); the names are forgotten with the next screenshot, so ids of freed images are not kept.
+    The results are available as the summary table and as the trace in Chrome trace-event format (chrome://tracing,
+    https://ui.perfetto.dev). When the search runs in worker processes, only decode and write are recorded.
+    Usage:
+        timer = StageTimer(trace=True)
+        CheckImages(..., timer=timer).run()
+        print(timer.summary())
+        timer.save_trace('trace.json')
+    """
+
+    enabled = True
+    stages = ('decode', 'resize', 'match', 'peaks', 'cluster', 'write')
+
+    def __init__(self, trace=False):
+        """
+        :param trace: bool, keep every event for save_trace(), otherwise only totals are kept
+        """
+        self.__trace = trace
+        self.__origin = time.perf_counter()
+        self.__scr_path = ''
+        self.__d_names = dict()   # {id(template image): path, ...} - templates named for the current screenshot
+        self.__d_pairs = dict()   # {(screenshot, template): {stage: seconds, ..., 'candidates': int}, ...}
+        self.__d_stages = {stage: [0, 0.0, 0.0] for stage in self.stages}   # {stage: [calls, total, max], ...}
+        self.__events = []
+
+    def start(self) -> float:
+        return time.perf_counter()
+
+    def set_screenshot(self, scr_path: str):
+        self.__scr_path = scr_path
+        self.__d_names.clear()
+
+    def name(self, tmpl_img, tmpl_path: str):
+        self.__d_names[id(tmpl_img)] = tmpl_path
+
+    def stop(self, stage: str, started: float, tmpl=None, **args):
+        """
+        Records the stage which started at `started` (value of start()) and finished now.
+        :param tmpl: str - path to the template, numpy.ndarray - template image named by name(), None - the stage
+                     belongs to the whole screenshot
+        :param args: extra values of the stage, ex.: candidates=12
+        """
+        finished = time.perf_counter()
+        duration = finished - started
+        if tmpl is None or isinstance(tmpl, str):
+            tmpl_path = tmpl or ''
+        else:
+            tmpl_path = self.__d_names.get(id(tmpl), '')
+
+        d_pair = self.__d_pairs.setdefault((self.__scr_path, tmpl_path), dict())
+        d_pair[stage] = d_pair.get(stage, 0.0) + duration
+        for key, value in args.items():
+            d_pair[key] = d_pair.get(key, 0) + value
+        totals = self.__d_stages.setdefault(stage, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += duration
+        totals[2] = max(totals[2], duration)
+
+        if self.__trace:
+            self.__events.append({'name': stage,
+                                  'cat': 'search',
+                                  'ph': 'X',
+                                  'ts': round((started - self.__origin) * 1e6, 1),
+                                  'dur': round(duration * 1e6, 1),
+                                  'pid': os.getpid(),
+                                  'tid': threading.get_ident(),
+                                  'args': dict(screenshot=self.__scr_path, template=tmpl_path, **args)})
+
+    @property
+    def totals(self) -> dict:
+        """
+        :return: dict, {stage: seconds, ...}
+        """
+        return {stage: totals[1] for stage, totals in self.__d_stages.items()}
+
+    @property
+    def pairs(self) -> dict:
+        """
+        :return: dict, {(screenshot, template): {stage: seconds, ..., 'candidates': int}, ...}
+        """
+        return self.__d_pairs
+
+    def summary(self, top=10) -> str:
+        """
+        Returns the table with totals of every stage, the slowest screenshots and the `top` slowest pairs.
+        """
+        lines = [f'{"STAGE":<10}|{"CALLS":<8}|{"TOTAL, S":<12}|{"MEAN, MS":<12}|{"MAX, MS":<12}']
+        for stage, (calls, total, maximum) in self.__d_stages.items():
+            if calls:
+                lines.append(f'{stage:<10}|{calls:<8}|{total:<12.4f}|{total / calls * 1000:<12.3f}|'
+                             f'{maximum * 1000:<12.3f}')
+
+        d_screenshots = dict()
+        for (scr_path, _), d_pair in self.__d_pairs.items():
+            d_screenshots[scr_path] = d_screenshots.get(scr_path, 0.0) + sum(
+                d_pair.get(stage, 0.0) for stage in self.__d_stages)
+        scr_indent = max([len(scr_path) for scr_path in d_screenshots] + [10]) + 2
+        lines += ['', f'{"SCREENSHOT":<{scr_indent}}|{"TOTAL, S":<12}']
+        for scr_path, total in sorted(d_screenshots.items(), key=lambda item: -item[1])[:top]:
+            lines.append(f'{scr_path:<{scr_indent}}|{total:<12.4f}')
+
+        pairs = [(sum(d_pair.get(stage, 0.0) for stage in self.__d_stages), key, d_pair)
+                 for key, d_pair in self.__d_pairs.items() if key[1]]
+        pairs.sort(key=lambda item: -item[0])
+        tmpl_indent = max([len(os.path.basename(key[1])) for _, key, _ in pairs[:top]] + [8]) + 2
+        lines += ['', f'{"TEMPLATE":<{tmpl_indent}}|{"TOTAL, MS":<11}|{"MATCH, MS":<11}|{"CANDIDATES":<12}|SCREENSHOT']
+        for total, (scr_path, tmpl_path), d_pair in pairs[:top]:
+            lines.append(f'{os.path.basename(tmpl_path):<{tmpl_indent}}|{total * 1000:<11.3f}|'
+                         f'{d_pair.get("match", 0.0) * 1000:<11.3f}|{d_pair.get("candidates", 0):<12}|{scr_path}')
+
+        return '\n'.join(lines) + '\n'
+
+    def save_trace(self, path: str):
+        with open(path, 'wt', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.__events, 'displayTimeUnit': 'ms'}, f)
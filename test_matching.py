@@ -0,0 +1,156 @@
+import unittest
+import cv2
+import numpy
+from matching import PointClusterer, TemplateMatcher, FFTMatcher, MaskedTemplate
+
+
+def peaks_of(*rows) -> numpy.ndarray:
+    return numpy.array(rows, dtype=numpy.float64)
+
+
+def gaussian_map(shape: (int, int), centres: [(int, int)], peak=0.95, sigma=2.0) -> numpy.ndarray:
+    """
+    Synthetic correlation map: a smooth blob around every centre (x, y) on a flat background.
+    """
+    ys, xs = numpy.mgrid[0:shape[0], 0:shape[1]]
+    searching = numpy.zeros(shape, dtype=numpy.float32)
+    for x, y in centres:
+        blob = peak * numpy.exp(-((xs - x) ** 2 + (ys - y) ** 2) / (2 * sigma ** 2))
+        searching = numpy.maximum(searching, blob.astype(numpy.float32))
+    return searching
+
+
+class PointClustererTest(unittest.TestCase):
+
+    def test_one_best_point_per_cluster(self):
+        peaks = peaks_of((100, 100, 0.81), (102, 101, 0.93), (98, 99, 0.85),
+                         (300, 200, 0.88), (305, 203, 0.90))
+        points = PointClusterer(40, 30).cluster(peaks)
+        self.assertEqual(sorted(points), [((102, 101), 0.93), ((305, 203), 0.90)])
+
+    def test_offset_on_one_axis_is_kept_separate(self):
+        # Same x, y differs by more than the height: two occurrences one under the other
+        vertical = PointClusterer(40, 30).cluster(peaks_of((100, 100, 0.9), (100, 140, 0.85)))
+        self.assertEqual(len(vertical), 2)
+        # Same y, x differs by more than the width: two occurrences side by side
+        horizontal = PointClusterer(40, 30).cluster(peaks_of((100, 100, 0.9), (150, 100, 0.85)))
+        self.assertEqual(len(horizontal), 2)
+
+    def test_near_on_both_axes_is_merged(self):
+        points = PointClusterer(40, 30).cluster(peaks_of((100, 100, 0.9), (139, 129, 0.85)))
+        self.assertEqual(points, [((100, 100), 0.9)])
+
+    def test_doubled_window_for_small_templates(self):
+        self.assertEqual(PointClusterer(18, 18).search_area, (36, 36))
+        self.assertEqual(PointClusterer(19, 19).search_area, (19, 19))
+        self.assertEqual(PointClusterer(18, 19).search_area, (18, 19))
+
+        peaks = peaks_of((100, 100, 0.9), (125, 100, 0.85))   # 25 px apart on x
+        self.assertEqual(len(PointClusterer(18, 18).cluster(peaks)), 1)
+        self.assertEqual(len(PointClusterer(19, 19).cluster(peaks)), 2)
+
+    def test_extra_columns_are_kept(self):
+        peaks = peaks_of((100, 100, 0.9, 1.25), (101, 100, 0.8, 1.0), (400, 100, 0.85, 1.5))
+        points = PointClusterer(40, 30).cluster(peaks)
+        self.assertEqual(sorted(points), [((100, 100), 0.9, 1.25), ((400, 100), 0.85, 1.5)])
+
+    def test_chain_of_points_is_not_over_merged(self):
+        # Every point is near the previous one, but the first and the last ones are two footprints apart
+        peaks = peaks_of(*[(100 + 10 * idx, 100, 0.9 - 0.01 * idx) for idx in range(9)])
+        points = PointClusterer(40, 30).cluster(peaks)
+        self.assertEqual([pt[0] for pt in points], [(100, 100), (140, 100), (180, 100)])
+
+    def test_empty(self):
+        self.assertEqual(PointClusterer(40, 30).cluster(numpy.empty((0, 3))), [])
+
+
+class FindPeaksTest(unittest.TestCase):
+
+    def test_one_peak_per_blob(self):
+        centres = [(50, 40), (200, 40), (50, 150), (320, 220)]
+        searching = gaussian_map((300, 400), centres)
+        peaks = TemplateMatcher.find_peaks(searching, 0.6, (30, 30))
+        points = PointClusterer(30, 30).cluster(peaks)
+        self.assertEqual(sorted(pt[0] for pt in points), sorted(centres))
+
+    def test_plateau_gives_one_occurrence(self):
+        searching = numpy.zeros((100, 100), dtype=numpy.float32)
+        searching[40:44, 60:66] = 0.9   # All points of the plateau are equal maxima
+        peaks = TemplateMatcher.find_peaks(searching, 0.6, (20, 20))
+        self.assertTrue(len(peaks) >= 1)
+        points = PointClusterer(20, 20).cluster(peaks)
+        self.assertEqual(len(points), 1)
+        (x, y), thr = points[0]
+        self.assertTrue(60 <= x < 66 and 40 <= y < 44)
+        self.assertAlmostEqual(thr, 0.9, places=5)
+
+    def test_dense_map(self):
+        # Wide overlapping blobs: over a thousand points are above the threshold, only the maxima are occurrences
+        centres = [(30, 30), (70, 30), (30, 70), (70, 70)]
+        searching = gaussian_map((100, 100), centres, peak=0.95, sigma=12.0)
+        self.assertGreater(numpy.count_nonzero(searching >= 0.6), 1000)
+        peaks = TemplateMatcher.find_peaks(searching, 0.6, (25, 25))
+        points = PointClusterer(25, 25).cluster(peaks)
+        self.assertEqual(sorted(pt[0] for pt in points), sorted(centres))
+
+    def test_below_threshold(self):
+        searching = gaussian_map((100, 100), [(50, 50)], peak=0.5)
+        self.assertEqual(TemplateMatcher.find_peaks(searching, 0.6, (20, 20)).shape, (0, 3))
+
+
+class FFTMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        # Smooth texture with a flat rectangle: windows inside it have no contrast
+        rng = numpy.random.default_rng(0)
+        self.scr_img = cv2.GaussianBlur(rng.integers(0, 256, (400, 700), dtype=numpy.uint8), (5, 5), 0)
+        self.scr_img[50:150, 100:300] = 90
+
+    def assert_like_opencv(self, tmpl_img: numpy.ndarray):
+        expected = cv2.matchTemplate(self.scr_img, tmpl_img, cv2.TM_CCOEFF_NORMED)
+        searching = FFTMatcher(0.8).match_many(self.scr_img, [tmpl_img])[0]
+        self.assertEqual(searching.shape, expected.shape)
+        self.assertLess(float(numpy.abs(searching - expected).max()), 1e-4)
+
+    def test_textured_templates(self):
+        for tmpl_img in (self.scr_img[200:224, 400:424], self.scr_img[150:182, 250:298], self.scr_img[20:320, 50:550],
+                         self.scr_img[:395, :690]):
+            self.assert_like_opencv(tmpl_img.copy())
+
+    def test_flat_windows(self):
+        tmpl_img = self.scr_img[200:224, 400:424].copy()
+        self.assert_like_opencv(tmpl_img)
+        searching = FFTMatcher(0.8).match_many(self.scr_img, [tmpl_img])[0]
+        self.assertTrue((searching[50:127, 100:277] == 0).all())
+
+    def test_flat_template(self):
+        # OpenCV gives 1 everywhere for a template without contrast
+        for size in (24, 32):
+            self.assert_like_opencv(numpy.full((size, size), 90, dtype=numpy.uint8))
+        tmpl_img = numpy.full((24, 24), 90, dtype=numpy.uint8)
+        self.assertEqual(len(FFTMatcher(0.8).find_all(self.scr_img, tmpl_img)),
+                         len(TemplateMatcher(0.8).find_all(self.scr_img, tmpl_img)))
+
+    def test_many_templates_in_order(self):
+        tmpl_imgs = [self.scr_img[200:224, 400:424].copy(), self.scr_img[20:320, 50:550].copy(),
+                     self.scr_img[300:340, 600:630].copy()]
+        expected = [TemplateMatcher(0.8).find_all(self.scr_img, tmpl_img) for tmpl_img in tmpl_imgs]
+        found = list(FFTMatcher(0.8).find_all_many(self.scr_img, tmpl_imgs, [None] * len(tmpl_imgs)))
+        self.assertEqual([[pt[0] for pt in points] for points in found],
+                         [[pt[0] for pt in points] for points in expected])
+
+
+class MaskedTemplateTest(unittest.TestCase):
+
+    def test_flat_template(self):
+        rng = numpy.random.default_rng(0)
+        scr_img = rng.integers(0, 256, (60, 80), dtype=numpy.uint8)
+        mask = numpy.ones((10, 10), dtype=numpy.uint8)
+        mask[:4, :4] = 0   # Not a rectangle, so the template is matched with the mask
+        tmpl_img = MaskedTemplate(numpy.full((10, 10), 90, dtype=numpy.uint8), mask)
+        self.assertIsNone(tmpl_img.opaque_box)
+        self.assertTrue((TemplateMatcher.match(scr_img, tmpl_img) == 1).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
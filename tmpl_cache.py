@@ -0,0 +1,156 @@
+import os
+import threading
+import collections
+import numpy
+from decoder import imread_grayscale_alpha
+from atlas import TemplateAtlas
+from matching import MaskedTemplate
+
+
+class TemplateCache:
+    """
+    The class keeps decoded grayscale templates in memory, so each template file is read and decoded only once, no
+    matter how many screenshots it is searched on. Entries are keyed by path, modification time and size of the file,
+    so a changed file is decoded again. When the total size of decoded images exceeds the memory budget, the least
+    recently used templates are evicted. There is only one cache per process, it is shared by all CheckImages objects.
+    Templates of atlases (virtual paths <file>.atlas/<name>) are not decoded and not stored, they are memory-mapped
+    views of the atlas file. Templates with transparent pixels are stored as matching.MaskedTemplate, so their masks
+    are built once too; for the masked templates of atlases only the mask data is built, the pixels stay in the file.
+    """
+
+    _instance = None
+
+    default_budget_mb = 512
+    extension_list = ['png', 'jpg', 'webp']
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+            cls._instance.__initialized = False
+        return cls._instance
+
+    def __init__(self, budget_mb=None):
+        """
+        :param budget_mb: int or float, memory budget for decoded templates in megabytes, None - keep current budget
+        """
+        if not self.__initialized:
+            self.__lock = threading.Lock()
+            self.__entries = collections.OrderedDict()   # {(path, mtime, size): numpy.ndarray, ...}
+            self.__used = 0
+            self.__budget = int(self.default_budget_mb * 1024 * 1024)
+            self.__hits = 0
+            self.__misses = 0
+            self.__initialized = True
+
+        if budget_mb is not None:
+            self.set_budget(budget_mb)
+
+    @staticmethod
+    def __make_key(path: str) -> (str, int, int):
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+    @classmethod
+    def list_templates(cls, root: str) -> [(str, str)]:
+        """
+        Lists the templates of the folder tree, the template file or the atlas.
+        :return: list, [(path, name with subfolders inside the folder or the atlas), ...]
+        """
+        if TemplateAtlas.is_atlas(root):
+            atlas = TemplateAtlas.open(root)
+            return list(zip(atlas.paths(), atlas.names))
+        if os.path.isfile(root):
+            return [(root, os.path.basename(root))]
+        if not os.path.isdir(root):
+            error = f'{root} not found'
+            raise IOError(error)
+
+        templates = []
+        for folder, dirs, files in os.walk(root):
+            dirs.sort()
+            for file in sorted(files):
+                if file.split('.')[-1].lower() in cls.extension_list:
+                    path = os.path.join(folder, file)
+                    templates.append((path, os.path.relpath(path, root)))
+        return templates
+
+    @staticmethod
+    def decode(path: str) -> numpy.ndarray:
+        member = TemplateAtlas.member(path)
+        if member is not None:
+            atlas, name = member
+            return MaskedTemplate.from_alpha(atlas.image(name), atlas.alpha(name))
+        return MaskedTemplate.from_alpha(*imread_grayscale_alpha(path))
+
+    @staticmethod
+    def __size_of(img: numpy.ndarray) -> int:
+        return img.nbytes_with_mask if MaskedTemplate.is_masked(img) else img.nbytes
+
+    def __evict(self):
+        # The most recently added entry is never evicted, even if it alone does not fit into the budget
+        while self.__used > self.__budget and len(self.__entries) > 1:
+            _, img = self.__entries.popitem(last=False)
+            self.__used -= self.__size_of(img)
+
+    def set_budget(self, budget_mb):
+        if budget_mb < 0:
+            error = f'budget_mb={budget_mb} but it should be a positive number'
+            raise ValueError(error)
+        with self.__lock:
+            self.__budget = int(budget_mb * 1024 * 1024)
+            self.__evict()
+
+    def get(self, path: str) -> numpy.ndarray:
+        """
+        Returns the grayscale image of the template, decodes it only if it is not in the cache yet. The returned array
+        is read-only, because it is shared between all callers.
+        """
+        member = TemplateAtlas.member(path)
+        if member is not None:
+            atlas, name = member
+            if atlas.alpha(name) is None:
+                with self.__lock:
+                    self.__hits += 1
+                return atlas.image(name)
+            key = (os.path.abspath(path),) + self.__make_key(atlas.path)[1:]
+        else:
+            key = self.__make_key(path)
+
+        with self.__lock:
+            img = self.__entries.get(key)
+            if img is not None:
+                self.__entries.move_to_end(key)
+                self.__hits += 1
+                return img
+
+        img = self.decode(path)
+        img.setflags(write=False)
+
+        with self.__lock:
+            self.__misses += 1
+            if key not in self.__entries:
+                self.__entries[key] = img
+                self.__used += self.__size_of(img)
+                self.__evict()
+        return img
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__used = 0
+
+    @property
+    def used_bytes(self):
+        return self.__used
+
+    @property
+    def budget_bytes(self):
+        return self.__budget
+
+    @property
+    def hits(self):
+        return self.__hits
+
+    @property
+    def misses(self):
+        return self.__misses
@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import cv2
+import numpy
+from atlas import TemplateAtlas
+from matching import MaskedTemplate
+
+
+class TemplateIndex:
+    """
+    Persistent index of templates for the deduplication of big template libraries, stored in SQLite database next to
+    the file with thresholds like ResultCache. For every template it keeps the hash of the decoded pixels (and of
+    the mask of transparent pixels) and the perceptual hash dHash: 64 bits, the signs of the differences of
+    the neighbour pixels of the template reduced to 9 x 8. Hashes are calculated again only for the files whose
+    modification time or size has changed, so the index of a big library is rebuilt incrementally.
+    groups() splits the templates into groups which are searched once:
+        exact - the same decoded pixels, ex.: the same icon in several subfolders or in png and webp; the results of
+                the group are the same for all members;
+        near  - also the templates of the same size and mask whose perceptual hashes differ in not more than
+                `max_distance` bits and the mean brightness in not more than `max_mean_diff`, ex.: the icon
+                re-exported with another JPEG quality; the results of the first template of the group are reported for
+                all members, so their thresholds may differ in the last digits from the separate search.
+    """
+
+    default_filename = 'check_images.index.sqlite'
+    modes = ['exact', 'near']
+    max_distance = 3
+    max_mean_diff = 2.0
+
+    def __init__(self, path: str):
+        """
+        :param path: str, path to the database file
+        """
+        self.__path = path
+        self.__lock = threading.Lock()
+        self.__rehashed = 0
+
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.executescript("""
+            CREATE TABLE IF NOT EXISTS templates (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, size INTEGER NOT NULL,
+                                                  height INTEGER NOT NULL, width INTEGER NOT NULL,
+                                                  pixel_hash TEXT NOT NULL, mask_hash TEXT NOT NULL,
+                                                  dhash TEXT NOT NULL, mean REAL NOT NULL);
+        """)
+
+    @classmethod
+    def next_to(cls, thresholds_path: str):
+        """
+        Opens the index in the folder of the file with thresholds.
+        """
+        folder = os.path.dirname(os.path.abspath(thresholds_path))
+        return cls(os.path.join(folder, cls.default_filename))
+
+    @property
+    def rehashed(self) -> int:
+        """
+        :return: int, number of templates hashed by this object, the rest were taken from the index
+        """
+        return self.__rehashed
+
+    @staticmethod
+    def __file_state(path: str) -> (str, int, int):
+        """
+        :return: tuple (absolute path, mtime, size), templates of an atlas have the state of the atlas file
+        """
+        member = TemplateAtlas.member(path)
+        stat = os.stat(member[0].path if member is not None else path)
+        return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def fingerprint(tmpl_img: numpy.ndarray) -> (str, str, str, float):
+        """
+        :return: tuple (hash of the pixels, hash of the mask or '', dHash in hex, mean brightness)
+        """
+        pixels = numpy.ascontiguousarray(tmpl_img)
+        pixel_hash = hashlib.blake2b(pixels.tobytes(), digest_size=16)
+        pixel_hash.update(str(pixels.shape).encode('ascii'))
+        mask_hash = ''
+        if MaskedTemplate.is_masked(tmpl_img):
+            mask_hash = hashlib.blake2b(numpy.ascontiguousarray(tmpl_img.alpha_mask).tobytes(),
+                                        digest_size=16).hexdigest()
+            pixel_hash.update(mask_hash.encode('ascii'))
+
+        small = cv2.resize(numpy.asarray(pixels), (9, 8), interpolation=cv2.INTER_AREA).astype(numpy.int16)
+        dhash = numpy.packbits(small[:, 1:] > small[:, :-1]).tobytes().hex()
+        return pixel_hash.hexdigest(), mask_hash, dhash, float(pixels.mean())
+
+    def update(self, tmpl_paths: [str], decode) -> dict:
+        """
+        Takes the hashes of unchanged templates from the index, hashes the new and changed ones and stores them.
+        :param decode: callable(str) -> numpy.ndarray, decodes the template, ex.: TemplateCache.get
+        :return: dict, {path: (height, width, hash of the pixels, hash of the mask, dHash, mean), ...}
+        """
+        d_states = {tmpl_path: self.__file_state(tmpl_path) for tmpl_path in tmpl_paths}
+        d_stored = dict()
+        abs_paths = list({state[0] for state in d_states.values()})
+        with self.__lock:
+            for start in range(0, len(abs_paths), 500):   # SQLite limits the number of parameters in one query
+                part = abs_paths[start:start + 500]
+                marks = ','.join('?' * len(part))
+                for row in self.__connection.execute(f'SELECT * FROM templates WHERE path IN ({marks})', part):
+                    d_stored[row[0]] = row
+
+        d_records, rows = dict(), []
+        for tmpl_path, (abs_path, mtime, size) in d_states.items():
+            row = d_stored.get(abs_path)
+            if row is None or row[1] != mtime or row[2] != size:
+                tmpl_img = decode(tmpl_path)
+                row = (abs_path, mtime, size) + tuple(tmpl_img.shape[:2]) + self.fingerprint(tmpl_img)
+                d_stored[abs_path] = row
+                rows.append(row)
+            d_records[tmpl_path] = row[3:]
+
+        if rows:
+            with self.__lock, self.__connection:
+                self.__connection.executemany('INSERT OR REPLACE INTO templates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                              rows)
+            self.__rehashed += len(rows)
+        return d_records
+
+    def groups(self, tmpl_paths: [str], decode, mode='exact') -> dict:
+        """
+        Splits the templates into groups of duplicates, the first template of a group in the order of `tmpl_paths`
+        represents it. A near duplicate joins the first group whose representative is close enough, so the members of
+        a group never drift far from the template which is searched.
+        :param decode: callable(str) -> numpy.ndarray, decodes the changed templates, ex.: TemplateCache.get
+        :param mode:   str, 'exact' or 'near'
+        :return: dict, {path: path of the template which is searched instead, ...}, a unique template maps to itself
+        """
+        if mode not in self.modes:
+            error = f'mode={mode} but it should be one of {self.modes}'
+            raise ValueError(error)
+
+        d_records = self.update(tmpl_paths, decode)
+        d_representatives = dict()
+        d_exact = dict()   # {hash of the pixels: representative, ...}
+        d_near = dict()    # {(height, width, hash of the mask): ([representative, ...], [dHash, ...], [mean, ...])}
+        for tmpl_path in tmpl_paths:
+            height, width, pixel_hash, mask_hash, dhash, mean = d_records[tmpl_path]
+            representative = d_exact.get(pixel_hash)
+            if representative is None and mode == 'near':
+                paths, dhashes, means = d_near.setdefault((height, width, mask_hash), ([], [], []))
+                bits = numpy.frombuffer(bytes.fromhex(dhash), dtype=numpy.uint8)
+                if paths:
+                    distances = numpy.unpackbits(numpy.bitwise_xor(numpy.array(dhashes), bits), axis=1).sum(axis=1)
+                    close = numpy.nonzero((distances <= self.max_distance) &
+                                          (numpy.abs(numpy.array(means) - mean) <= self.max_mean_diff))[0]
+                    if len(close):
+                        representative = paths[close[0]]
+                if representative is None:
+                    paths.append(tmpl_path)
+                    dhashes.append(bits)
+                    means.append(mean)
+            if representative is None:
+                representative = tmpl_path
+            d_exact.setdefault(pixel_hash, representative)
+            d_representatives[tmpl_path] = representative
+        return d_representatives
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
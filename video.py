@@ -0,0 +1,175 @@
+import hashlib
+import cv2
+import numpy
+
+
+class VideoFrame:
+    """
+    One frame of VideoFrameStream, it has the same interface as screenshots.Screenshot, so it is checked the same way.
+    `path` is the label of the frame in the results: <video file>@<timestamp>, ex.: D:\\Capture\\1.mp4@00:01:02.480.
+    """
+
+    def __init__(self, video_path: str, index: int, timestamp: float, image: numpy.ndarray, small: numpy.ndarray):
+        """
+        :param video_path: str, path to the video file
+        :param index:      int, number of the frame in the video, from 0
+        :param timestamp:  float, position of the frame in the video in seconds
+        :param image:      numpy.ndarray, grayscale image of the frame
+        :param small:      numpy.ndarray, the frame downsampled by VideoFrameStream.hash_step
+        """
+        self.__path = f'{video_path}@{self.format_timestamp(timestamp)}'
+        self.__index = index
+        self.__timestamp = timestamp
+        self.__image = image
+        self.__small = small
+        self.__hash = hashlib.blake2b(small.tobytes(), digest_size=16).digest()
+
+    @staticmethod
+    def format_timestamp(timestamp: float) -> str:
+        """
+        :return: str, hh:mm:ss.mmm, ex.: 00:01:02.480
+        """
+        milliseconds = int(round(timestamp * 1000))
+        hours, milliseconds = divmod(milliseconds, 3600 * 1000)
+        minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+        seconds, milliseconds = divmod(milliseconds, 1000)
+        return f'{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}'
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def index(self) -> int:
+        return self.__index
+
+    @property
+    def timestamp(self) -> float:
+        return self.__timestamp
+
+    @property
+    def decoded(self) -> bool:
+        return self.__image is not None
+
+    @property
+    def image(self) -> numpy.ndarray:
+        return self.__image
+
+    @property
+    def small(self) -> numpy.ndarray:
+        return self.__small
+
+    @property
+    def content_hash(self) -> bytes:
+        """
+        :return: bytes, hash of the downsampled frame, equal hashes - the frames look the same
+        """
+        return self.__hash
+
+    def changed_rect(self, previous) -> (int, int, int, int):
+        """
+        Compares the downsampled frame with the previous one.
+        :param previous: VideoFrame, the previous checked frame of the same video
+        :return: tuple (x, y, width, height), the region of the full-size frame which has changed, None - nothing has
+                 changed
+        """
+        if previous.content_hash == self.__hash:
+            return None
+        changed = numpy.argwhere(cv2.absdiff(self.__small, previous.small))
+        if not changed.size:
+            return None
+        step_y = self.__image.shape[0] / self.__small.shape[0]
+        step_x = self.__image.shape[1] / self.__small.shape[1]
+        (top, left), (bottom, right) = changed.min(axis=0), changed.max(axis=0) + 1
+        # One cell of margin: a change which averages out in the cell may still touch the pixels of the neighbours
+        x = max(0, int((left - 1) * step_x))
+        y = max(0, int((top - 1) * step_y))
+        return (x, y, min(self.__image.shape[1], int(numpy.ceil((right + 1) * step_x))) - x,
+                min(self.__image.shape[0], int(numpy.ceil((bottom + 1) * step_y))) - y)
+
+    def release(self):
+        self.__image = None
+
+
+class VideoFrameStream:
+    """
+    The class reads the video file frame by frame and yields every `stride`-th frame as a grayscale VideoFrame, so
+    the frames are not exported to image files. Skipped frames are only grabbed, they are not converted. Only the
+    current frame and the next one, which is read by the threads of `decoder` while the current one is checked, are in
+    memory.
+    Usage:
+        for frame in VideoFrameStream('D:\\Capture\\1.mp4', stride=10):
+            check(frame.path, frame.image)
+    """
+
+    extension_list = ['mp4', 'avi', 'mkv', 'mov', 'wmv', 'webm']
+    hash_step = 8   # Frames are downsampled by this factor for the content hash and the comparison
+
+    def __init__(self, path: str, stride=1, decoder=None):
+        """
+        :param path:    str, path to the video file
+        :param stride:  int, every `stride`-th frame is checked, 1 - every frame
+        :param decoder: decoder.PrefetchingDecoder, reads the next frame in advance, None - on demand
+        """
+        if not isinstance(stride, int) or stride < 1:
+            error = f'stride={stride} but it should be a positive integer'
+            raise ValueError(error)
+
+        self.__path = path
+        self.__stride = stride
+        self.__decoder = decoder
+        self.__capture = None
+        self.__fps = 0.0
+        self.__index = -1   # Number of the last grabbed frame
+
+    @classmethod
+    def is_video(cls, path: str) -> bool:
+        return path.split('.')[-1].lower() in cls.extension_list
+
+    def __read_frame(self, first: bool) -> VideoFrame:
+        """
+        Grabs the frames up to the next checked one and decodes it, None - the end of the video.
+        """
+        for _ in range(1 if first else self.__stride):
+            if not self.__capture.grab():
+                return None
+            self.__index += 1
+        ok, img = self.__capture.retrieve()
+        if not ok:
+            return None
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+        timestamp = self.__index / self.__fps if self.__fps > 0 else \
+            self.__capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        small = cv2.resize(img, (max(1, img.shape[1] // self.hash_step), max(1, img.shape[0] // self.hash_step)),
+                           interpolation=cv2.INTER_AREA)
+        return VideoFrame(self.__path, self.__index, timestamp, img, small)
+
+    def __iter__(self):
+        self.__capture = cv2.VideoCapture(self.__path)
+        if not self.__capture.isOpened():
+            error = f'Video {self.__path} can not be read'
+            raise IOError(error)
+        self.__fps = self.__capture.get(cv2.CAP_PROP_FPS)
+        self.__index = -1
+
+        pending = None   # The next frame which is being read in advance
+        try:
+            frame = self.__read_frame(True)
+            while frame is not None:
+                # VideoCapture is not thread-safe, so only one frame is read ahead
+                if self.__decoder is not None:
+                    pending = self.__decoder.submit(self.__read_frame, False)
+                try:
+                    yield frame
+                finally:
+                    frame.release()
+                frame = pending.result() if pending is not None else self.__read_frame(False)
+                pending = None
+        finally:
+            if pending is not None:
+                pending.cancel()
+                if not pending.cancelled():
+                    pending.exception()   # Waits for the reading thread before the capture is released
+            self.__capture.release()
+            self.__capture = None
@@ -0,0 +1,101 @@
+import os
+import queue
+import threading
+
+
+class ScreenshotWatcher:
+    """
+    The class watches the folder for new screenshots in a separate thread and passes their paths to the bounded
+    queue. A file is passed only when its size and modification time have not changed between two checks of
+    the folder, so files which are still being written by the capture tool are not taken. If the queue is full,
+    the watcher waits until there is a free place (backpressure), new files are taken later. Files which were in
+    the folder before the start are skipped. Paths of files removed from the folder are forgotten, so the watcher of
+    a folder which is cleaned up does not grow, and a new file with the name of a removed one is taken again.
+    Usage:
+        with ScreenshotWatcher('D:\\Capture', ['png', 'jpg', 'webp']) as watcher:
+            while True:
+                path = watcher.get()
+    """
+
+    def __init__(self, folder: str, extension_list: [str], poll_interval=0.5, queue_size=8):
+        """
+        :param folder:         str, folder where new screenshots appear
+        :param extension_list: list, extensions of screenshot files, ex.: ['png', 'jpg']
+        :param poll_interval:  float, seconds between checks of the folder
+        :param queue_size:     int, maximum number of screenshots waiting to be processed
+        """
+        if not os.path.isdir(folder):
+            error = f'{folder} not found'
+            raise IOError(error)
+
+        self.__folder = folder
+        self.__extension_list = extension_list
+        self.__poll_interval = poll_interval
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__stop_event = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__seen = set(self.__scan())   # Files which were already in the folder are not processed
+        self.__d_pending = dict()          # {path: (size, mtime), ...} - new files which may be still written
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def __scan(self) -> dict:
+        d_files = dict()   # {path: (size, mtime), ...}
+        with os.scandir(self.__folder) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.split('.')[-1].lower() in self.__extension_list:
+                    stat = entry.stat()
+                    d_files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return d_files
+
+    def __put(self, path: str) -> bool:
+        while not self.__stop_event.is_set():
+            try:
+                self.__queue.put(path, timeout=self.__poll_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __run(self):
+        while not self.__stop_event.wait(self.__poll_interval):
+            d_files = self.__scan()
+            self.__seen.intersection_update(d_files)
+            for path in [path for path in self.__d_pending if path not in d_files]:
+                del self.__d_pending[path]
+            ready = []
+            for path, state in d_files.items():
+                if path in self.__seen:
+                    continue
+                if self.__d_pending.get(path) == state and state[0] > 0:
+                    ready.append((state[1], path))
+                else:
+                    self.__d_pending[path] = state
+
+            for _, path in sorted(ready):   # The oldest screenshots first
+                if not self.__put(path):
+                    return
+                self.__seen.add(path)
+                del self.__d_pending[path]
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        self.__thread.join()
+
+    def get(self, timeout=None) -> str:
+        """
+        Returns the path to the next new screenshot, waits for it if there is no one. Returns None if there is no new
+        screenshot during `timeout` seconds.
+        """
+        try:
+            return self.__queue.get(timeout=timeout)
+        except queue.Empty:
+            return None